@@ -1,8 +1,10 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
+from django.contrib import messages
 from django.utils.safestring import mark_safe
-from .models import CategoriaProblema, RelatoZeladoria, HistoricoStatus, PerfilCidadao
+from .models import CategoriaProblema, RelatoZeladoria, HistoricoStatus, PerfilCidadao, AvisoBroadcast
+from .transicoes import mudar_status
 
 class PerfilCidadaoInline(admin.StackedInline):
     model = PerfilCidadao
@@ -35,13 +37,13 @@ class RelatoZeladoriaAdmin(admin.ModelAdmin):
     list_display = ('id_protocolo', 'prioridade_badge', 'status_badge', 'categoria_com_emoji', 'cidadao', 'criado_em')
     list_filter = ('status_atual', 'prioridade', 'categoria', 'criado_em')
     search_fields = ('id', 'descricao', 'endereco_aproximado', 'cidadao__username', 'cidadao__first_name')
-    readonly_fields = ('criado_em', 'atualizado_em', 'mapa_localizacao_v2', 'justificativa_ia', 'avaliacao_cidadao')
+    readonly_fields = ('criado_em', 'atualizado_em', 'mapa_localizacao_v2', 'justificativa_ia', 'avaliacao_cidadao', 'relato_original')
     inlines = [HistoricoStatusInline]
     list_per_page = 20
 
     fieldsets = (
         ('🔍 Identificação do Chamado', {
-            'fields': (('categoria', 'prioridade'), 'status_atual')
+            'fields': (('categoria', 'prioridade'), 'status_atual', 'relato_original')
         }),
         ('📝 Detalhes do Problema', {
             'fields': ('descricao', 'foto_problema', 'justificativa_ia')
@@ -124,18 +126,56 @@ class RelatoZeladoriaAdmin(admin.ModelAdmin):
     mapa_localizacao_v2.short_description = "Mapa de Precisão"
 
     def save_model(self, request, obj, form, change):
-        if change:
-            old_obj = RelatoZeladoria.objects.get(pk=obj.pk)
-            if old_obj.status_atual != obj.status_atual:
-                HistoricoStatus.objects.create(
-                    relato=obj,
-                    status=obj.status_atual,
-                    observacao_prefeitura=f"Status alterado via Painel Administrativo por {request.user.username}.",
-                    atualizado_por=request.user
-                )
-        super().save_model(request, obj, form, change)
+        # O formulário já sabe se o status mudou: nada de reler o relato do banco
+        if change and 'status_atual' in form.changed_data:
+            mudar_status(
+                obj,
+                obj.status_atual,
+                observacao=f"Status alterado via Painel Administrativo por {request.user.username}.",
+                atualizado_por=request.user,
+                salvar_relato_completo=True,
+            )
+        else:
+            super().save_model(request, obj, form, change)
 
 @admin.register(HistoricoStatus)
 class HistoricoStatusAdmin(admin.ModelAdmin):
     list_display = ('relato', 'status', 'data_atualizacao', 'atualizado_por')
     list_filter = ('status', 'data_atualizacao')
+
+
+@admin.register(AvisoBroadcast)
+class AvisoBroadcastAdmin(admin.ModelAdmin):
+    list_display = ('titulo', 'bairro', 'categoria', 'status', 'total_dispositivos', 'andamento_entregas', 'criado_em')
+    list_filter = ('status', 'categoria')
+    search_fields = ('titulo', 'mensagem', 'bairro')
+    readonly_fields = ('status', 'total_dispositivos', 'andamento_entregas', 'criado_por', 'criado_em', 'disparado_em')
+    actions = ['disparar_avisos']
+
+    def andamento_entregas(self, obj):
+        resumo = obj.resumo_entregas()
+        if not resumo:
+            return "-"
+        return ", ".join(f"{status}: {total}" for status, total in sorted(resumo.items()))
+    andamento_entregas.short_description = "Entregas"
+
+    def save_model(self, request, obj, form, change):
+        if not obj.criado_por_id:
+            obj.criado_por = request.user
+        super().save_model(request, obj, form, change)
+
+    def disparar_avisos(self, request, queryset):
+        from .webpush_service import disparar_aviso_broadcast, PushNaoConfigurado
+        for aviso in queryset:
+            try:
+                total = disparar_aviso_broadcast(aviso)
+            except PushNaoConfigurado as e:
+                self.message_user(request, f"❌ {e}", messages.ERROR)
+                return
+            if total is None:
+                self.message_user(request, f"'{aviso.titulo}' já tinha sido disparado.", messages.WARNING)
+            elif total == 0:
+                self.message_user(request, f"⚠️ '{aviso.titulo}': nenhum dispositivo inscrito no público escolhido.", messages.WARNING)
+            else:
+                self.message_user(request, f"📣 '{aviso.titulo}' enfileirado para {total} dispositivos.", messages.SUCCESS)
+    disparar_avisos.short_description = "📣 Disparar avisos selecionados"
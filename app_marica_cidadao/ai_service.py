@@ -1,6 +1,7 @@
 import sys
 try:
     import google.generativeai as genai
+    from google.api_core import exceptions as erros_google
     HAS_GEMINI = True
 except Exception as e:
     HAS_GEMINI = False
@@ -10,13 +11,201 @@ from django.conf import settings
 from decouple import config
 import PIL.Image
 import json
+import time
+import threading
+from collections import deque
 
 # Configuração da API Key
 GEMINI_API_KEY = config('GEMINI_API_KEY', default='')
 
+# Nomes de modelos em ordem de preferência
+MODELOS_PREFERIDOS = [
+    'models/gemini-1.5-flash',
+    'models/gemini-1.5-flash-latest',
+    'models/gemini-2.5-flash', # Encontrado no log do servidor
+    'gemini-1.5-flash',
+    'gemini-pro-vision'
+]
+
+# Cliente e modelo resolvidos uma vez por processo (compartilhados pelas threads da triagem)
+_lock_modelo = threading.Lock()
+_cliente_configurado = False
+_modelo = None
+_nome_modelo = None
+_consultar_disponiveis = False
+
+
+def obter_modelo():
+    """
+    Retorna (modelo, nome). Na primeira chamada configura o cliente e escolhe o
+    primeiro modelo da lista de preferência; depois reaproveita o mesmo objeto.
+    Se o modelo escolhido falhou (descartar_modelo), a próxima resolução pergunta
+    à API quais modelos existem para esta chave antes de escolher.
+    """
+    global _cliente_configurado, _modelo, _nome_modelo, _consultar_disponiveis
+    with _lock_modelo:
+        if _modelo is not None:
+            return _modelo, _nome_modelo
+
+        if not _cliente_configurado:
+            genai.configure(api_key=GEMINI_API_KEY)
+            _cliente_configurado = True
+
+        candidatos = MODELOS_PREFERIDOS
+        if _consultar_disponiveis:
+            try:
+                disponiveis = {m.name for m in genai.list_models(
+                    request_options={'timeout': getattr(settings, 'IA_TEMPO_LIMITE_SEGUNDOS', 15)}
+                )}
+                print(f"Modelos disponíveis para esta chave: {sorted(disponiveis)}")
+                candidatos = [
+                    nome for nome in MODELOS_PREFERIDOS
+                    if nome in disponiveis or f'models/{nome}' in disponiveis
+                ] or MODELOS_PREFERIDOS
+            except Exception as e:
+                print(f"Não foi possível listar os modelos da API: {e}")
+
+        for nome in candidatos:
+            try:
+                # O teste real só acontece no generate_content
+                _modelo = genai.GenerativeModel(nome)
+                _nome_modelo = nome
+                _consultar_disponiveis = False
+                print(f"Modelo Gemini escolhido: {nome}")
+                break
+            except Exception:
+                continue
+
+        return _modelo, _nome_modelo
+
+
+def descartar_modelo(nome):
+    """
+    Esquece o modelo que falhou para que a próxima análise resolva de novo.
+    """
+    global _modelo, _nome_modelo, _consultar_disponiveis
+    with _lock_modelo:
+        if _nome_modelo == nome:
+            _modelo = None
+            _nome_modelo = None
+            _consultar_disponiveis = True
+
+
+class DisjuntorIA:
+    """
+    Circuit breaker da chamada ao Gemini (um por processo). Depois de
+    IA_DISJUNTOR_FALHAS falhas seguidas fica aberto por IA_DISJUNTOR_SEGUNDOS e as
+    análises respondem na hora, sem chamar a API. Passado esse tempo, uma única
+    chamada de teste é liberada: se der certo o disjuntor fecha, se falhar reabre.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.falhas = 0
+        self.aberto_ate = 0.0
+        self.testando = False
+        self.rejeitadas = 0
+
+    def limite_falhas(self):
+        return getattr(settings, 'IA_DISJUNTOR_FALHAS', 5)
+
+    def permitir(self):
+        with self.lock:
+            if self.falhas < self.limite_falhas():
+                return True
+            if time.monotonic() >= self.aberto_ate and not self.testando:
+                self.testando = True
+                return True
+            self.rejeitadas += 1
+            return False
+
+    def registrar_sucesso(self):
+        with self.lock:
+            self.falhas = 0
+            self.testando = False
+
+    def registrar_falha(self):
+        with self.lock:
+            self.falhas += 1
+            self.testando = False
+            if self.falhas >= self.limite_falhas():
+                self.aberto_ate = time.monotonic() + getattr(settings, 'IA_DISJUNTOR_SEGUNDOS', 60)
+
+    def estado(self):
+        with self.lock:
+            if self.falhas < self.limite_falhas():
+                return 'fechado'
+            return 'meio_aberto' if time.monotonic() >= self.aberto_ate else 'aberto'
+
+    def segundos_para_reabrir(self):
+        with self.lock:
+            return max(0.0, self.aberto_ate - time.monotonic())
+
+
+disjuntor = DisjuntorIA()
+
+# Últimas chamadas ao modelo: (duração em ms, sucesso)
+metricas_chamadas = deque(maxlen=500)
+
+
+def percentil(valores, fracao):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(fracao * (len(ordenados) - 1))))]
+
+
+def resumo_metricas_ia():
+    """
+    Latência p50/p95 e taxa de erro das últimas chamadas ao Gemini, mais o estado do disjuntor.
+    """
+    chamadas = list(metricas_chamadas)
+    duracoes = [duracao for duracao, _ in chamadas]
+    erros = sum(1 for _, sucesso in chamadas if not sucesso)
+    return {
+        'amostras': len(chamadas),
+        'p50_ms': round(percentil(duracoes, 0.5), 1) if duracoes else None,
+        'p95_ms': round(percentil(duracoes, 0.95), 1) if duracoes else None,
+        'taxa_erro': round(erros / len(chamadas), 3) if chamadas else None,
+        'disjuntor': disjuntor.estado(),
+        'disjuntor_reabre_em_s': round(disjuntor.segundos_para_reabrir(), 1),
+        'rejeitadas_pelo_disjuntor': disjuntor.rejeitadas,
+        'modelo': _nome_modelo,
+    }
+
+
+PROMPT_TRIAGEM = """
+    Você é um especialista em zeladoria urbana da Prefeitura de Maricá.
+    Analise a imagem e identifique qual categoria de problema de infraestrutura ela representa.
+    As categorias possíveis (e seus IDs) são:
+    1: Buraco na via
+    2: Lâmpada Queimada
+    3: Foco de Dengue
+    4: Lixo Acumulado
+    5: Vazamento de Água
+    6: Outros (Para qualquer outro problema como árvore caída, poda, calçada quebrada, etc)
+
+    Instruções:
+    - Se o problema for claramente um dos itens de 1 a 5, use esse ID.
+    - Se o problema for de infraestrutura urbana mas não se encaixar de 1 a 5, use o ID 6 (Outros).
+    - Se não for um problema de zeladoria urbana, retorne "categoria_id": null.
+
+    ESTIMATIVA DE PRIORIDADE:
+    - "alta": Risco iminente à vida, obstrução total de vias principais, grandes vazamentos, focos críticos de doenças.
+    - "media": Problemas que afetam a mobilidade ou segurança mas não são urgentes (ex: buraco em rua residencial, lâmpada queimada em local movimentado).
+    - "baixa": Problemas estéticos, lixo pequeno, ou situações que não oferecem risco imediato.
+
+    Responda APENAS em formato JSON com os seguintes campos:
+    - "categoria_id": (ID numérico ou null)
+    - "prioridade": ("baixa", "media" ou "alta")
+    - "confianca": (0 a 100)
+    - "justificativa": (Breve explicação técnica do que viu na foto e por que escolheu essa prioridade em português)
+    """
+
+
 def analisar_imagem_problema(image_path):
     """
     Usa o modelo Gemini 1.5 Flash para analisar a imagem e sugerir uma categoria.
+    image_path pode ser um caminho ou um arquivo em memória (qualquer coisa aceita pelo PIL).
+    Cada chamada tem no máximo IA_TEMPO_LIMITE_SEGUNDOS; com o disjuntor aberto a
+    resposta de erro (com "indisponivel": true) é imediata.
     """
     if not HAS_GEMINI:
         return {"error": "Biblioteca Gemini não carregou. Verifique 'pip install google-generativeai'"}
@@ -25,64 +214,51 @@ def analisar_imagem_problema(image_path):
         return {"error": "API Key do Gemini não configurada no .env"}
 
     try:
-        print(f"Iniciando análise de imagem com Gemini: {image_path}")
-        genai.configure(api_key=GEMINI_API_KEY)
-        
-        # Testar nomes de modelos em ordem de preferência
-        modelos_para_testar = [
-            'models/gemini-1.5-flash',
-            'models/gemini-1.5-flash-latest',
-            'models/gemini-2.5-flash', # Encontrado no log do servidor
-            'gemini-1.5-flash',
-            'gemini-pro-vision'
-        ]
-        
-        model = None
-        for name in modelos_para_testar:
-            try:
-                print(f"Tentando modelo: {name}...")
-                model = genai.GenerativeModel(name)
-                # O teste real só acontece no generate_content
-                break
-            except:
-                continue
+        img = PIL.Image.open(image_path)
+    except Exception as e:
+        return {"error": f"Imagem inválida: {e}"}
 
+    if not disjuntor.permitir():
+        return {
+            "error": "Serviço de IA indisponível no momento. Selecione a categoria manualmente.",
+            "indisponivel": True,
+        }
+
+    nome_modelo = None
+    inicio = time.perf_counter()
+    try:
+        print(f"Iniciando análise de imagem com Gemini: {image_path}")
+        model, nome_modelo = obter_modelo()
         if not model:
-            return {"error": "Nenhum modelo Gemini disponível para esta chave."}
+            raise RuntimeError("Nenhum modelo Gemini disponível para esta chave.")
 
-        img = PIL.Image.open(image_path)
-        
-        prompt = """
-        Você é um especialista em zeladoria urbana da Prefeitura de Maricá.
-        Analise a imagem e identifique qual categoria de problema de infraestrutura ela representa.
-        As categorias possíveis (e seus IDs) são:
-        1: Buraco na via
-        2: Lâmpada Queimada
-        3: Foco de Dengue
-        4: Lixo Acumulado
-        5: Vazamento de Água
-        6: Outros (Para qualquer outro problema como árvore caída, poda, calçada quebrada, etc)
-
-        Instruções:
-        - Se o problema for claramente um dos itens de 1 a 5, use esse ID.
-        - Se o problema for de infraestrutura urbana mas não se encaixar de 1 a 5, use o ID 6 (Outros).
-        - Se não for um problema de zeladoria urbana, retorne "categoria_id": null.
-
-        ESTIMATIVA DE PRIORIDADE:
-        - "alta": Risco iminente à vida, obstrução total de vias principais, grandes vazamentos, focos críticos de doenças.
-        - "media": Problemas que afetam a mobilidade ou segurança mas não são urgentes (ex: buraco em rua residencial, lâmpada queimada em local movimentado).
-        - "baixa": Problemas estéticos, lixo pequeno, ou situações que não oferecem risco imediato.
-
-        Responda APENAS em formato JSON com os seguintes campos:
-        - "categoria_id": (ID numérico ou null)
-        - "prioridade": ("baixa", "media" ou "alta")
-        - "confianca": (0 a 100)
-        - "justificativa": (Breve explicação técnica do que viu na foto e por que escolheu essa prioridade em português)
-        """
-
-        response = model.generate_content([prompt, img])
+        response = model.generate_content(
+            [PROMPT_TRIAGEM, img],
+            request_options={'timeout': getattr(settings, 'IA_TEMPO_LIMITE_SEGUNDOS', 15)}
+        )
+    except erros_google.InvalidArgument as e:
+        # A API respondeu e recusou o pedido (imagem que o modelo não aceita): erro da
+        # entrada, não do serviço nem do modelo. Não conta para o disjuntor.
+        metricas_chamadas.append(((time.perf_counter() - inicio) * 1000, True))
+        disjuntor.registrar_sucesso()
+        print(f"Gemini recusou a imagem ({nome_modelo}): {e}")
+        return {"error": f"Imagem inválida: {e}", "entrada_invalida": True}
+    except Exception as e:
+        metricas_chamadas.append(((time.perf_counter() - inicio) * 1000, False))
+        disjuntor.registrar_falha()
+        # Só erros do próprio modelo (removido, sem acesso) justificam escolher outro;
+        # timeout e indisponibilidade ficam a cargo do disjuntor
+        if nome_modelo and isinstance(e, (erros_google.NotFound, erros_google.PermissionDenied)):
+            descartar_modelo(nome_modelo)
+        print(f"Erro ao chamar Gemini ({nome_modelo}): {e}")
+        return {"error": str(e)}
+
+    metricas_chamadas.append(((time.perf_counter() - inicio) * 1000, True))
+    disjuntor.registrar_sucesso()
+
+    try:
         text_response = response.text.strip()
-        
+
         # Limpa a resposta para garantir que seja um JSON válido
         if "```json" in text_response:
             text_response = text_response.split("```json")[1].split("```")[0].strip()
@@ -93,10 +269,29 @@ def analisar_imagem_problema(image_path):
         return json.loads(text_response)
 
     except Exception as e:
-        print(f"Erro ao chamar Gemini: {e}")
-        try:
-            available_models = [m.name for m in genai.list_models()]
-            print(f"Modelos disponíveis para esta chave: {available_models}")
-        except:
-            print("Não foi possível listar os modelos da API.")
+        print(f"Resposta inválida do Gemini ({nome_modelo}): {e}")
         return {"error": str(e)}
+
+
+def analisar_imagem_stub(image_path):
+    """
+    Modelo local para testes e desenvolvimento (IA_BACKEND=stub). Não chama a API:
+    confere que a imagem abre e devolve uma resposta no mesmo formato do Gemini.
+    IA_STUB_ATRASO_SEGUNDOS simula a latência do modelo remoto.
+    """
+    atraso = getattr(settings, 'IA_STUB_ATRASO_SEGUNDOS', 0)
+    if atraso:
+        time.sleep(atraso)
+
+    try:
+        img = PIL.Image.open(image_path)
+        largura, altura = img.size
+    except Exception as e:
+        return {"error": f"Imagem inválida: {e}"}
+
+    return {
+        "categoria_id": 6,
+        "prioridade": "baixa",
+        "confianca": 50,
+        "justificativa": f"Análise simulada (imagem {largura}x{altura}).",
+    }
@@ -0,0 +1,209 @@
+"""
+Motor único de estatísticas do dashboard.
+Usado pelo index do admin (template tag), pela view do Dashboard Premium e por utils.get_dashboard_stats.
+"""
+import json
+import time
+import hashlib
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, time as dtime, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum, Q, Count
+from django.db.models.functions import Round
+from django.utils import timezone
+from .models import RelatoZeladoria, EstatisticaDiaria, VersaoDados
+
+# Contador em VersaoDados cujo valor entra no nome de todas as entradas do
+# dashboard em cache. Fica no banco, então uma escrita atendida por um worker
+# invalida o cache de todos (mesmo com o LocMemCache, que é por processo).
+CHAVE_VERSAO_DASHBOARD = 'dashboard'
+
+# Últimas medições de tempo (uma por cálculo real, sem contar acertos de cache)
+historico_tempos = deque(maxlen=200)
+
+
+def invalidar_cache_dashboard():
+    """
+    Chamado pelos signals de RelatoZeladoria.
+    """
+    VersaoDados.incrementar(CHAVE_VERSAO_DASHBOARD)
+
+
+def cache_dashboard(nome, calcular):
+    """
+    Devolve o valor em cache para 'nome' na versão atual dos dados ou calcula e guarda.
+    """
+    versao, _ = VersaoDados.obter(CHAVE_VERSAO_DASHBOARD)
+
+    # Bairros têm acentos e espaços; o hash deixa a chave válida em qualquer backend
+    chave = f"dashboard:{versao}:{hashlib.md5(nome.encode('utf-8')).hexdigest()}"
+    valor = cache.get(chave)
+    if valor is None:
+        valor = calcular()
+        cache.set(chave, valor, getattr(settings, 'DASHBOARD_CACHE_SEGUNDOS', 300))
+    return valor
+
+
+@contextmanager
+def medir(tempos, nome):
+    """
+    Acumula em tempos[nome] a duração (ms) do bloco.
+    """
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        tempos[nome] = round(tempos.get(nome, 0) + (time.perf_counter() - inicio) * 1000, 2)
+
+
+def filtros_da_requisicao(params):
+    """
+    Lê bairro, data_inicio, data_fim (AAAA-MM-DD) e categoria (id) dos parâmetros GET.
+    Valores inválidos são ignorados.
+    """
+    filtros = {'bairro': params.get('bairro', '') or None}
+    for nome in ('data_inicio', 'data_fim'):
+        try:
+            filtros[nome] = datetime.strptime(params.get(nome, ''), '%Y-%m-%d').date()
+        except ValueError:
+            filtros[nome] = None
+    try:
+        filtros['categoria'] = int(params.get('categoria', ''))
+    except ValueError:
+        filtros['categoria'] = None
+    return filtros
+
+
+def obter_estatisticas(bairro=None, data_inicio=None, data_fim=None, categoria=None):
+    """
+    Estatísticas do dashboard com cache por combinação de filtros.
+    """
+    nome = f'stats:{bairro or ""}:{data_inicio or ""}:{data_fim or ""}:{categoria or ""}'
+    return cache_dashboard(
+        nome,
+        lambda: calcular_estatisticas(bairro, data_inicio, data_fim, categoria)
+    )
+
+
+def calcular_estatisticas(bairro=None, data_inicio=None, data_fim=None, categoria=None):
+    """
+    Calcula as estatísticas sem passar pelo cache.
+    Os totais vêm da tabela materializada EstatisticaDiaria, cujo tamanho depende
+    do número de dias/categorias/bairros e não do volume de relatos.
+    O tempo de cada consulta é devolvido em 'tempos_consultas' e guardado em historico_tempos.
+    """
+    tempos = {}
+    estatisticas = EstatisticaDiaria.objects.filter(total__gt=0)
+
+    if bairro:
+        estatisticas = estatisticas.filter(bairro=bairro)
+    if categoria:
+        estatisticas = estatisticas.filter(categoria_id=categoria)
+    if data_inicio:
+        estatisticas = estatisticas.filter(data__gte=data_inicio)
+    if data_fim:
+        estatisticas = estatisticas.filter(data__lte=data_fim)
+
+    # 1. Status, categoria e KPIs em uma única consulta com agregação condicional:
+    # uma linha por categoria, com uma coluna de soma para cada status conhecido
+    codigos_status = [codigo for codigo, _ in RelatoZeladoria.STATUS_CHOICES]
+    with medir(tempos, 'kpis_status_categoria'):
+        por_categoria = list(estatisticas.values('categoria__nome').annotate(
+            total_categoria=Sum('total'),
+            **{f'status_{codigo}': Sum('total', filter=Q(status=codigo)) for codigo in codigos_status}
+        ).order_by('-total_categoria'))
+
+    totais_status = {
+        codigo: sum(linha[f'status_{codigo}'] or 0 for linha in por_categoria)
+        for codigo in codigos_status
+    }
+
+    # 2. Evolução diária (sem data_inicio, os 30 dias até data_fim ou até hoje)
+    evolucao = estatisticas
+    if not data_inicio:
+        evolucao = evolucao.filter(data__gte=(data_fim or timezone.localdate()) - timedelta(days=30))
+    with medir(tempos, 'evolucao'):
+        evolucao_stats = list(evolucao.values('data').annotate(
+            total_dia=Sum('total')
+        ).order_by('data'))
+
+    # 3. Bairros para o filtro
+    with medir(tempos, 'bairros'):
+        bairros_disponiveis = list(
+            EstatisticaDiaria.objects.filter(total__gt=0).exclude(bairro='')
+            .values_list('bairro', flat=True).distinct().order_by('bairro')
+        )
+
+    historico_tempos.append({'momento': timezone.now().isoformat(), 'tempos': tempos})
+
+    return {
+        'status_stats_json': json.dumps([
+            {'status_atual': codigo, 'total': total}
+            for codigo, total in totais_status.items() if total
+        ]),
+        'categoria_stats_json': json.dumps([
+            {'categoria__nome': linha['categoria__nome'], 'total': linha['total_categoria']}
+            for linha in por_categoria
+        ]),
+        'evolucao_stats_json': json.dumps([
+            {'data': item['data'].strftime('%d/%m'), 'total': item['total_dia']}
+            for item in evolucao_stats
+        ]),
+        'total_relatos': sum(totais_status.values()),
+        'resolvidos': totais_status['resolvido'],
+        'pendentes': totais_status['recebido'],
+        'em_andamento': sum(totais_status[codigo] for codigo in RelatoZeladoria.STATUS_EM_ANDAMENTO),
+        'bairros_disponiveis': bairros_disponiveis,
+        'bairro_selecionado': bairro or '',
+        'tempos_consultas': tempos,
+    }
+
+
+def consulta_heatmap(bairro=None, data_inicio=None, data_fim=None, categoria=None, casas_decimais=4):
+    """
+    Coordenadas arredondadas para 'casas_decimais' e agrupadas no banco:
+    cada linha é (latitude, longitude, peso), onde peso é a quantidade de relatos na célula.
+    """
+    relatos = RelatoZeladoria.objects.filter(geohash__isnull=False)
+    if bairro:
+        relatos = relatos.filter(bairro=bairro)
+    if categoria:
+        relatos = relatos.filter(categoria_id=categoria)
+    if data_inicio:
+        relatos = relatos.filter(criado_em__gte=timezone.make_aware(datetime.combine(data_inicio, dtime.min)))
+    if data_fim:
+        relatos = relatos.filter(criado_em__lt=timezone.make_aware(datetime.combine(data_fim + timedelta(days=1), dtime.min)))
+
+    return relatos.annotate(
+        lat=Round('latitude', casas_decimais),
+        lng=Round('longitude', casas_decimais),
+    ).values_list('lat', 'lng').annotate(
+        peso=Count('id')
+    ).order_by()
+
+
+def pontos_heatmap(**filtros):
+    """
+    Linhas de consulta_heatmap como iterador, para serem transmitidas sem carregar tudo em memória.
+    """
+    return consulta_heatmap(**filtros).iterator(chunk_size=2000)
+
+
+def resumo_tempos():
+    """
+    Média e máximo (ms) de cada consulta nas últimas medições.
+    """
+    por_consulta = {}
+    for medicao in historico_tempos:
+        for nome, ms in medicao['tempos'].items():
+            por_consulta.setdefault(nome, []).append(ms)
+    return {
+        'amostras': len(historico_tempos),
+        'consultas': {
+            nome: {'media_ms': round(sum(valores) / len(valores), 2), 'max_ms': max(valores)}
+            for nome, valores in por_consulta.items()
+        },
+        'ultima': historico_tempos[-1] if historico_tempos else None,
+    }
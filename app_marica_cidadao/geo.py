@@ -0,0 +1,167 @@
+import math
+from django.db.models import Q
+
+# Alfabeto base32 padrão do geohash (sem a, i, l, o)
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Precisão gravada em RelatoZeladoria.geohash (9 caracteres ~ 4,8 m x 4,8 m)
+PRECISAO_GEOHASH = 9
+
+# Quantidade máxima de células usadas para cobrir um bbox em uma consulta
+MAX_CELULAS_BBOX = 16
+
+RAIO_TERRA_METROS = 6371000
+
+
+def codificar_geohash(latitude, longitude, precisao=PRECISAO_GEOHASH):
+    """
+    Converte uma coordenada em geohash. Pontos próximos compartilham o mesmo
+    prefixo, o que permite buscar uma área com um simples intervalo no índice.
+    """
+    lat_min, lat_max = -90.0, 90.0
+    lng_min, lng_max = -180.0, 180.0
+    geohash = []
+    bits, bit_atual, usar_longitude = 0, 0, True
+
+    while len(geohash) < precisao:
+        if usar_longitude:
+            meio = (lng_min + lng_max) / 2
+            if longitude >= meio:
+                bit_atual = (bit_atual << 1) | 1
+                lng_min = meio
+            else:
+                bit_atual <<= 1
+                lng_max = meio
+        else:
+            meio = (lat_min + lat_max) / 2
+            if latitude >= meio:
+                bit_atual = (bit_atual << 1) | 1
+                lat_min = meio
+            else:
+                bit_atual <<= 1
+                lat_max = meio
+        usar_longitude = not usar_longitude
+        bits += 1
+        if bits == 5:
+            geohash.append(BASE32[bit_atual])
+            bits, bit_atual = 0, 0
+
+    return ''.join(geohash)
+
+
+def tamanho_celula(precisao):
+    """
+    Retorna (altura, largura) em graus de uma célula geohash com a precisão dada.
+    """
+    total_bits = precisao * 5
+    bits_longitude = (total_bits + 1) // 2
+    bits_latitude = total_bits // 2
+    return 180.0 / (2 ** bits_latitude), 360.0 / (2 ** bits_longitude)
+
+
+def geohashes_cobrindo_bbox(oeste, sul, leste, norte, max_celulas=MAX_CELULAS_BBOX):
+    """
+    Lista os geohashes que cobrem o retângulo, usando a maior precisão que
+    ainda cabe em 'max_celulas' células.
+    """
+    melhor = None
+    for precisao in range(1, PRECISAO_GEOHASH + 1):
+        altura, largura = tamanho_celula(precisao)
+        linhas = math.floor(norte / altura) - math.floor(sul / altura) + 1
+        colunas = math.floor(leste / largura) - math.floor(oeste / largura) + 1
+        if linhas * colunas > max_celulas:
+            break
+        melhor = precisao
+
+    if melhor is None:
+        # A área é maior que o mundo dividido em 'max_celulas'; não há ganho em filtrar
+        return []
+
+    altura, largura = tamanho_celula(melhor)
+    celulas = set()
+    lat = (math.floor(sul / altura) + 0.5) * altura
+    while lat <= norte + altura / 2:
+        lng = (math.floor(oeste / largura) + 0.5) * largura
+        while lng <= leste + largura / 2:
+            celulas.add(codificar_geohash(
+                max(-90.0, min(90.0, lat)),
+                max(-180.0, min(180.0, lng)),
+                melhor
+            ))
+            lng += largura
+        lat += altura
+    return sorted(celulas)
+
+
+def proximo_prefixo(prefixo):
+    """
+    Menor geohash que vem depois de todos os que começam com 'prefixo'
+    (último caractere trocado pelo seguinte no alfabeto, com "vai um" no 'z').
+    Como só usa caracteres do próprio alfabeto, a ordem vale em qualquer collation
+    (C, en_US.UTF-8, ICU). Retorna None se não houver limite ('zzz...').
+    """
+    prefixo = prefixo.rstrip(BASE32[-1])
+    if not prefixo:
+        return None
+    return prefixo[:-1] + BASE32[BASE32.index(prefixo[-1]) + 1]
+
+
+def filtro_bbox(oeste, sul, leste, norte, campo='geohash'):
+    """
+    Q para filtrar um queryset pelo retângulo informado.
+    Os prefixos geohash viram intervalos (>= prefixo e < proximo_prefixo),
+    que usam o índice tanto no SQLite quanto no PostgreSQL. A comparação exata
+    com latitude/longitude elimina as bordas das células.
+    """
+    filtro = Q(
+        latitude__gte=sul, latitude__lte=norte,
+        longitude__gte=oeste, longitude__lte=leste,
+    )
+    prefixos = geohashes_cobrindo_bbox(oeste, sul, leste, norte)
+    if prefixos:
+        por_celula = Q()
+        for prefixo in prefixos:
+            intervalo = Q(**{f'{campo}__gte': prefixo})
+            limite = proximo_prefixo(prefixo)
+            if limite is not None:
+                intervalo &= Q(**{f'{campo}__lt': limite})
+            por_celula |= intervalo
+        filtro &= por_celula
+    return filtro
+
+
+def bbox_ao_redor(latitude, longitude, raio_metros):
+    """
+    Retângulo (oeste, sul, leste, norte) que contém o círculo de raio informado.
+    """
+    delta_lat = math.degrees(raio_metros / RAIO_TERRA_METROS)
+    cos_lat = max(math.cos(math.radians(latitude)), 1e-6)
+    delta_lng = math.degrees(raio_metros / (RAIO_TERRA_METROS * cos_lat))
+    return longitude - delta_lng, latitude - delta_lat, longitude + delta_lng, latitude + delta_lat
+
+
+def distancia_metros(lat1, lng1, lat2, lng2):
+    """
+    Distância (haversine) entre dois pontos, em metros.
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = math.radians(lat2 - lat1)
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * RAIO_TERRA_METROS * math.asin(math.sqrt(a))
+
+
+def relatos_no_raio(queryset, latitude, longitude, raio_metros):
+    """
+    Retorna [(relato, distancia_em_metros), ...] dos relatos do queryset que
+    estão a até 'raio_metros' do ponto, do mais próximo para o mais distante.
+    O índice do geohash reduz a busca ao retângulo; o raio exato é conferido aqui.
+    """
+    candidatos = queryset.filter(filtro_bbox(*bbox_ao_redor(latitude, longitude, raio_metros)))
+    proximos = []
+    for relato in candidatos:
+        distancia = distancia_metros(latitude, longitude, relato.latitude, relato.longitude)
+        if distancia <= raio_metros:
+            proximos.append((relato, distancia))
+    proximos.sort(key=lambda item: item[1])
+    return proximos
@@ -0,0 +1,200 @@
+import random
+import statistics
+import time
+from collections import defaultdict
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from app_marica_cidadao.estatisticas import consulta_heatmap
+from app_marica_cidadao.geo import codificar_geohash, filtro_bbox, bbox_ao_redor
+from app_marica_cidadao.models import CategoriaProblema, RelatoZeladoria, HistoricoStatus
+
+# Índices criados na migração 0017 (removidos temporariamente para a medição "antes")
+INDICES_AVALIADOS = [
+    (RelatoZeladoria, 'relato_cidadao_criado_idx'),
+    (RelatoZeladoria, 'relato_criado_id_idx'),
+    (RelatoZeladoria, 'relato_status_criado_idx'),
+    (RelatoZeladoria, 'relato_bairro_criado_idx'),
+    (RelatoZeladoria, 'relato_categoria_geohash_idx'),
+    (HistoricoStatus, 'historico_relato_data_idx'),
+]
+
+BAIRROS = ['Centro', 'Itaipuaçu', 'Inoã', 'Ponta Negra', 'São José do Imbassaí', 'Barra de Maricá', 'Flamengo']
+
+
+class RollbackBenchmark(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Popula uma massa de dados temporária, mede as consultas principais com e sem '
+        'os índices da migração 0017 e mostra os planos de execução. Tudo é desfeito no final.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--relatos', type=int, default=50000, help='Quantidade de relatos gerados')
+        parser.add_argument('--repeticoes', type=int, default=5, help='Execuções por consulta em cada rodada')
+        parser.add_argument(
+            '--rodadas', type=int, default=4,
+            help='Rodadas com e sem índices, alternando qual fase vem primeiro (usa a mediana de todas)'
+        )
+        parser.add_argument('--planos', action='store_true', help='Mostra o EXPLAIN de cada consulta')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                contexto = self.popular(options['relatos'])
+                tempos = {True: defaultdict(list), False: defaultdict(list)}
+                com_indices = True
+                for rodada in range(max(1, options['rodadas'])):
+                    # A fase que roda primeiro se alterna: nenhuma das duas herda sempre
+                    # o cache já aquecido pela outra
+                    for fase in ((True, False) if rodada % 2 == 0 else (False, True)):
+                        if fase != com_indices:
+                            self.alternar_indices(fase)
+                            com_indices = fase
+                        mostrar_planos = options['planos'] and rodada == 0
+                        for nome, medidas in self.medir(contexto, options['repeticoes'], mostrar_planos, fase, rodada).items():
+                            tempos[fase][nome] += medidas
+                self.relatorio(tempos[False], tempos[True])
+                raise RollbackBenchmark()
+        except RollbackBenchmark:
+            self.stdout.write(self.style.SUCCESS('🧹 Dados temporários e alterações de índice desfeitos.'))
+
+    def popular(self, quantidade):
+        self.stdout.write(f'Gerando {quantidade} relatos temporários...')
+        random.seed(42)
+        agora = timezone.now()
+
+        cidadaos = User.objects.bulk_create([
+            User(username=f'benchmark_{i}_{time.time_ns()}') for i in range(max(1, quantidade // 20))
+        ])
+        categorias = CategoriaProblema.objects.bulk_create([
+            CategoriaProblema(nome=f'Benchmark {i}', tempo_estimado_resolucao=5) for i in range(6)
+        ])
+        status = [codigo for codigo, _ in RelatoZeladoria.STATUS_CHOICES]
+
+        # bulk_create não chama save(): o geohash é calculado aqui
+        lote = []
+        for _ in range(quantidade):
+            latitude = -22.92 + random.uniform(-0.08, 0.08)
+            longitude = -42.82 + random.uniform(-0.15, 0.15)
+            lote.append(RelatoZeladoria(
+                cidadao=random.choice(cidadaos),
+                categoria=random.choice(categorias),
+                descricao='benchmark',
+                latitude=latitude,
+                longitude=longitude,
+                geohash=codificar_geohash(latitude, longitude),
+                bairro=random.choice(BAIRROS),
+                status_atual=random.choice(status),
+            ))
+        relatos = RelatoZeladoria.objects.bulk_create(lote, batch_size=2000)
+
+        # auto_now_add ignora o valor do bulk_create: espalha as datas em um ano
+        for relato in relatos:
+            relato.criado_em = agora - timedelta(minutes=random.randint(0, 365 * 24 * 60))
+        RelatoZeladoria.objects.bulk_update(relatos, ['criado_em'], batch_size=2000)
+
+        HistoricoStatus.objects.bulk_create([
+            HistoricoStatus(relato=relato, status=relato.status_atual) for relato in relatos
+        ], batch_size=2000)
+
+        # Estatísticas atualizadas para o planejador escolher entre os índices
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        return {
+            'cidadao': cidadaos[0],
+            'categoria': categorias[0],
+            'ids': [relato.id for relato in relatos[:20]],
+            'agora': agora,
+        }
+
+    def consultas(self, contexto):
+        """
+        Consultas equivalentes às usadas em views.py, estatisticas.py, serializers.py e admin.py.
+        """
+        agora = contexto['agora']
+        bbox_duplicado = bbox_ao_redor(-22.92, -42.82, 30)
+        return {
+            'lista_cidadao': RelatoZeladoria.objects.filter(
+                cidadao=contexto['cidadao']
+            ).order_by('-criado_em', '-id')[:20],
+            'fila_staff': RelatoZeladoria.objects.order_by('-criado_em', '-id')[:20],
+            'fila_por_status': RelatoZeladoria.objects.filter(
+                status_atual='recebido'
+            ).order_by('-criado_em', '-id')[:20],
+            'fila_por_bairro': RelatoZeladoria.objects.filter(
+                bairro='Centro'
+            ).order_by('-criado_em', '-id')[:20],
+            'heatmap': consulta_heatmap(),
+            'busca_duplicados': RelatoZeladoria.objects.filter(
+                filtro_bbox(*bbox_duplicado),
+                categoria=contexto['categoria'],
+                criado_em__gte=agora - timedelta(days=30),
+            ).only('id', 'latitude', 'longitude').order_by(),
+            'historico_prefetch': HistoricoStatus.objects.filter(
+                relato_id__in=contexto['ids']
+            ).order_by(*HistoricoStatus.ORDEM_POR_RELATO),
+        }
+
+    def medir(self, contexto, repeticoes, mostrar_planos, com_indices, rodada):
+        """
+        Executa o SQL gerado por cada queryset direto no cursor. A primeira execução
+        de cada consulta aquece o cache e é descartada. O comentário com a fase e a
+        rodada muda o texto da consulta: o cache de statements do driver sqlite3
+        reaproveitaria o plano antigo depois do DROP/CREATE INDEX.
+        Retorna os tempos (ms) de cada consulta.
+        """
+        rotulo = 'com índices' if com_indices else 'sem índices'
+        self.stdout.write(self.style.MIGRATE_HEADING(f'\n== Rodada {rodada + 1}: {rotulo} =='))
+        resultados = {}
+        with connection.cursor() as cursor:
+            for nome, queryset in self.consultas(contexto).items():
+                sql, params = queryset.query.sql_with_params()
+                sql = f'/* benchmark {rotulo} rodada {rodada} */ {sql}'
+
+                cursor.execute(sql, params)
+                cursor.fetchall()
+
+                tempos = []
+                for _ in range(repeticoes):
+                    inicio = time.perf_counter()
+                    cursor.execute(sql, params)
+                    cursor.fetchall()
+                    tempos.append((time.perf_counter() - inicio) * 1000)
+                resultados[nome] = tempos
+                self.stdout.write(f'{nome:<22} {statistics.median(tempos):>9.2f} ms')
+
+                if mostrar_planos:
+                    cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+                    for linha in cursor.fetchall():
+                        self.stdout.write(f'    {linha[-1]}')
+        return resultados
+
+    def alternar_indices(self, criar):
+        """
+        DROP/CREATE INDEX direto (e não pelo schema_editor, que no SQLite não roda
+        dentro de transaction.atomic): funciona no SQLite e no PostgreSQL e é desfeito no rollback.
+        """
+        editor = connection.schema_editor()
+        with connection.cursor() as cursor:
+            for modelo, nome in INDICES_AVALIADOS:
+                if criar:
+                    indice = next(indice for indice in modelo._meta.indexes if indice.name == nome)
+                    cursor.execute(str(indice.create_sql(modelo, editor)))
+                else:
+                    cursor.execute(f'DROP INDEX {connection.ops.quote_name(nome)}')
+
+    def relatorio(self, antes, depois):
+        self.stdout.write(self.style.MIGRATE_HEADING('\n== Resultado (mediana de todas as rodadas, em ms) =='))
+        self.stdout.write(f'{"consulta":<22} {"antes":>10} {"depois":>10} {"ganho":>8}')
+        for nome in antes:
+            mediana_antes = statistics.median(antes[nome])
+            mediana_depois = statistics.median(depois[nome])
+            ganho = mediana_antes / mediana_depois if mediana_depois else 0
+            self.stdout.write(f'{nome:<22} {mediana_antes:>10.2f} {mediana_depois:>10.2f} {ganho:>7.1f}x')
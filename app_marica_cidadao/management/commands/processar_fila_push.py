@@ -0,0 +1,37 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from app_marica_cidadao.notificacoes import processar_notificacoes_pendentes, segundos_ate_proxima_notificacao
+from app_marica_cidadao.webpush_service import processar_fila_push, segundos_ate_proxima_entrega
+
+
+class Command(BaseCommand):
+    help = (
+        'Distribui as notificações de status agrupadas (NotificacaoPendente) e envia as notificações '
+        'push pendentes da fila (EntregaPush). Sem --continuo, envia o que '
+        'estiver vencido e termina (útil no cron ou após reiniciar o servidor). Com --continuo, '
+        'roda como worker dedicado; nesse caso use WEBPUSH_DESPACHANTE_EMBUTIDO=False no servidor web.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--continuo', action='store_true', help='Fica rodando e processa novas entregas')
+
+    def handle(self, *args, **options):
+        if not options['continuo']:
+            processar_notificacoes_pendentes()
+            enviadas = processar_fila_push()
+            self.stdout.write(self.style.SUCCESS(f'✅ {enviadas} entregas processadas.'))
+            return
+
+        self.stdout.write('📨 Processando a fila de push (Ctrl+C para sair)...')
+        try:
+            while True:
+                processar_notificacoes_pendentes()
+                enviadas = processar_fila_push()
+                if enviadas:
+                    self.stdout.write(f'   {enviadas} entregas processadas.')
+                espera = min(segundos_ate_proxima_entrega(maximo=5), segundos_ate_proxima_notificacao(maximo=5))
+                close_old_connections()
+                time.sleep(max(0.5, espera))
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.SUCCESS('Encerrado.'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from app_marica_cidadao.models import EstatisticaDiaria
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói a tabela de estatísticas diárias do dashboard a partir dos relatos.'
+
+    def handle(self, *args, **kwargs):
+        linhas = EstatisticaDiaria.recalcular()
+        self.stdout.write(self.style.SUCCESS(f'✅ Estatísticas recalculadas: {linhas} linhas geradas.'))
@@ -0,0 +1,178 @@
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+from app_marica_cidadao.ai_service import disjuntor
+from app_marica_cidadao.models import RelatoZeladoria, CacheAnaliseIA, VersaoDados
+from app_marica_cidadao.triagem import (
+    analisar, preparar_imagem, cache_ativo, validade_cache, guardar_no_cache, resultado_com_erro
+)
+
+PRIORIDADES_VALIDAS = {codigo for codigo, _ in RelatoZeladoria.PRIORIDADE_CHOICES}
+
+
+class LimitadorTaxa:
+    """
+    Espaça as chamadas ao modelo para no máximo 'por_minuto', somando todas as threads.
+    """
+    def __init__(self, por_minuto):
+        self.intervalo = 60.0 / por_minuto if por_minuto > 0 else 0
+        self.proxima = time.monotonic()
+        self.lock = threading.Lock()
+
+    def aguardar(self):
+        if not self.intervalo:
+            return
+        with self.lock:
+            agora = time.monotonic()
+            espera = self.proxima - agora
+            self.proxima = max(agora, self.proxima) + self.intervalo
+        if espera > 0:
+            time.sleep(espera)
+
+
+class Command(BaseCommand):
+    help = (
+        'Refaz a triagem da IA (prioridade e justificativa) dos relatos antigos a partir da foto. '
+        'Processa em lotes com paralelismo e taxa limitados e grava um checkpoint após cada lote, '
+        'permitindo retomar de onde parou.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--todos', action='store_true', help='Inclui relatos que já têm justificativa da IA')
+        parser.add_argument('--status', help='Somente relatos com este status')
+        parser.add_argument('--desde', help='Somente relatos criados a partir desta data (AAAA-MM-DD)')
+        parser.add_argument('--limite', type=int, help='Quantidade máxima de relatos nesta execução')
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'IA_TRIAGEM_WORKERS', 2), help='Chamadas simultâneas ao modelo')
+        parser.add_argument('--por-minuto', type=int, default=60, help='Máximo de chamadas ao modelo por minuto (0 = sem limite)')
+        parser.add_argument('--lote', type=int, default=50, help='Relatos por lote (uma escrita em massa e um checkpoint por lote)')
+        parser.add_argument(
+            '--checkpoint',
+            default=os.path.join(settings.BASE_DIR, 'backups', 'retriagem_ia_checkpoint.json'),
+            help='Arquivo onde o progresso é guardado'
+        )
+        parser.add_argument('--recomecar', action='store_true', help='Ignora o checkpoint existente')
+        parser.add_argument('--simular', action='store_true', help='Classifica mas não grava nos relatos')
+
+    def handle(self, *args, **options):
+        # pendentes: relatos até ultimo_id que pegaram o disjuntor aberto e ainda faltam
+        progresso = {'ultimo_id': 0, 'pendentes': [], 'processados': 0, 'atualizados': 0, 'erros': 0}
+        if not options['recomecar'] and os.path.exists(options['checkpoint']):
+            with open(options['checkpoint']) as arquivo:
+                progresso.update(json.load(arquivo))
+            self.stdout.write(f"↩️ Retomando após o relato #{progresso['ultimo_id']} ({progresso['processados']} já processados).")
+
+        relatos = self.selecionar(options)
+        total = relatos.filter(Q(id__gt=progresso['ultimo_id']) | Q(id__in=progresso['pendentes'])).count()
+        if options['limite']:
+            total = min(total, options['limite'])
+        taxa = f"até {options['por_minuto']} chamadas/min" if options['por_minuto'] > 0 else "sem limite de taxa"
+        self.stdout.write(f"🤖 {total} relatos para triar com {options['workers']} workers, {taxa}.")
+
+        limitador = LimitadorTaxa(options['por_minuto'])
+        inicio = time.monotonic()
+        feitos = 0
+
+        with ThreadPoolExecutor(max_workers=max(1, options['workers']), thread_name_prefix='retriagem-ia') as executor:
+            while feitos < total:
+                tamanho = min(options['lote'], total - feitos)
+                lote = list(relatos.filter(
+                    Q(id__gt=progresso['ultimo_id']) | Q(id__in=progresso['pendentes'])
+                ).order_by('id')[:tamanho])
+                if not lote:
+                    break
+
+                resultados = list(executor.map(lambda relato: self.classificar(relato, limitador), lote))
+
+                alterados = []
+                concluidos = []
+                indisponiveis = []
+                for relato, resultado in zip(lote, resultados):
+                    if isinstance(resultado, dict) and resultado.get('indisponivel'):
+                        # Disjuntor aberto: só este relato volta no próximo lote; os
+                        # demais resultados do lote já foram pagos e são gravados
+                        indisponiveis.append(relato.id)
+                        continue
+                    concluidos.append(relato)
+                    if resultado_com_erro(resultado):
+                        progresso['erros'] += 1
+                        self.stdout.write(self.style.WARNING(f"⚠️ Relato #{relato.id}: {(resultado or {}).get('error', resultado)}"))
+                        continue
+                    prioridade = resultado.get('prioridade')
+                    if prioridade in PRIORIDADES_VALIDAS:
+                        relato.prioridade = prioridade
+                    relato.justificativa_ia = resultado.get('justificativa') or relato.justificativa_ia
+                    alterados.append(relato)
+
+                if alterados and not options['simular']:
+                    RelatoZeladoria.objects.bulk_update(alterados, ['prioridade', 'justificativa_ia'])
+                    # bulk_update não dispara signals: avisa o mapa público (ETag) manualmente
+                    VersaoDados.incrementar('relatos')
+
+                if concluidos:
+                    feitos += len(concluidos)
+                    progresso['ultimo_id'] = max(progresso['ultimo_id'], lote[-1].id)
+                    progresso['pendentes'] = indisponiveis
+                    progresso['processados'] += len(concluidos)
+                    progresso['atualizados'] += len(alterados)
+                    if not options['simular']:
+                        self.salvar_checkpoint(options['checkpoint'], progresso)
+
+                    decorrido = time.monotonic() - inicio
+                    restante = decorrido / feitos * (total - feitos)
+                    self.stdout.write(f"   {feitos}/{total} relatos ({decorrido:.0f}s, ~{restante:.0f}s restantes)")
+
+                if indisponiveis:
+                    espera = max(1.0, disjuntor.segundos_para_reabrir())
+                    self.stdout.write(self.style.WARNING(f"⏸️ IA indisponível (disjuntor aberto). Aguardando {espera:.0f}s..."))
+                    time.sleep(espera)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Retriagem concluída: {progresso['atualizados']} atualizados, {progresso['erros']} erros "
+            f"(relatos com erro continuam sem justificativa e voltam com --recomecar)."
+        ))
+
+    def selecionar(self, options):
+        relatos = RelatoZeladoria.objects.exclude(foto_problema='').exclude(foto_problema__isnull=True)
+        if not options['todos']:
+            relatos = relatos.filter(Q(justificativa_ia__isnull=True) | Q(justificativa_ia=''))
+        if options['status']:
+            relatos = relatos.filter(status_atual=options['status'])
+        if options['desde']:
+            relatos = relatos.filter(criado_em__date__gte=options['desde'])
+        # Só o necessário para a triagem e para o bulk_update
+        return relatos.only('id', 'foto_problema', 'prioridade', 'justificativa_ia')
+
+    def classificar(self, relato, limitador):
+        """
+        Executado nas threads do pool. Resultados do cache não contam para o limite de taxa.
+        """
+        try:
+            with relato.foto_problema.open('rb') as arquivo:
+                conteudo, hashes = preparar_imagem(arquivo)
+
+            resultado = CacheAnaliseIA.buscar(*hashes, validade_cache()) if cache_ativo() else None
+            if resultado is None:
+                limitador.aguardar()
+                resultado = analisar(io.BytesIO(conteudo))
+                guardar_no_cache(hashes, resultado)
+            return resultado
+        except Exception as e:
+            return {"error": str(e)}
+        finally:
+            close_old_connections()
+
+    def salvar_checkpoint(self, caminho, progresso):
+        os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+        temporario = f'{caminho}.tmp'
+        with open(temporario, 'w') as arquivo:
+            json.dump({**progresso, 'atualizado_em': timezone.now().isoformat()}, arquivo)
+        # Troca atômica: uma interrupção no meio da escrita não corrompe o checkpoint
+        os.replace(temporario, caminho)
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:40
+
+from django.db import migrations, models
+
+
+def preencher_geohash(apps, schema_editor):
+    from app_marica_cidadao.geo import codificar_geohash
+
+    RelatoZeladoria = apps.get_model('app_marica_cidadao', 'RelatoZeladoria')
+    relatos = RelatoZeladoria.objects.filter(
+        latitude__isnull=False, longitude__isnull=False
+    ).only('id', 'latitude', 'longitude')
+
+    lote = []
+    for relato in relatos.iterator(chunk_size=2000):
+        relato.geohash = codificar_geohash(relato.latitude, relato.longitude)
+        lote.append(relato)
+        if len(lote) >= 2000:
+            RelatoZeladoria.objects.bulk_update(lote, ['geohash'])
+            lote = []
+    if lote:
+        RelatoZeladoria.objects.bulk_update(lote, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_marica_cidadao', '0012_relatozeladoria_bairro'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='relatozeladoria',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='Chave espacial calculada a partir da latitude/longitude (buscas por área)', max_length=12, null=True),
+        ),
+        migrations.RunPython(preencher_geohash, migrations.RunPython.noop),
+    ]
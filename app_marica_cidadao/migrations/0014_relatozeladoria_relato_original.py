@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_marica_cidadao', '0013_relatozeladoria_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='relatozeladoria',
+            name='relato_original',
+            field=models.ForeignKey(blank=True, help_text='Relato aberto da mesma categoria e no mesmo local do qual este parece ser duplicado', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicados', to='app_marica_cidadao.relatozeladoria'),
+        ),
+    ]
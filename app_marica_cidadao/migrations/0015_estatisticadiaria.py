@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def preencher_estatisticas(apps, schema_editor):
+    RelatoZeladoria = apps.get_model('app_marica_cidadao', 'RelatoZeladoria')
+    EstatisticaDiaria = apps.get_model('app_marica_cidadao', 'EstatisticaDiaria')
+
+    linhas = RelatoZeladoria.objects.annotate(
+        dia=TruncDate('criado_em')
+    ).values('dia', 'status_atual', 'categoria_id', 'bairro').annotate(
+        quantidade=Count('id')
+    ).order_by()
+
+    agregado = {}
+    for linha in linhas:
+        chave = (linha['dia'], linha['status_atual'], linha['categoria_id'], linha['bairro'] or '')
+        agregado[chave] = agregado.get(chave, 0) + linha['quantidade']
+
+    EstatisticaDiaria.objects.bulk_create([
+        EstatisticaDiaria(data=data, status=status, categoria_id=categoria_id, bairro=bairro, total=total)
+        for (data, status, categoria_id, bairro), total in agregado.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_marica_cidadao', '0014_relatozeladoria_relato_original'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstatisticaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField(help_text='Dia de criação dos relatos')),
+                ('status', models.CharField(choices=[('recebido', 'Recebido'), ('em_analise', 'Em Análise'), ('equipe_despachada', 'Equipe no Local'), ('resolvido', 'Resolvido'), ('rejeitado', 'Rejeitado / Improcedente')], max_length=20)),
+                ('bairro', models.CharField(blank=True, default='', max_length=150)),
+                ('total', models.IntegerField(default=0)),
+                ('categoria', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='estatisticas', to='app_marica_cidadao.categoriaproblema')),
+            ],
+            options={
+                'verbose_name': 'Estatística Diária',
+                'verbose_name_plural': 'Estatísticas Diárias',
+                'indexes': [models.Index(fields=['bairro', 'data'], name='estatistica_bairro_data_idx')],
+                'constraints': [models.UniqueConstraint(fields=('data', 'status', 'categoria', 'bairro'), name='estatistica_diaria_unica')],
+            },
+        ),
+        migrations.RunPython(preencher_estatisticas, migrations.RunPython.noop),
+    ]
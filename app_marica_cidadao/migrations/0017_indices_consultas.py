@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:50
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_marica_cidadao', '0016_versaodados'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='historicostatus',
+            index=models.Index(fields=['relato', '-data_atualizacao'], name='historico_relato_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='relatozeladoria',
+            index=models.Index(fields=['cidadao', '-criado_em', '-id'], name='relato_cidadao_criado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='relatozeladoria',
+            index=models.Index(fields=['-criado_em', '-id'], name='relato_criado_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='relatozeladoria',
+            index=models.Index(fields=['status_atual', '-criado_em'], name='relato_status_criado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='relatozeladoria',
+            index=models.Index(fields=['bairro', '-criado_em'], name='relato_bairro_criado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='relatozeladoria',
+            index=models.Index(fields=['categoria', 'geohash'], name='relato_categoria_geohash_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:54
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_marica_cidadao', '0017_indices_consultas'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnaliseFoto',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('pendente', 'Pendente'), ('processando', 'Processando'), ('concluida', 'Concluída'), ('erro', 'Erro')], default='pendente', max_length=20)),
+                ('resultado', models.JSONField(blank=True, help_text="Resposta da IA (ou {'error': ...})", null=True)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('concluido_em', models.DateTimeField(blank=True, null=True)),
+                ('cidadao', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='analises_foto', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Análise de Foto (IA)',
+                'verbose_name_plural': 'Análises de Fotos (IA)',
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:56
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_marica_cidadao', '0018_analisefoto'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheAnaliseIA',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash_conteudo', models.CharField(help_text='SHA-256 dos bytes da imagem', max_length=64, unique=True)),
+                ('hash_perceptual', models.CharField(blank=True, default='', max_length=16)),
+                ('banda_1', models.CharField(blank=True, db_index=True, default='', max_length=4)),
+                ('banda_2', models.CharField(blank=True, db_index=True, default='', max_length=4)),
+                ('banda_3', models.CharField(blank=True, db_index=True, default='', max_length=4)),
+                ('banda_4', models.CharField(blank=True, db_index=True, default='', max_length=4)),
+                ('resultado', models.JSONField()),
+                ('acertos', models.PositiveIntegerField(default=0)),
+                ('criado_em', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('ultimo_uso', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Cache de Análise (IA)',
+                'verbose_name_plural': 'Cache de Análises (IA)',
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:02
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_marica_cidadao', '0019_cacheanaliseia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MensagemPush',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('titulo', models.CharField(max_length=150)),
+                ('mensagem', models.TextField()),
+                ('url', models.CharField(default='/', max_length=255)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Mensagem Push',
+                'verbose_name_plural': 'Mensagens Push',
+            },
+        ),
+        migrations.CreateModel(
+            name='EntregaPush',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pendente', 'Pendente'), ('enviando', 'Enviando'), ('enviada', 'Enviada'), ('falhou', 'Falhou')], default='pendente', max_length=20)),
+                ('tentativas', models.PositiveIntegerField(default=0)),
+                ('proxima_tentativa', models.DateTimeField(default=django.utils.timezone.now)),
+                ('ultimo_erro', models.TextField(blank=True, default='')),
+                ('enviada_em', models.DateTimeField(blank=True, null=True)),
+                ('reserva', models.CharField(blank=True, default='', help_text='Identifica o lote do despachante que reservou a entrega (evita envio duplicado)', max_length=32)),
+                ('inscricao', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entregas', to='app_marica_cidadao.webpushsubscription')),
+                ('mensagem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entregas', to='app_marica_cidadao.mensagempush')),
+            ],
+            options={
+                'verbose_name': 'Entrega Push',
+                'verbose_name_plural': 'Entregas Push',
+                'indexes': [models.Index(fields=['status', 'proxima_tentativa'], name='entrega_push_fila_idx')],
+            },
+        ),
+    ]
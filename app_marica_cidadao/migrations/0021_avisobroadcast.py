@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_marica_cidadao', '0020_fila_push'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvisoBroadcast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('titulo', models.CharField(max_length=150)),
+                ('mensagem', models.TextField()),
+                ('url', models.CharField(default='/', max_length=255)),
+                ('bairro', models.CharField(blank=True, default='', help_text='Bairro do perfil do cidadão', max_length=100)),
+                ('status', models.CharField(choices=[('rascunho', 'Rascunho'), ('enviando', 'Enviando'), ('enviado', 'Enviado')], default='rascunho', max_length=20)),
+                ('total_dispositivos', models.PositiveIntegerField(default=0)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('disparado_em', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Aviso em Massa',
+                'verbose_name_plural': 'Avisos em Massa',
+                'ordering': ['-criado_em'],
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='entregapush',
+            name='entrega_push_fila_idx',
+        ),
+        migrations.AddField(
+            model_name='entregapush',
+            name='em_massa',
+            field=models.BooleanField(default=False, help_text='Entrega de aviso em massa: só sai depois das notificações individuais vencidas'),
+        ),
+        migrations.AddIndex(
+            model_name='entregapush',
+            index=models.Index(fields=['em_massa', 'status', 'proxima_tentativa'], name='entrega_push_fila_idx'),
+        ),
+        migrations.AddField(
+            model_name='avisobroadcast',
+            name='categoria',
+            field=models.ForeignKey(blank=True, help_text='Cidadãos com relatos ainda abertos nesta categoria', null=True, on_delete=django.db.models.deletion.SET_NULL, to='app_marica_cidadao.categoriaproblema'),
+        ),
+        migrations.AddField(
+            model_name='avisobroadcast',
+            name='criado_por',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='avisos_broadcast', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='avisobroadcast',
+            name='mensagem_push',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='app_marica_cidadao.mensagempush'),
+        ),
+    ]
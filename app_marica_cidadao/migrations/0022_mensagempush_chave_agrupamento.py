@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_marica_cidadao', '0021_avisobroadcast'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mensagempush',
+            name='chave_agrupamento',
+            field=models.CharField(blank=True, db_index=True, default='', help_text="Mensagens com a mesma chave (ex: 'relato:42') ainda não enviadas são substituídas pela mais nova", max_length=50),
+        ),
+    ]
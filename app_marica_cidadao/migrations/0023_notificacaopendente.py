@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_marica_cidadao', '0022_mensagempush_chave_agrupamento'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='mensagempush',
+            name='chave_agrupamento',
+        ),
+        migrations.CreateModel(
+            name='NotificacaoPendente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('enviar_em', models.DateTimeField(db_index=True)),
+                ('historico', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='app_marica_cidadao.historicostatus')),
+                ('relato', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='notificacao_pendente', to='app_marica_cidadao.relatozeladoria')),
+            ],
+            options={
+                'verbose_name': 'Notificação Pendente',
+                'verbose_name_plural': 'Notificações Pendentes',
+            },
+        ),
+    ]
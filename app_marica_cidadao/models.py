@@ -1,5 +1,10 @@
-from django.db import models
+import uuid
+from datetime import timedelta
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Q, Count
+from django.db.models.functions import TruncDate
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class CategoriaProblema(models.Model):
     """
@@ -34,6 +39,11 @@ class RelatoZeladoria(models.Model):
         ('rejeitado', 'Rejeitado / Improcedente'),
     ]
 
+    # Status em que a prefeitura já está trabalhando no chamado
+    STATUS_EM_ANDAMENTO = ['em_analise', 'equipe_despachada']
+    # Status em que o chamado não está mais na fila da prefeitura
+    STATUS_ENCERRADOS = ['resolvido', 'rejeitado']
+
     PRIORIDADE_CHOICES = [
         ('baixa', 'Baixa'),
         ('media', 'Média'),
@@ -52,6 +62,10 @@ class RelatoZeladoria(models.Model):
     longitude = models.FloatField(help_text="Longitude", null=True, blank=True)
     endereco_aproximado = models.CharField(max_length=255, blank=True, null=True)
     bairro = models.CharField(max_length=150, blank=True, null=True, help_text="Bairro onde o problema ocorreu")
+    geohash = models.CharField(
+        max_length=12, blank=True, null=True, db_index=True, editable=False,
+        help_text="Chave espacial calculada a partir da latitude/longitude (buscas por área)"
+    )
     
     # Propriedade Privada
     e_propriedade_privada = models.BooleanField(default=False, help_text="O problema é em uma propriedade privada?")
@@ -62,6 +76,14 @@ class RelatoZeladoria(models.Model):
     status_atual = models.CharField(max_length=20, choices=STATUS_CHOICES, default='recebido')
     prioridade = models.CharField(max_length=20, choices=PRIORIDADE_CHOICES, default='baixa', help_text="Estimada pela IA ou servidora")
     justificativa_ia = models.TextField(blank=True, null=True, help_text="Explicação técnica da IA")
+    relato_original = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='duplicados',
+        help_text="Relato aberto da mesma categoria e no mesmo local do qual este parece ser duplicado"
+    )
     
     # Feedback do Cidadão (Pós-Resolução)
     avaliacao = models.IntegerField(null=True, blank=True, help_text="Avaliação de 1 a 5 estrelas")
@@ -74,10 +96,56 @@ class RelatoZeladoria(models.Model):
     def __str__(self):
         return f"Protocolo #{self.id} - {self.categoria.nome}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Guarda a chave de estatística carregada do banco para detectar mudanças no save
+        if {'criado_em', 'status_atual', 'categoria_id', 'bairro'} <= set(field_names):
+            instance._chave_estatistica_original = instance.chave_estatistica()
+        return instance
+
+    def chave_estatistica(self):
+        """
+        Linha de EstatisticaDiaria em que este relato é contado.
+        """
+        return (
+            timezone.localdate(self.criado_em),
+            self.status_atual,
+            self.categoria_id,
+            self.bairro or '',
+        )
+
+    def save(self, *args, **kwargs):
+        # Mantém o geohash sincronizado com as coordenadas
+        from .geo import codificar_geohash
+
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = codificar_geohash(self.latitude, self.longitude)
+        else:
+            self.geohash = None
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and ({'latitude', 'longitude'} & set(update_fields)):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = "Relato de Zeladoria"
         verbose_name_plural = "Relatos de Zeladoria"
         ordering = ['-criado_add'] if hasattr(models, 'criado_add') else ['-criado_em']
+        # Índices pensados a partir das consultas reais (ver comando benchmark_consultas)
+        indexes = [
+            # "Meus protocolos" do cidadão, paginado por (criado_em, id)
+            models.Index(fields=['cidadao', '-criado_em', '-id'], name='relato_cidadao_criado_idx'),
+            # Fila da prefeitura e lista do admin: mais recentes primeiro, período do heatmap
+            models.Index(fields=['-criado_em', '-id'], name='relato_criado_id_idx'),
+            # Fila filtrada por status / bairro, sempre ordenada pela data
+            models.Index(fields=['status_atual', '-criado_em'], name='relato_status_criado_idx'),
+            models.Index(fields=['bairro', '-criado_em'], name='relato_bairro_criado_idx'),
+            # Busca de duplicados: mesma categoria + intervalo de geohash
+            models.Index(fields=['categoria', 'geohash'], name='relato_categoria_geohash_idx'),
+        ]
 
 
 class HistoricoStatus(models.Model):
@@ -103,41 +171,22 @@ class HistoricoStatus(models.Model):
     )
     data_atualizacao = models.DateTimeField(auto_now_add=True)
 
+    # Ordem do prefetch de vários relatos: segue historico_relato_data_idx, então o
+    # banco lê as linhas do índice já ordenadas, sem ordenar o resultado do IN (...)
+    ORDEM_POR_RELATO = ['relato_id', '-data_atualizacao']
+
     class Meta:
         ordering = ['-data_atualizacao']
         verbose_name = "Histórico de Status"
         verbose_name_plural = "Históricos de Status"
+        indexes = [
+            # Linha do tempo de um relato (prefetch do serializer e inline do admin)
+            models.Index(fields=['relato', '-data_atualizacao'], name='historico_relato_data_idx'),
+        ]
 
     def __str__(self):
         return f"Atualização #{self.id} para Relato #{self.relato.id}"
 
-    def save(self, *args, **kwargs):
-        is_new = self.pk is None
-        super().save(*args, **kwargs)
-        
-        if is_new:
-            # Envia a notificação Push quando um novo histórico é criado (status alterado no banco)
-            try:
-                from .webpush_service import disparar_notificacao_push
-                from .models import RelatoZeladoria
-                
-                status_legivel = dict(RelatoZeladoria.STATUS_CHOICES).get(self.status, self.status)
-                titulo = f"Maricá Cidadão - Atualização"
-                mensagem = f"O status do seu chamado '{self.relato.categoria.nome}' mudou para: {status_legivel}."
-                
-                if self.observacao_prefeitura:
-                    mensagem += f"\nObs: {self.observacao_prefeitura}"
-                    
-                disparar_notificacao_push(
-                    user=self.relato.cidadao,
-                    title=titulo,
-                    message=mensagem,
-                    url="/"
-                )
-            except Exception as e:
-                print(f"Aviso: Falha ao enviar WebPush automático: {str(e)}")
-
-
 
 class PerfilCidadao(models.Model):
     """
@@ -188,3 +237,396 @@ class WebPushSubscription(models.Model):
 
     def __str__(self):
         return f"Push endpoint para {self.user.username}"
+
+
+class AnaliseFoto(models.Model):
+    """
+    Pedido de triagem de uma foto pela IA. A API devolve o id na hora e o
+    resultado é gravado aqui pelo pool de triagem (ver triagem.py).
+    """
+    STATUS_CHOICES = [
+        ('pendente', 'Pendente'),
+        ('processando', 'Processando'),
+        ('concluida', 'Concluída'),
+        ('erro', 'Erro'),
+    ]
+    STATUS_FINALIZADOS = ['concluida', 'erro']
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    cidadao = models.ForeignKey(User, on_delete=models.CASCADE, related_name='analises_foto')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pendente')
+    resultado = models.JSONField(null=True, blank=True, help_text="Resposta da IA (ou {'error': ...})")
+    criado_em = models.DateTimeField(auto_now_add=True)
+    concluido_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Análise de Foto (IA)"
+        verbose_name_plural = "Análises de Fotos (IA)"
+
+    def __str__(self):
+        return f"Análise {self.id} - {self.status}"
+
+
+class CacheAnaliseIA(models.Model):
+    """
+    Resultados da IA guardados por hash da imagem, para que a mesma foto
+    (ou uma quase idêntica, ex.: recomprimida pelo navegador) não pague outra chamada ao modelo.
+    hash_perceptual é um dHash de 64 bits em hexadecimal; as quatro bandas de
+    16 bits indexadas permitem achar hashes a até 3 bits de distância
+    (se 3 bits mudaram, ao menos uma das 4 bandas continua igual).
+    """
+    DISTANCIA_MAXIMA = 3
+
+    hash_conteudo = models.CharField(max_length=64, unique=True, help_text="SHA-256 dos bytes da imagem")
+    hash_perceptual = models.CharField(max_length=16, blank=True, default='')
+    banda_1 = models.CharField(max_length=4, blank=True, default='', db_index=True)
+    banda_2 = models.CharField(max_length=4, blank=True, default='', db_index=True)
+    banda_3 = models.CharField(max_length=4, blank=True, default='', db_index=True)
+    banda_4 = models.CharField(max_length=4, blank=True, default='', db_index=True)
+    resultado = models.JSONField()
+    acertos = models.PositiveIntegerField(default=0)
+    criado_em = models.DateTimeField(auto_now_add=True, db_index=True)
+    ultimo_uso = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = "Cache de Análise (IA)"
+        verbose_name_plural = "Cache de Análises (IA)"
+
+    def __str__(self):
+        return f"{self.hash_conteudo[:12]} ({self.acertos} acertos)"
+
+    @staticmethod
+    def bandas(hash_perceptual):
+        if len(hash_perceptual) != 16:
+            return ['', '', '', '']
+        return [hash_perceptual[i:i + 4] for i in range(0, 16, 4)]
+
+    @classmethod
+    def buscar(cls, hash_conteudo, hash_perceptual, validade):
+        """
+        Retorna o resultado guardado para a imagem (igual ou parecida) ou None.
+        Entradas criadas antes de 'validade' são ignoradas.
+        """
+        entradas = cls.objects.filter(criado_em__gte=validade)
+        entrada = entradas.filter(hash_conteudo=hash_conteudo).first()
+
+        if entrada is None and hash_perceptual:
+            banda_1, banda_2, banda_3, banda_4 = cls.bandas(hash_perceptual)
+            alvo = int(hash_perceptual, 16)
+            melhor_distancia = cls.DISTANCIA_MAXIMA + 1
+            for candidata in entradas.filter(
+                models.Q(banda_1=banda_1) | models.Q(banda_2=banda_2) |
+                models.Q(banda_3=banda_3) | models.Q(banda_4=banda_4)
+            ):
+                distancia = bin(alvo ^ int(candidata.hash_perceptual, 16)).count('1')
+                if distancia < melhor_distancia:
+                    entrada, melhor_distancia = candidata, distancia
+
+        if entrada is None:
+            return None
+
+        cls.objects.filter(pk=entrada.pk).update(acertos=F('acertos') + 1, ultimo_uso=timezone.now())
+        return entrada.resultado
+
+    @classmethod
+    def guardar(cls, hash_conteudo, hash_perceptual, resultado, validade, max_entradas):
+        banda_1, banda_2, banda_3, banda_4 = cls.bandas(hash_perceptual)
+        cls.objects.update_or_create(hash_conteudo=hash_conteudo, defaults={
+            'hash_perceptual': hash_perceptual,
+            'banda_1': banda_1, 'banda_2': banda_2, 'banda_3': banda_3, 'banda_4': banda_4,
+            'resultado': resultado,
+            # auto_now_add não vale no update: uma entrada vencida e ainda não podada
+            # seria apagada logo abaixo junto com o resultado que acabou de ser pago
+            'criado_em': timezone.now(),
+            'ultimo_uso': timezone.now(),
+        })
+        cls.podar(validade, max_entradas)
+
+    @classmethod
+    def podar(cls, validade, max_entradas):
+        """
+        Remove as entradas vencidas e, acima de max_entradas, as usadas há mais tempo (LRU).
+        """
+        cls.objects.filter(criado_em__lt=validade).delete()
+        ids = list(cls.objects.order_by('-ultimo_uso').values_list('pk', flat=True)[max_entradas:])
+        if ids:
+            cls.objects.filter(pk__in=ids).delete()
+
+
+class NotificacaoPendente(models.Model):
+    """
+    Notificação de mudança de status esperando a janela de agrupamento
+    (NOTIFICACOES_JANELA_SEGUNDOS). Há no máximo uma por relato: outra mudança
+    dentro da janela só troca o histórico, e o despachante envia a todos os
+    canais apenas o status mais recente (ver notificacoes.py).
+    """
+    relato = models.OneToOneField(RelatoZeladoria, on_delete=models.CASCADE, related_name='notificacao_pendente')
+    historico = models.ForeignKey(HistoricoStatus, on_delete=models.CASCADE, related_name='+')
+    enviar_em = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = "Notificação Pendente"
+        verbose_name_plural = "Notificações Pendentes"
+
+    def __str__(self):
+        return f"Relato #{self.relato_id} às {self.enviar_em}"
+
+    @classmethod
+    def agendar(cls, historico, janela):
+        """
+        Agenda a notificação do histórico para daqui a 'janela' segundos ou, se o
+        relato já tem uma pendente, troca o histórico dela e mantém o horário.
+        """
+        if cls.objects.filter(relato_id=historico.relato_id).update(historico=historico):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    relato_id=historico.relato_id, historico=historico,
+                    enviar_em=timezone.now() + timedelta(seconds=janela),
+                )
+        except IntegrityError:
+            # Outra requisição agendou o mesmo relato ao mesmo tempo
+            cls.objects.filter(relato_id=historico.relato_id).update(historico=historico)
+
+
+class MensagemPush(models.Model):
+    """
+    Conteúdo de uma notificação push. É gravada uma vez e entregue a cada
+    dispositivo por meio de EntregaPush (caixa de saída processada em segundo plano).
+    """
+    titulo = models.CharField(max_length=150)
+    mensagem = models.TextField()
+    url = models.CharField(max_length=255, default='/')
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Mensagem Push"
+        verbose_name_plural = "Mensagens Push"
+
+    def __str__(self):
+        return self.titulo
+
+
+class EntregaPush(models.Model):
+    """
+    Uma mensagem para um dispositivo. O despachante (webpush_service) pega as entregas
+    vencidas, envia em paralelo e reagenda as que falharam com espera exponencial.
+    """
+    STATUS_CHOICES = [
+        ('pendente', 'Pendente'),
+        ('enviando', 'Enviando'),
+        ('enviada', 'Enviada'),
+        ('falhou', 'Falhou'),
+    ]
+
+    mensagem = models.ForeignKey(MensagemPush, on_delete=models.CASCADE, related_name='entregas')
+    inscricao = models.ForeignKey(WebPushSubscription, on_delete=models.CASCADE, related_name='entregas')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pendente')
+    tentativas = models.PositiveIntegerField(default=0)
+    proxima_tentativa = models.DateTimeField(default=timezone.now)
+    ultimo_erro = models.TextField(blank=True, default='')
+    enviada_em = models.DateTimeField(null=True, blank=True)
+    reserva = models.CharField(
+        max_length=32, blank=True, default='',
+        help_text="Identifica o lote do despachante que reservou a entrega (evita envio duplicado)"
+    )
+    em_massa = models.BooleanField(
+        default=False,
+        help_text="Entrega de aviso em massa: só sai depois das notificações individuais vencidas"
+    )
+
+    class Meta:
+        verbose_name = "Entrega Push"
+        verbose_name_plural = "Entregas Push"
+        indexes = [
+            # Busca do despachante: entregas pendentes (ou com reserva vencida) por horário,
+            # primeiro as individuais e depois as de avisos em massa
+            models.Index(fields=['em_massa', 'status', 'proxima_tentativa'], name='entrega_push_fila_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.mensagem} -> {self.inscricao_id} ({self.status})"
+
+
+class AvisoBroadcast(models.Model):
+    """
+    Aviso enviado por push a um grupo de cidadãos (ex.: "Falta d'água em Inoã").
+    O público é definido pelo bairro do perfil e/ou por ter relatos abertos em uma
+    categoria; sem nenhum dos dois, vai para todos os dispositivos inscritos.
+    Depois de disparado fica 'enviando' enquanto houver entregas na fila.
+    """
+    STATUS_CHOICES = [
+        ('rascunho', 'Rascunho'),
+        ('enviando', 'Enviando'),
+        ('enviado', 'Enviado'),
+    ]
+
+    titulo = models.CharField(max_length=150)
+    mensagem = models.TextField()
+    url = models.CharField(max_length=255, default='/')
+    bairro = models.CharField(max_length=100, blank=True, default='', help_text="Bairro do perfil do cidadão")
+    categoria = models.ForeignKey(
+        CategoriaProblema, on_delete=models.SET_NULL, null=True, blank=True,
+        help_text="Cidadãos com relatos ainda abertos nesta categoria"
+    )
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='rascunho')
+    total_dispositivos = models.PositiveIntegerField(default=0)
+    mensagem_push = models.ForeignKey(MensagemPush, on_delete=models.SET_NULL, null=True, blank=True, editable=False)
+    criado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='avisos_broadcast')
+    criado_em = models.DateTimeField(auto_now_add=True)
+    disparado_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Aviso em Massa"
+        verbose_name_plural = "Avisos em Massa"
+        ordering = ['-criado_em']
+
+    def __str__(self):
+        return self.titulo
+
+    def inscricoes_alvo(self):
+        """
+        Inscrições WebPush do público do aviso (uma subconsulta, nada é carregado aqui).
+        """
+        usuarios = User.objects.all()
+        if self.bairro:
+            usuarios = usuarios.filter(perfil__bairro__iexact=self.bairro)
+        if self.categoria_id:
+            # Mesmo filter(): categoria e status se referem ao mesmo relato
+            usuarios = usuarios.filter(
+                relatos__categoria_id=self.categoria_id,
+                relatos__status_atual__in=[
+                    codigo for codigo, _ in RelatoZeladoria.STATUS_CHOICES
+                    if codigo not in RelatoZeladoria.STATUS_ENCERRADOS
+                ],
+            )
+        return WebPushSubscription.objects.filter(user__in=usuarios.values('pk'))
+
+    def resumo_entregas(self):
+        if not self.mensagem_push_id:
+            return {}
+        return dict(
+            EntregaPush.objects.filter(mensagem_id=self.mensagem_push_id)
+            .values_list('status').annotate(total=Count('id')).order_by()
+        )
+
+
+class EstatisticaDiaria(models.Model):
+    """
+    Contagem materializada de relatos por dia de criação, status, categoria e bairro.
+    Mantida de forma incremental pelos signals de RelatoZeladoria para que o
+    dashboard não precise agrupar a tabela inteira de relatos a cada acesso.
+    """
+    data = models.DateField(help_text="Dia de criação dos relatos")
+    status = models.CharField(max_length=20, choices=RelatoZeladoria.STATUS_CHOICES)
+    categoria = models.ForeignKey(CategoriaProblema, on_delete=models.CASCADE, related_name='estatisticas')
+    bairro = models.CharField(max_length=150, blank=True, default='')
+    total = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Estatística Diária"
+        verbose_name_plural = "Estatísticas Diárias"
+        constraints = [
+            models.UniqueConstraint(fields=['data', 'status', 'categoria', 'bairro'], name='estatistica_diaria_unica'),
+        ]
+        indexes = [
+            models.Index(fields=['bairro', 'data'], name='estatistica_bairro_data_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.data} - {self.status} - {self.total}"
+
+    @classmethod
+    def ajustar(cls, chave, delta):
+        """
+        Soma 'delta' à linha da chave (data, status, categoria_id, bairro), criando-a se preciso.
+        """
+        data, status, categoria_id, bairro = chave
+        filtro = dict(data=data, status=status, categoria_id=categoria_id, bairro=bairro)
+
+        if delta < 0:
+            # Nunca abaixo de zero: sem linha (ou com total menor) a contagem já estava
+            # defasada, e a linha é recontada a partir dos relatos
+            if not cls.objects.filter(total__gte=-delta, **filtro).update(total=F('total') + delta):
+                cls.recontar(chave)
+            return
+
+        if cls.objects.filter(**filtro).update(total=F('total') + delta):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(total=delta, **filtro)
+        except IntegrityError:
+            # Outra requisição criou a linha ao mesmo tempo
+            cls.objects.filter(**filtro).update(total=F('total') + delta)
+
+    @classmethod
+    def recontar(cls, chave):
+        """
+        Refaz a contagem de uma única linha (data, status, categoria_id, bairro).
+        """
+        data, status, categoria_id, bairro = chave
+        relatos = RelatoZeladoria.objects.filter(criado_em__date=data, status_atual=status, categoria_id=categoria_id)
+        # bairro nulo e vazio caem na mesma linha
+        relatos = relatos.filter(Q(bairro=bairro) | Q(bairro__isnull=True)) if not bairro else relatos.filter(bairro=bairro)
+        cls.objects.update_or_create(
+            data=data, status=status, categoria_id=categoria_id, bairro=bairro,
+            defaults={'total': relatos.count()},
+        )
+
+    @classmethod
+    def recalcular(cls):
+        """
+        Reconstrói a tabela inteira a partir de RelatoZeladoria.
+        """
+        linhas = RelatoZeladoria.objects.annotate(
+            dia=TruncDate('criado_em')
+        ).values('dia', 'status_atual', 'categoria_id', 'bairro').annotate(
+            quantidade=Count('id')
+        ).order_by()
+
+        agregado = {}
+        for linha in linhas:
+            # bairro nulo e vazio caem na mesma linha
+            chave = (linha['dia'], linha['status_atual'], linha['categoria_id'], linha['bairro'] or '')
+            agregado[chave] = agregado.get(chave, 0) + linha['quantidade']
+
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create([
+                cls(data=data, status=status, categoria_id=categoria_id, bairro=bairro, total=total)
+                for (data, status, categoria_id, bairro), total in agregado.items()
+            ], batch_size=1000)
+        return len(agregado)
+
+
+class VersaoDados(models.Model):
+    """
+    Contador de versão por conjunto de dados público ('relatos', 'categorias').
+    É incrementado pelos signals a cada escrita e usado para gerar ETag e
+    Last-Modified sem precisar executar a consulta principal.
+    """
+    chave = models.CharField(max_length=50, unique=True)
+    versao = models.BigIntegerField(default=1)
+    atualizado_em = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Versão dos Dados"
+        verbose_name_plural = "Versões dos Dados"
+
+    def __str__(self):
+        return f"{self.chave} v{self.versao}"
+
+    @classmethod
+    def incrementar(cls, chave):
+        if not cls.objects.filter(chave=chave).update(versao=F('versao') + 1, atualizado_em=timezone.now()):
+            cls.obter(chave)
+
+    @classmethod
+    def obter(cls, chave):
+        """
+        Retorna (versao, atualizado_em), criando o contador na primeira consulta.
+        """
+        versao, _ = cls.objects.get_or_create(chave=chave)
+        return versao.versao, versao.atualizado_em
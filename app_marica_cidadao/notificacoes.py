@@ -0,0 +1,127 @@
+"""
+Notificações ao cidadão quando o status do relato muda.
+Cada novo HistoricoStatus gera um único evento, montado a partir de uma só consulta
+(histórico + relato + categoria + cidadão + perfil) e entregue aos canais de
+NOTIFICACOES_CANAIS. O agrupamento acontece antes da distribuição: mudanças do
+mesmo relato dentro de NOTIFICACOES_JANELA_SEGUNDOS ficam em NotificacaoPendente
+e só o status mais recente chega a cada canal (push e WhatsApp).
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+from .models import HistoricoStatus, PerfilCidadao, NotificacaoPendente
+
+
+def agendar_notificacao_status(historico):
+    """
+    Chamado pelo signal de criação do HistoricoStatus, dentro da transação da mudança:
+    um rollback no admin desfaz o agendamento e não avisa o cidadão.
+    Sem janela, a notificação sai logo após o commit; com janela, quem envia é o
+    despachante (webpush_service.DespachantePush ou o comando processar_fila_push).
+    """
+    janela = getattr(settings, 'NOTIFICACOES_JANELA_SEGUNDOS', 15)
+    if not janela:
+        transaction.on_commit(lambda: notificar_mudanca_status(historico.pk))
+        return
+
+    from .webpush_service import acordar_despachante
+
+    NotificacaoPendente.agendar(historico, janela)
+    transaction.on_commit(acordar_despachante)
+
+
+def processar_notificacoes_pendentes():
+    """
+    Distribui as notificações cuja janela venceu. Cada uma sai da tabela por um
+    DELETE condicionado ao histórico lido: se outra mudança chegou nesse meio tempo,
+    a notificação fica para a próxima rodada, já com o status novo.
+    Retorna quantas foram distribuídas.
+    """
+    vencidas = NotificacaoPendente.objects.filter(enviar_em__lte=timezone.now()).values_list('pk', 'historico_id')
+    distribuidas = 0
+    for pk, historico_id in list(vencidas):
+        removidas, _ = NotificacaoPendente.objects.filter(pk=pk, historico_id=historico_id).delete()
+        if removidas:
+            notificar_mudanca_status(historico_id)
+            distribuidas += 1
+    return distribuidas
+
+
+def segundos_ate_proxima_notificacao(maximo=60):
+    proxima = NotificacaoPendente.objects.aggregate(proxima=Min('enviar_em'))['proxima']
+    if proxima is None:
+        return maximo
+    return min(maximo, max(0.0, (proxima - timezone.now()).total_seconds()))
+
+
+def notificar_mudanca_status(historico_id):
+    try:
+        historico = HistoricoStatus.objects.select_related(
+            'relato__categoria', 'relato__cidadao__perfil'
+        ).get(pk=historico_id)
+    except HistoricoStatus.DoesNotExist:
+        return
+
+    evento = montar_evento(historico)
+    for nome in getattr(settings, 'NOTIFICACOES_CANAIS', ['push', 'whatsapp']):
+        canal = CANAIS.get(nome.strip())
+        if canal is None:
+            print(f"Aviso: canal de notificação desconhecido: {nome}")
+            continue
+        try:
+            canal(evento)
+        except Exception as e:
+            print(f"Aviso: Falha ao notificar pelo canal {nome}: {str(e)}")
+
+
+def montar_evento(historico):
+    """
+    Tudo o que os canais precisam, já resolvido (nenhum canal volta ao banco pelo relato).
+    """
+    relato = historico.relato
+    cidadao = relato.cidadao
+    try:
+        telefone = cidadao.perfil.telefone or 'Não cadastrado'
+    except PerfilCidadao.DoesNotExist:
+        telefone = 'Não cadastrado'
+
+    return {
+        'relato_id': relato.id,
+        'cidadao': cidadao,
+        'nome': cidadao.first_name or cidadao.username,
+        'telefone': telefone,
+        'categoria': relato.categoria.nome,
+        'status': historico.get_status_display(),
+        'observacao': historico.observacao_prefeitura,
+    }
+
+
+def enviar_push(evento):
+    from .webpush_service import enfileirar_notificacao_push
+
+    mensagem = f"O status do seu chamado '{evento['categoria']}' mudou para: {evento['status']}."
+    if evento['observacao']:
+        mensagem += f"\nObs: {evento['observacao']}"
+
+    enfileirar_notificacao_push(
+        user=evento['cidadao'],
+        title="Maricá Cidadão - Atualização",
+        message=mensagem,
+        url="/",
+    )
+
+
+def enviar_whatsapp_simulado(evento):
+    print(f"\n--- [SIMULAÇÃO WHATSAPP] ---")
+    print(f"Para: {evento['telefone']}")
+    print(f"Mensagem: Olá {evento['nome']}, o status do seu relato #{evento['relato_id']} ({evento['categoria']}) mudou para: {evento['status']}.")
+    if evento['observacao']:
+        print(f"Observação da Prefeitura: {evento['observacao']}")
+    print(f"--- FIM DA SIMULAÇÃO ---\n")
+
+
+CANAIS = {
+    'push': enviar_push,
+    'whatsapp': enviar_whatsapp_simulado,
+}
@@ -1,8 +1,12 @@
 from rest_framework import serializers
 
 from django.contrib.auth.models import User
-from .models import CategoriaProblema, RelatoZeladoria, HistoricoStatus, PerfilCidadao
+from .models import CategoriaProblema, RelatoZeladoria, HistoricoStatus, PerfilCidadao, AvisoBroadcast
 from django.db import transaction
+from django.conf import settings
+from django.utils import timezone
+from datetime import timedelta
+from .geo import relatos_no_raio
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -65,6 +69,22 @@ class CategoriaProblemaSerializer(serializers.ModelSerializer):
         fields = ['id', 'nome', 'descricao', 'emoji']
 
 
+class AvisoBroadcastSerializer(serializers.ModelSerializer):
+    entregas = serializers.SerializerMethodField()
+
+    class Meta:
+        model = AvisoBroadcast
+        fields = [
+            'id', 'titulo', 'mensagem', 'url', 'bairro', 'categoria',
+            'status', 'total_dispositivos', 'entregas', 'criado_em', 'disparado_em'
+        ]
+        read_only_fields = ['status', 'total_dispositivos', 'criado_em', 'disparado_em']
+
+    def get_entregas(self, obj):
+        # Contagem por status (pendente, enviando, enviada, falhou)
+        return obj.resumo_entregas()
+
+
 class HistoricoStatusSerializer(serializers.ModelSerializer):
     class Meta:
         model = HistoricoStatus
@@ -78,6 +98,7 @@ class RelatoZeladoriaSerializer(serializers.ModelSerializer):
     categoria_nome = serializers.CharField(source='categoria.nome', read_only=True)
     categoria_emoji = serializers.CharField(source='categoria.emoji', read_only=True)
     status_display = serializers.CharField(source='get_status_atual_display', read_only=True)
+    possiveis_duplicados = serializers.SerializerMethodField()
 
     class Meta:
         model = RelatoZeladoria
@@ -86,10 +107,20 @@ class RelatoZeladoriaSerializer(serializers.ModelSerializer):
             'endereco_aproximado', 'status_atual', 'status_display', 'criado_em',
             'historico', 'latitude', 'longitude', 'avaliacao', 'comentario_cidadao',
             'e_propriedade_privada', 'comprovante_titularidade', 'aceite_termo_ambiental',
-            'prioridade', 'justificativa_ia'
+            'prioridade', 'justificativa_ia', 'relato_original', 'possiveis_duplicados'
         ]
         # O cidadão não pode alterar o status ou a data de criação manualmente
-        read_only_fields = ['status_atual', 'criado_em']
+        read_only_fields = ['status_atual', 'criado_em', 'relato_original']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Listagens da fila podem dispensar o histórico aninhado (?historico=0)
+        if self.context.get('omitir_historico'):
+            self.fields.pop('historico', None)
+
+    def get_possiveis_duplicados(self, obj):
+        # Preenchido apenas na criação (ver buscar_duplicados)
+        return getattr(obj, 'possiveis_duplicados', [])
 
     def validate(self, data):
         """
@@ -111,11 +142,49 @@ class RelatoZeladoriaSerializer(serializers.ModelSerializer):
         
         return data
 
+    def buscar_duplicados(self, validated_data):
+        """
+        Procura relatos abertos da mesma categoria perto do novo relato,
+        criados dentro da janela configurada. Usa o índice (categoria, geohash);
+        a ordenação por distância é feita em relatos_no_raio.
+        """
+        latitude = validated_data.get('latitude')
+        longitude = validated_data.get('longitude')
+        if latitude is None or longitude is None:
+            return []
+
+        raio = getattr(settings, 'DUPLICIDADE_RAIO_METROS', 30)
+        janela_dias = getattr(settings, 'DUPLICIDADE_JANELA_DIAS', 30)
+
+        candidatos = RelatoZeladoria.objects.filter(
+            categoria=validated_data['categoria'],
+            criado_em__gte=timezone.now() - timedelta(days=janela_dias),
+            relato_original__isnull=True,
+        ).exclude(
+            status_atual__in=RelatoZeladoria.STATUS_ENCERRADOS
+        ).only('id', 'latitude', 'longitude', 'status_atual', 'criado_em').order_by()
+
+        return relatos_no_raio(candidatos, latitude, longitude, raio)
+
     def create(self, validated_data):
         # Pega o usuário logado automaticamente da requisição
         validated_data['cidadao'] = self.context['request'].user
+
+        duplicados = self.buscar_duplicados(validated_data)
+        if duplicados:
+            # Vincula ao relato aberto mais próximo
+            validated_data['relato_original'] = duplicados[0][0]
         
         relato = super().create(validated_data)
+        relato.possiveis_duplicados = [
+            {
+                'id': candidato.id,
+                'status_atual': candidato.status_atual,
+                'distancia_metros': round(distancia, 1),
+                'criado_em': candidato.criado_em,
+            }
+            for candidato, distancia in duplicados[:5]
+        ]
         
         # Cria a primeira entrada de histórico automaticamente
         HistoricoStatus.objects.create(
@@ -1,33 +1,79 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import HistoricoStatus
+from .models import HistoricoStatus, RelatoZeladoria, EstatisticaDiaria, CategoriaProblema, VersaoDados
+from .estatisticas import invalidar_cache_dashboard
+from .notificacoes import agendar_notificacao_status
+from .transicoes import sincronizar_status
+
+
+@receiver(post_save, sender=RelatoZeladoria)
+def atualizar_estatisticas_relato(sender, instance, created, raw=False, **kwargs):
+    """
+    Mantém EstatisticaDiaria em dia: +1 na criação e, quando status, categoria
+    ou bairro mudam, move a contagem da linha antiga para a nova.
+    """
+    if raw:
+        return
+    chave_nova = instance.chave_estatistica()
+    chave_antiga = getattr(instance, '_chave_estatistica_original', None)
+
+    if created:
+        EstatisticaDiaria.ajustar(chave_nova, 1)
+    elif chave_antiga is not None and chave_antiga != chave_nova:
+        EstatisticaDiaria.ajustar(chave_antiga, -1)
+        EstatisticaDiaria.ajustar(chave_nova, 1)
+
+    instance._chave_estatistica_original = chave_nova
+
+
+@receiver(post_delete, sender=RelatoZeladoria)
+def remover_estatisticas_relato(sender, instance, **kwargs):
+    chave = getattr(instance, '_chave_estatistica_original', None) or instance.chave_estatistica()
+    EstatisticaDiaria.ajustar(chave, -1)
+
 
 @receiver(post_save, sender=HistoricoStatus)
-def notificar_mudanca_status(sender, instance, created, **kwargs):
+def notificar_mudanca_status(sender, instance, created, raw=False, **kwargs):
     """
     Sempre que um novo histórico de status é criado:
-    1. Atualiza o status_atual do RelatoZeladoria vinculado.
-    2. Envia uma notificação simulada ao cidadão.
+    1. Atualiza o status_atual do RelatoZeladoria vinculado, se ainda não foi
+       atualizado (históricos criados por transicoes.mudar_status já chegam
+       sincronizados; ver transicoes.py para os dois caminhos).
+    2. Agenda a notificação ao cidadão (push e WhatsApp simulado, ver notificacoes.py).
     """
-    if created:
-        relato = instance.relato
-        
+    if created and not raw:
         # 1. Sincronização de Status (Garante que o frontend veja a mudança)
-        if relato.status_atual != instance.status:
-            relato.status_atual = instance.status
-            relato.save(update_fields=['status_atual', 'atualizado_em'])
-            print(f"INFO: Status do Relato #{relato.id} sincronizado para: {instance.status}")
-
-        cidadao = relato.cidadao
-        # Tenta pegar o telefone do PerfilCidadao de forma segura
-        perfil = getattr(cidadao, 'perfil', None)
-        telefone = getattr(perfil, 'telefone', 'Não cadastrado') if perfil else 'Não cadastrado'
-        
-        status_msg = instance.get_status_display()
-        
-        print(f"\n--- [SIMULAÇÃO WHATSAPP] ---")
-        print(f"Para: {telefone}")
-        print(f"Mensagem: Olá {cidadao.first_name or cidadao.username}, o status do seu relato #{relato.id} ({relato.categoria.nome}) mudou para: {status_msg}.")
-        if instance.observacao_prefeitura:
-            print(f"Observação da Prefeitura: {instance.observacao_prefeitura}")
-        print(f"--- FIM DA SIMULAÇÃO ---\n")
+        if sincronizar_status(instance):
+            print(f"INFO: Status do Relato #{instance.relato_id} sincronizado para: {instance.status}")
+
+        agendar_notificacao_status(instance)
+
+
+@receiver(post_save, sender=RelatoZeladoria)
+@receiver(post_delete, sender=RelatoZeladoria)
+def versionar_relatos(sender, **kwargs):
+    if not kwargs.get('raw', False):
+        VersaoDados.incrementar('relatos')
+
+
+@receiver(post_save, sender=CategoriaProblema)
+@receiver(post_delete, sender=CategoriaProblema)
+def versionar_categorias(sender, **kwargs):
+    if not kwargs.get('raw', False):
+        VersaoDados.incrementar('categorias')
+        # O mapa público mostra o nome e o emoji da categoria
+        VersaoDados.incrementar('relatos')
+
+
+@receiver(post_save, sender=RelatoZeladoria)
+@receiver(post_delete, sender=RelatoZeladoria)
+def limpar_cache_dashboard(sender, **kwargs):
+    """
+    Qualquer relato novo, alterado ou removido muda os números do dashboard.
+    Um novo histórico só muda o dashboard ao levar o status para o relato, e aí
+    o save do relato já invalida. Fica por último no módulo para rodar depois
+    da atualização de EstatisticaDiaria.
+    """
+    if not kwargs.get('raw', False):
+        invalidar_cache_dashboard()
+
@@ -0,0 +1,904 @@
+import base64
+import io
+import json
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock, skipUnless
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from django.contrib.admin import site as admin_site
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models import F
+from django.forms import modelform_factory
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+import PIL.Image
+from . import ai_service
+from .admin import RelatoZeladoriaAdmin
+from .ai_service import DisjuntorIA
+from .models import (
+    CategoriaProblema, RelatoZeladoria, HistoricoStatus, AnaliseFoto, CacheAnaliseIA, PerfilCidadao,
+    WebPushSubscription, AvisoBroadcast, MensagemPush, EntregaPush, VersaoDados, EstatisticaDiaria, NotificacaoPendente,
+)
+from . import notificacoes
+from .notificacoes import processar_notificacoes_pendentes
+from .transicoes import mudar_status
+from .webpush_service import processar_fila_push
+from .estatisticas import cache_dashboard, calcular_estatisticas
+from .management.commands.retriagem_ia import Command as RetriagemCommand
+from .geo import BASE32, codificar_geohash, proximo_prefixo, filtro_bbox
+
+
+class ConsultasRelatosAPITest(TestCase):
+    """
+    A lista /api/relatos/ tem de custar um número fixo de consultas,
+    qualquer que seja o tamanho da página (sem N+1 em categoria ou histórico).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.servidor = User.objects.create_user('servidor', password='x', is_staff=True)
+        cls.token = Token.objects.create(user=cls.servidor)
+        cidadao = User.objects.create_user('cidadao', password='x')
+        categorias = [
+            CategoriaProblema.objects.create(nome=f'Categoria {i}', emoji='🕳️', tempo_estimado_resolucao=3)
+            for i in range(3)
+        ]
+        historicos = []
+        for i in range(30):
+            relato = RelatoZeladoria.objects.create(
+                cidadao=cidadao,
+                categoria=categorias[i % len(categorias)],
+                descricao=f'Relato {i}',
+                latitude=-22.92 + i * 0.001,
+                longitude=-42.82,
+                bairro='Centro',
+                status_atual='em_analise',
+            )
+            historicos += [
+                HistoricoStatus(relato=relato, status='recebido'),
+                HistoricoStatus(relato=relato, status='em_analise', atualizado_por=cls.servidor),
+            ]
+        # Sem signals: o status já foi gravado no relato e nenhuma notificação interessa aqui
+        HistoricoStatus.objects.bulk_create(historicos)
+
+    def listar(self, **params):
+        resposta = self.client.get('/api/relatos/', params, HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(resposta.status_code, 200)
+        return resposta.json()
+
+    def test_com_historico_consultas_fixas(self):
+        # token + página de relatos (com categoria) + prefetch do histórico
+        for limite in (5, 25):
+            with self.assertNumQueries(3):
+                dados = self.listar(limite=limite)
+            self.assertEqual(len(dados['results']), limite)
+            self.assertEqual(len(dados['results'][0]['historico']), 2)
+
+    def test_filtros_invalidos_respondem_400(self):
+        for nome, valor in [('categoria', 'abc'), ('data_inicio', '2024-13-01'), ('data_fim', 'ontem')]:
+            resposta = self.client.get('/api/relatos/', {nome: valor}, HTTP_AUTHORIZATION=f'Token {self.token.key}')
+            self.assertEqual(resposta.status_code, 400, f'{nome}={valor}')
+            self.assertIn(nome, resposta.json())
+
+    def test_sem_historico_consultas_fixas(self):
+        # token + página de relatos (com categoria)
+        for limite in (5, 25):
+            with self.assertNumQueries(2):
+                dados = self.listar(limite=limite, historico=0)
+            self.assertEqual(len(dados['results']), limite)
+            self.assertNotIn('historico', dados['results'][0])
+
+
+class IntervaloGeohashTest(TestCase):
+    """
+    O limite superior do intervalo de um prefixo usa só caracteres do alfabeto
+    geohash, então a ordem não depende da collation do banco.
+    """
+
+    def test_proximo_prefixo(self):
+        self.assertEqual(proximo_prefixo('75cm'), '75cn')
+        self.assertEqual(proximo_prefixo('75cz'), '75d')
+        self.assertEqual(proximo_prefixo('7zz'), '8')
+        self.assertIsNone(proximo_prefixo('zz'))
+
+    def test_intervalo_contem_exatamente_o_prefixo(self):
+        geohash = codificar_geohash(-22.92, -42.82)
+        for tamanho in range(1, len(geohash) + 1):
+            prefixo = geohash[:tamanho]
+            limite = proximo_prefixo(prefixo)
+            self.assertTrue(prefixo <= geohash < limite)
+            self.assertTrue(all(c in BASE32 for c in limite))
+
+    def test_filtro_bbox_encontra_relatos_da_area(self):
+        cidadao = User.objects.create_user('cidadao', password='x')
+        categoria = CategoriaProblema.objects.create(nome='Buraco', tempo_estimado_resolucao=3)
+        dentro = [
+            RelatoZeladoria.objects.create(
+                cidadao=cidadao, categoria=categoria, descricao='x',
+                latitude=-22.92 + i * 0.002, longitude=-42.82 + i * 0.002,
+            )
+            for i in range(5)
+        ]
+        RelatoZeladoria.objects.create(cidadao=cidadao, categoria=categoria, descricao='x', latitude=-22.5, longitude=-43.2)
+
+        encontrados = RelatoZeladoria.objects.filter(filtro_bbox(-42.83, -22.93, -42.80, -22.90))
+        self.assertCountEqual(encontrados, dentro)
+
+
+class DuplicadosRelatoTest(TestCase):
+    """
+    Um relato novo da mesma categoria a poucos metros de um aberto é ligado a ele
+    (busca pelo intervalo de geohash, ver IntervaloGeohashTest).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cidadao = User.objects.create_user('cidadao', password='x')
+        cls.token = Token.objects.create(user=cls.cidadao)
+        cls.categoria = CategoriaProblema.objects.create(nome='Buraco', tempo_estimado_resolucao=3)
+        cls.original = RelatoZeladoria.objects.create(
+            cidadao=cls.cidadao, categoria=cls.categoria, descricao='Buraco grande',
+            latitude=-22.91900, longitude=-42.81900,
+        )
+
+    def criar(self, latitude, longitude):
+        resposta = self.client.post('/api/relatos/', {
+            'categoria': self.categoria.id,
+            'descricao': 'Mesmo buraco',
+            'latitude': latitude,
+            'longitude': longitude,
+        }, HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(resposta.status_code, 201, resposta.content)
+        return resposta.json()
+
+    def test_relato_proximo_aponta_para_o_original(self):
+        # ~10 m ao norte
+        dados = self.criar(-22.91891, -42.81900)
+        self.assertEqual(dados['relato_original'], self.original.id)
+        self.assertEqual([d['id'] for d in dados['possiveis_duplicados']], [self.original.id])
+
+    def test_relato_distante_nao_e_duplicado(self):
+        # ~1 km de distância
+        dados = self.criar(-22.92800, -42.81900)
+        self.assertIsNone(dados['relato_original'])
+        self.assertEqual(dados['possiveis_duplicados'], [])
+
+
+class ParametrosMapaPublicoTest(TestCase):
+    """
+    Parâmetros malformados do mapa público respondem 400 com mensagem, nunca 500.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cidadao = User.objects.create_user('cidadao', password='x')
+        cls.categoria = CategoriaProblema.objects.create(nome='Buraco', tempo_estimado_resolucao=3)
+        RelatoZeladoria.objects.create(
+            cidadao=cidadao, categoria=cls.categoria, descricao='x', latitude=-22.92, longitude=-42.82,
+        )
+
+    def test_parametros_invalidos(self):
+        for nome, valor in [
+            ('categoria', 'abc'), ('zoom', 'perto'), ('zoom', '30'), ('cursor', '1.5'),
+            ('limite', 'muitos'), ('limite', '0'), ('limite', '-3'), ('bbox', '1,2,3'), ('bbox', '-42.9,-22.9,x,-22.8'),
+        ]:
+            resposta = self.client.get('/api/public/relatos/', {nome: valor})
+            self.assertEqual(resposta.status_code, 400, f'{nome}={valor}')
+            self.assertIn('error', resposta.json())
+
+    def test_parametros_validos(self):
+        resposta = self.client.get('/api/public/relatos/', {
+            'categoria': self.categoria.id, 'zoom': 15, 'limite': 10,
+            'bbox': '-42.83,-22.93,-42.81,-22.91',
+        })
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(len(resposta.json()['resultados']), 1)
+
+
+    def test_formato_colunar(self):
+        resposta = self.client.get('/api/public/relatos/', {'formato': 'colunar', 'zoom': 15})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertTrue(resposta['Content-Type'].startswith('application/vnd.marica.colunar+json'))
+        dados = json.loads(resposta.content)
+        self.assertEqual(dados['categorias'], [{'nome': 'Buraco', 'emoji': None}])
+        colunas = dados['colunas']
+        self.assertEqual(len(colunas['id']), 1)
+        self.assertEqual(colunas['categoria'], [0])
+        self.assertEqual(dados['status'][colunas['status'][0]], 'Recebido')
+        self.assertEqual(colunas['latitude'], [-22.92])
+
+    def test_content_type_acompanha_o_formato(self):
+        colunar = 'application/vnd.marica.colunar+json'
+        resposta = self.client.get('/api/public/relatos/', {'formato': 'linhas'}, HTTP_ACCEPT=colunar)
+        self.assertTrue(resposta['Content-Type'].startswith('application/json'))
+        self.assertIn('resultados', json.loads(resposta.content))
+
+        resposta = self.client.get('/api/public/relatos/', HTTP_ACCEPT=colunar)
+        self.assertTrue(resposta['Content-Type'].startswith(colunar))
+        self.assertIn('colunas', json.loads(resposta.content))
+
+
+@override_settings(MAPA_PUBLICO_LIMITE_MAXIMO=5, MAPA_ZOOM_MINIMO_PONTOS=14)
+class ClustersMapaPublicoTest(TestCase):
+    """
+    O modo cluster nunca devolve mais que MAPA_PUBLICO_LIMITE_MAXIMO células,
+    mesmo sem bbox e com o zoom máximo.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cidadao = User.objects.create_user('cidadao', password='x')
+        categoria = CategoriaProblema.objects.create(nome='Buraco', tempo_estimado_resolucao=3)
+        # 12 relatos a ~2 km uns dos outros (células diferentes até no zoom 13)
+        RelatoZeladoria.objects.bulk_create([
+            RelatoZeladoria(
+                cidadao=cidadao, categoria=categoria, descricao='x',
+                latitude=-22.92 + i * 0.02, longitude=-42.82, geohash=codificar_geohash(-22.92 + i * 0.02, -42.82),
+            )
+            for i in range(12)
+        ])
+
+    def test_clusters_limitados_no_zoom_maximo(self):
+        for formato in ('linhas', 'colunar'):
+            resposta = self.client.get('/api/public/relatos/', {'modo': 'cluster', 'zoom': 22, 'formato': formato})
+            self.assertEqual(resposta.status_code, 200)
+            dados = resposta.json()
+            totais = dados['clusters'] if formato == 'linhas' else dados['colunas']['total']
+            self.assertEqual(len(totais), 5)
+            self.assertTrue(dados['truncado'])
+
+    def test_zoom_de_pontos_agrupa_como_o_zoom_anterior(self):
+        # ~10 m entre um e outro: células diferentes no zoom 22, a mesma no zoom 13
+        for i, relato in enumerate(RelatoZeladoria.objects.all()):
+            RelatoZeladoria.objects.filter(pk=relato.pk).update(latitude=-22.92 + i * 0.0001, longitude=-42.82)
+        resposta = self.client.get('/api/public/relatos/', {'modo': 'cluster', 'zoom': 22})
+        dados = resposta.json()
+        self.assertEqual([c['total'] for c in dados['clusters']], [12])
+        self.assertFalse(dados['truncado'])
+
+
+class CacheAnaliseIATest(TestCase):
+    HASH = 'a' * 64
+    DHASH = '0123456789abcdef'
+
+    def test_guardar_renova_entrada_vencida(self):
+        validade = timezone.now() - timedelta(days=30)
+        CacheAnaliseIA.guardar(self.HASH, self.DHASH, {'prioridade': 'baixa'}, validade, 100)
+        CacheAnaliseIA.objects.update(criado_em=validade - timedelta(days=1))
+
+        CacheAnaliseIA.guardar(self.HASH, self.DHASH, {'prioridade': 'alta'}, validade, 100)
+
+        self.assertEqual(CacheAnaliseIA.buscar(self.HASH, self.DHASH, validade), {'prioridade': 'alta'})
+
+
+@override_settings(WEBPUSH_BACKEND='fake', WEBPUSH_DESPACHANTE_EMBUTIDO=False)
+class AvisoBroadcastTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.servidor = User.objects.create_user('servidor', password='x', is_staff=True)
+        cls.token = Token.objects.create(user=cls.servidor)
+        for i, bairro in enumerate(['Centro', 'Centro', 'Inoã']):
+            cidadao = User.objects.create_user(f'cidadao{i}', password='x')
+            PerfilCidadao.objects.create(user=cidadao, cpf=f'000.000.000-0{i}', bairro=bairro)
+            WebPushSubscription.objects.create(user=cidadao, endpoint=f'https://push.example/{i}', p256dh='k', auth='a')
+
+    def criar(self, **dados):
+        return self.client.post(
+            '/api/avisos/', {'titulo': 'Falta d\'água', 'mensagem': 'Previsão: 18h', **dados},
+            content_type='application/json', HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+
+    def test_aviso_fica_enviando_ate_a_fila_esvaziar(self):
+        resposta = self.criar(bairro='centro')
+        self.assertEqual(resposta.status_code, 201)
+        dados = resposta.json()
+        self.assertEqual((dados['status'], dados['total_dispositivos']), ('enviando', 2))
+
+        processar_fila_push()
+
+        aviso = AvisoBroadcast.objects.get(pk=dados['id'])
+        self.assertEqual(aviso.status, 'enviado')
+        self.assertEqual(aviso.resumo_entregas(), {'enviada': 2})
+
+    @override_settings(WEBPUSH_BACKEND='pywebpush', VAPID_PRIVATE_KEY='')
+    def test_push_nao_configurado_responde_503(self):
+        resposta = self.criar()
+        self.assertEqual(resposta.status_code, 503)
+        self.assertFalse(AvisoBroadcast.objects.exists())
+
+    @override_settings(WEBPUSH_BACKEND='pywebpush', VAPID_PRIVATE_KEY='')
+    def test_acao_do_admin_avisa_quando_push_nao_configurado(self):
+        self.servidor.is_superuser = True
+        self.servidor.save()
+        aviso = AvisoBroadcast.objects.create(titulo='Obras', mensagem='Rua fechada', criado_por=self.servidor)
+        self.client.force_login(self.servidor)
+
+        resposta = self.client.post('/admin/app_marica_cidadao/avisobroadcast/', {
+            'action': 'disparar_avisos', '_selected_action': [aviso.pk],
+        }, follow=True)
+
+        self.assertContains(resposta, 'Push não configurado')
+        aviso.refresh_from_db()
+        self.assertEqual(aviso.status, 'rascunho')
+
+
+@override_settings(
+    WEBPUSH_BACKEND='fake', WEBPUSH_DESPACHANTE_EMBUTIDO=False,
+    NOTIFICACOES_CANAIS=['push', 'whatsapp'], NOTIFICACOES_JANELA_SEGUNDOS=60,
+)
+class AgrupamentoNotificacoesTest(TestCase):
+    """
+    Mudanças seguidas do mesmo relato são agrupadas antes da distribuição:
+    cada canal recebe uma única notificação, com o status mais recente.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cidadao = User.objects.create_user('cidadao', password='x')
+        WebPushSubscription.objects.create(user=cls.cidadao, endpoint='https://push.example/1', p256dh='k', auth='a')
+        categoria = CategoriaProblema.objects.create(nome='Buraco', emoji='🕳️', tempo_estimado_resolucao=3)
+        cls.relato = RelatoZeladoria.objects.create(
+            cidadao=cls.cidadao, categoria=categoria, descricao='Relato', latitude=-22.92, longitude=-42.82,
+        )
+
+    def setUp(self):
+        self.whatsapp = mock.Mock()
+        canais = mock.patch.dict(notificacoes.CANAIS, {'whatsapp': self.whatsapp})
+        canais.start()
+        self.addCleanup(canais.stop)
+
+    def vencer_janela(self):
+        NotificacaoPendente.objects.update(enviar_em=timezone.now())
+
+    def test_mudancas_seguidas_viram_uma_notificacao_por_canal(self):
+        mudar_status(self.relato, 'em_analise')
+        primeira = NotificacaoPendente.objects.get().enviar_em
+        mudar_status(self.relato, 'resolvido', observacao='Buraco tapado')
+
+        pendente = NotificacaoPendente.objects.get()
+        self.assertEqual(pendente.enviar_em, primeira)
+        # Nada sai antes de a janela vencer
+        self.assertEqual(processar_notificacoes_pendentes(), 0)
+        self.assertFalse(EntregaPush.objects.exists())
+        self.whatsapp.assert_not_called()
+
+        self.vencer_janela()
+        self.assertEqual(processar_notificacoes_pendentes(), 1)
+
+        self.assertIn('Resolvido', EntregaPush.objects.select_related('mensagem').get().mensagem.mensagem)
+        self.whatsapp.assert_called_once()
+        evento = self.whatsapp.call_args.args[0]
+        self.assertEqual((evento['status'], evento['observacao']), ('Resolvido', 'Buraco tapado'))
+        self.assertFalse(NotificacaoPendente.objects.exists())
+        self.assertEqual(processar_notificacoes_pendentes(), 0)
+
+    def test_mudanca_desfeita_nao_substitui_a_notificacao(self):
+        mudar_status(self.relato, 'em_analise')
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                mudar_status(self.relato, 'resolvido')
+                raise RuntimeError('queda')
+
+        self.vencer_janela()
+        processar_notificacoes_pendentes()
+
+        self.whatsapp.assert_called_once()
+        self.assertEqual(self.whatsapp.call_args.args[0]['status'], 'Em Análise')
+
+
+class VersaoDadosETagTest(TestCase):
+    """
+    GET condicional do mapa público e das categorias (responder_com_versao).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cidadao = User.objects.create_user('cidadao', password='x')
+        cls.categoria = CategoriaProblema.objects.create(nome='Buraco', tempo_estimado_resolucao=3)
+
+    def test_if_none_match_responde_304_com_validadores(self):
+        for url in ('/api/public/relatos/', '/api/categorias/'):
+            primeira = self.client.get(url)
+            self.assertEqual(primeira.status_code, 200)
+
+            resposta = self.client.get(url, HTTP_IF_NONE_MATCH=primeira['ETag'])
+            self.assertEqual(resposta.status_code, 304)
+            self.assertEqual(resposta['ETag'], primeira['ETag'])
+            self.assertEqual(resposta['Last-Modified'], primeira['Last-Modified'])
+            self.assertIn('Accept', resposta['Vary'])
+            self.assertEqual(resposta.content, b'')
+
+    def test_escrita_gera_nova_versao(self):
+        primeira = self.client.get('/api/public/relatos/')
+        versao = VersaoDados.obter('relatos')[0]
+
+        RelatoZeladoria.objects.create(
+            cidadao=self.cidadao, categoria=self.categoria, descricao='x', latitude=-22.92, longitude=-42.82,
+        )
+
+        self.assertEqual(VersaoDados.obter('relatos')[0], versao + 1)
+        resposta = self.client.get('/api/public/relatos/', HTTP_IF_NONE_MATCH=primeira['ETag'])
+        self.assertEqual(resposta.status_code, 200)
+        self.assertNotEqual(resposta['ETag'], primeira['ETag'])
+        self.assertEqual(len(resposta.json()['resultados']), 1)
+
+
+class CacheDashboardTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_escrita_de_outro_worker_invalida_o_cache(self):
+        calculos = []
+        calcular = lambda: calculos.append(1) or len(calculos)
+
+        self.assertEqual(cache_dashboard('stats:teste', calcular), 1)
+        self.assertEqual(cache_dashboard('stats:teste', calcular), 1)
+
+        # Outro processo só consegue mexer no banco: o cache local deste continua lá
+        VersaoDados.objects.filter(chave='dashboard').update(versao=F('versao') + 1)
+
+        self.assertEqual(cache_dashboard('stats:teste', calcular), 2)
+
+
+class EstatisticasDashboardTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categoria = CategoriaProblema.objects.create(nome='Buraco', emoji='🕳️', tempo_estimado_resolucao=3)
+
+    def test_evolucao_sem_data_inicio_termina_em_data_fim(self):
+        data_fim = timezone.localdate() - timedelta(days=90)
+        for dias_antes, total in ((0, 1), (10, 2), (40, 4)):
+            EstatisticaDiaria.objects.create(
+                data=data_fim - timedelta(days=dias_antes), status='recebido',
+                categoria=self.categoria, total=total,
+            )
+
+        stats = calcular_estatisticas(data_fim=data_fim)
+
+        evolucao = json.loads(stats['evolucao_stats_json'])
+        self.assertEqual([item['total'] for item in evolucao], [2, 1])
+        self.assertEqual(stats['total_relatos'], 7)
+
+
+class RetriagemIATest(TestCase):
+
+    def setUp(self):
+        cidadao = User.objects.create_user('cidadao', password='x')
+        categoria = CategoriaProblema.objects.create(nome='Buraco', emoji='🕳️', tempo_estimado_resolucao=3)
+        self.relatos = [
+            RelatoZeladoria.objects.create(
+                cidadao=cidadao, categoria=categoria, descricao=f'Relato {i}',
+                latitude=-22.92, longitude=-42.82, foto_problema=f'relatos/{i}.jpg',
+            )
+            for i in range(4)
+        ]
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        self.checkpoint = os.path.join(diretorio.name, 'checkpoint.json')
+
+    def test_indisponivel_no_meio_do_lote_grava_os_demais(self):
+        chamadas = []
+        segundo = self.relatos[1].id
+
+        def classificar(relato, limitador):
+            chamadas.append(relato.id)
+            if relato.id == segundo and chamadas.count(segundo) == 1:
+                return {'error': 'IA indisponível', 'indisponivel': True}
+            return {'prioridade': 'alta', 'justificativa': f'Triado {relato.id}'}
+
+        with mock.patch.object(RetriagemCommand, 'classificar', side_effect=classificar), \
+                mock.patch('app_marica_cidadao.management.commands.retriagem_ia.time.sleep'):
+            call_command('retriagem_ia', lote=4, workers=1, por_minuto=0, checkpoint=self.checkpoint, stdout=io.StringIO())
+
+        # Só o relato indisponível foi classificado de novo
+        self.assertEqual(sorted(chamadas), sorted([r.id for r in self.relatos] + [segundo]))
+        for relato in self.relatos:
+            relato.refresh_from_db()
+            self.assertEqual(relato.justificativa_ia, f'Triado {relato.id}')
+        with open(self.checkpoint) as arquivo:
+            progresso = json.load(arquivo)
+        self.assertEqual(progresso['ultimo_id'], self.relatos[-1].id)
+        self.assertEqual(progresso['processados'], 4)
+
+
+@override_settings(IA_DISJUNTOR_FALHAS=2, IA_DISJUNTOR_SEGUNDOS=60)
+class DisjuntorIATest(TestCase):
+
+    def setUp(self):
+        relogio = mock.patch('app_marica_cidadao.ai_service.time.monotonic', return_value=1000.0)
+        self.relogio = relogio.start()
+        self.addCleanup(relogio.stop)
+        self.disjuntor = DisjuntorIA()
+
+    def abrir(self):
+        for _ in range(2):
+            self.assertTrue(self.disjuntor.permitir())
+            self.disjuntor.registrar_falha()
+
+    def test_abre_depois_de_falhas_seguidas(self):
+        self.assertTrue(self.disjuntor.permitir())
+        self.disjuntor.registrar_falha()
+        self.assertEqual(self.disjuntor.estado(), 'fechado')
+
+        self.assertTrue(self.disjuntor.permitir())
+        self.disjuntor.registrar_falha()
+
+        self.assertEqual(self.disjuntor.estado(), 'aberto')
+        self.assertFalse(self.disjuntor.permitir())
+        self.assertEqual(self.disjuntor.rejeitadas, 1)
+        self.assertEqual(self.disjuntor.segundos_para_reabrir(), 60)
+
+    def test_meio_aberto_libera_uma_unica_chamada_de_teste(self):
+        self.abrir()
+        self.relogio.return_value = 1060.0
+
+        self.assertEqual(self.disjuntor.estado(), 'meio_aberto')
+        self.assertTrue(self.disjuntor.permitir())
+        self.assertFalse(self.disjuntor.permitir())
+
+        # O teste falhou: volta a ficar aberto por mais IA_DISJUNTOR_SEGUNDOS
+        self.disjuntor.registrar_falha()
+        self.assertEqual(self.disjuntor.estado(), 'aberto')
+        self.assertEqual(self.disjuntor.segundos_para_reabrir(), 60)
+        self.assertFalse(self.disjuntor.permitir())
+
+    def test_chamada_de_teste_bem_sucedida_fecha(self):
+        self.abrir()
+        self.relogio.return_value = 1060.0
+        self.assertTrue(self.disjuntor.permitir())
+
+        self.disjuntor.registrar_sucesso()
+
+        self.assertEqual(self.disjuntor.estado(), 'fechado')
+        self.assertTrue(self.disjuntor.permitir())
+        # A contagem recomeça do zero: uma falha isolada não reabre
+        self.disjuntor.registrar_falha()
+        self.assertEqual(self.disjuntor.estado(), 'fechado')
+
+
+@skipUnless(ai_service.HAS_GEMINI, 'google-generativeai não instalado')
+@override_settings(IA_DISJUNTOR_FALHAS=2)
+class ErrosGeminiTest(TestCase):
+
+    def analisar_com_erro(self, erro):
+        modelo = mock.Mock()
+        modelo.generate_content.side_effect = erro
+        imagem = io.BytesIO()
+        PIL.Image.new('RGB', (8, 8)).save(imagem, 'PNG')
+        imagem.seek(0)
+        with mock.patch.object(ai_service, 'GEMINI_API_KEY', 'chave'), \
+                mock.patch.object(ai_service, 'disjuntor', DisjuntorIA()) as disjuntor, \
+                mock.patch.object(ai_service, 'obter_modelo', return_value=(modelo, 'models/teste')), \
+                mock.patch.object(ai_service, 'descartar_modelo') as descartar:
+            resultado = ai_service.analisar_imagem_problema(imagem)
+        return resultado, disjuntor, descartar
+
+    def test_invalid_argument_e_erro_da_entrada(self):
+        resultado, disjuntor, descartar = self.analisar_com_erro(ai_service.erros_google.InvalidArgument('imagem não suportada'))
+
+        self.assertTrue(resultado['entrada_invalida'])
+        self.assertTrue(resultado['error'].startswith('Imagem inválida'))
+        descartar.assert_not_called()
+        self.assertEqual(disjuntor.falhas, 0)
+
+    def test_not_found_descarta_o_modelo(self):
+        resultado, disjuntor, descartar = self.analisar_com_erro(ai_service.erros_google.NotFound('modelo removido'))
+
+        self.assertNotIn('entrada_invalida', resultado)
+        descartar.assert_called_once_with('models/teste')
+        self.assertEqual(disjuntor.falhas, 1)
+
+
+class EstatisticaDiariaIncrementalTest(TestCase):
+    """
+    Os signals de RelatoZeladoria mantêm EstatisticaDiaria igual ao que
+    recalcular_estatisticas reconstrói do zero.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cidadao = User.objects.create_user('cidadao', password='x')
+        cls.buraco = CategoriaProblema.objects.create(nome='Buraco', emoji='🕳️', tempo_estimado_resolucao=3)
+        cls.lixo = CategoriaProblema.objects.create(nome='Lixo', emoji='🗑️', tempo_estimado_resolucao=2)
+
+    def criar_relato(self, bairro):
+        return RelatoZeladoria.objects.create(
+            cidadao=self.cidadao, categoria=self.buraco, descricao='Relato',
+            latitude=-22.92, longitude=-42.82, bairro=bairro,
+        )
+
+    def tabela(self):
+        return {
+            (linha.data, linha.status, linha.categoria_id, linha.bairro): linha.total
+            for linha in EstatisticaDiaria.objects.filter(total__gt=0)
+        }
+
+    def conferir_com_recalculo(self):
+        incremental = self.tabela()
+        call_command('recalcular_estatisticas', stdout=io.StringIO())
+        self.assertEqual(incremental, self.tabela())
+        self.assertFalse(EstatisticaDiaria.objects.filter(total__lt=0).exists())
+
+    def test_criar_mover_e_apagar(self):
+        relato = self.criar_relato('Centro')
+        self.criar_relato(None)
+        self.conferir_com_recalculo()
+
+        relato.status_atual = 'em_analise'
+        relato.save()
+        self.conferir_com_recalculo()
+
+        relato = RelatoZeladoria.objects.get(pk=relato.pk)
+        relato.categoria = self.lixo
+        relato.status_atual = 'resolvido'
+        relato.save()
+        self.conferir_com_recalculo()
+
+        relato.bairro = 'Itaipuaçu'
+        relato.save()
+        self.conferir_com_recalculo()
+
+        relato.delete()
+        self.conferir_com_recalculo()
+        self.assertEqual(sum(self.tabela().values()), 1)
+
+    def test_saida_de_linha_inexistente_nao_fica_negativa(self):
+        relato = self.criar_relato('Centro')
+        outro = self.criar_relato('Centro')
+        # Tabela defasada (ex.: restaurada de um backup antigo)
+        EstatisticaDiaria.objects.all().delete()
+
+        relato.delete()
+        self.assertEqual(self.tabela(), {outro.chave_estatistica(): 1})
+
+        outro.status_atual = 'em_analise'
+        outro.save()
+        self.conferir_com_recalculo()
+
+
+class ExecutorManual:
+    """
+    Substitui o pool da triagem: guarda as tarefas e só as executa quando o teste pede.
+    """
+    def __init__(self):
+        self.tarefas = []
+
+    def submit(self, funcao, *args):
+        self.tarefas.append((funcao, args))
+
+    def executar(self):
+        tarefas, self.tarefas = self.tarefas, []
+        with mock.patch('app_marica_cidadao.triagem.close_old_connections'):
+            for funcao, args in tarefas:
+                funcao(*args)
+
+
+@override_settings(IA_BACKEND='stub', IA_STUB_ATRASO_SEGUNDOS=0, IA_CACHE_DIAS=0)
+class TriagemAssincronaTest(TestCase):
+
+    def setUp(self):
+        self.cidadao = User.objects.create_user('cidadao', password='x')
+        self.autorizacao = f'Token {Token.objects.create(user=self.cidadao).key}'
+        self.executor = ExecutorManual()
+        self.vagas = threading.BoundedSemaphore(1)
+        pool = mock.patch('app_marica_cidadao.triagem.obter_pool', return_value=(self.executor, self.vagas))
+        pool.start()
+        self.addCleanup(pool.stop)
+
+    def enviar_foto(self):
+        imagem = io.BytesIO()
+        PIL.Image.new('RGB', (64, 48), 'gray').save(imagem, 'JPEG')
+        foto = SimpleUploadedFile('foto.jpg', imagem.getvalue(), content_type='image/jpeg')
+        return self.client.post('/api/analisar-foto/', {'foto_problema': foto}, HTTP_AUTHORIZATION=self.autorizacao)
+
+    def consultar(self, url):
+        return self.client.get(url, HTTP_AUTHORIZATION=self.autorizacao).json()
+
+    def test_aceita_com_202_e_resultado_sai_por_polling(self):
+        resposta = self.enviar_foto()
+
+        self.assertEqual(resposta.status_code, 202)
+        dados = resposta.json()
+        self.assertEqual(dados['status'], 'pendente')
+        self.assertEqual(self.consultar(dados['url'])['status'], 'pendente')
+
+        self.executor.executar()
+
+        analise = self.consultar(dados['url'])
+        self.assertEqual(analise['status'], 'concluida')
+        self.assertEqual(analise['resultado']['justificativa'], 'Análise simulada (imagem 64x48).')
+
+    def test_fila_cheia_responde_503(self):
+        self.assertEqual(self.enviar_foto().status_code, 202)
+
+        resposta = self.enviar_foto()
+        self.assertEqual(resposta.status_code, 503)
+        self.assertEqual(resposta['Retry-After'], '5')
+        self.assertEqual(AnaliseFoto.objects.count(), 1)
+
+        # Terminada a análise em andamento, a vaga é devolvida
+        self.executor.executar()
+        self.assertEqual(self.enviar_foto().status_code, 202)
+
+    @override_settings(IA_TRIAGEM_EXPIRACAO_SEGUNDOS=300)
+    def test_analise_abandonada_expira(self):
+        abandonada = AnaliseFoto.objects.create(cidadao=self.cidadao)
+        recente = AnaliseFoto.objects.create(cidadao=self.cidadao)
+        AnaliseFoto.objects.filter(pk=abandonada.pk).update(criado_em=timezone.now() - timedelta(seconds=301))
+
+        analise = self.consultar(f'/api/analisar-foto/{abandonada.pk}/')
+        self.assertEqual(analise['status'], 'erro')
+        self.assertIn('expirou', analise['resultado']['error'])
+        self.assertEqual(self.consultar(f'/api/analisar-foto/{recente.pk}/')['status'], 'pendente')
+
+
+def chaves_do_navegador():
+    """
+    p256dh e auth válidos, como os que o navegador manda na inscrição (o pywebpush cifra com eles).
+    """
+    chave = ec.generate_private_key(ec.SECP256R1())
+    publica = chave.public_key().public_bytes(serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint)
+    return (
+        base64.urlsafe_b64encode(publica).rstrip(b'=').decode(),
+        base64.urlsafe_b64encode(os.urandom(16)).rstrip(b'=').decode(),
+    )
+
+
+@override_settings(
+    WEBPUSH_BACKEND='pywebpush', VAPID_PRIVATE_KEY='chave', WEBPUSH_DESPACHANTE_EMBUTIDO=False,
+    WEBPUSH_MAX_TENTATIVAS=3, WEBPUSH_ESPERA_BASE_SEGUNDOS=30,
+)
+class FilaPushTest(TestCase):
+    """
+    Despachante com o pywebpush de verdade; só o POST da sessão HTTP é simulado.
+    """
+
+    def setUp(self):
+        cidadao = User.objects.create_user('cidadao', password='x')
+        p256dh, auth = chaves_do_navegador()
+        self.inscricao = WebPushSubscription.objects.create(
+            user=cidadao, endpoint='https://push.example/inscricao', p256dh=p256dh, auth=auth
+        )
+        self.sessao = mock.Mock()
+        self.responder(201)
+        for alvo, retorno in (('obter_sessao', self.sessao), ('cabecalhos_vapid', {})):
+            patcher = mock.patch(f'app_marica_cidadao.webpush_service.{alvo}', return_value=retorno)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def responder(self, status_code):
+        self.sessao.post.return_value = mock.Mock(status_code=status_code, reason='', text='', headers={})
+
+    def criar_entrega(self, **campos):
+        mensagem = MensagemPush.objects.create(titulo='Aviso', mensagem='Texto', url='/')
+        return EntregaPush.objects.create(mensagem=mensagem, inscricao=self.inscricao, **campos)
+
+    def vencer(self, entrega):
+        EntregaPush.objects.filter(pk=entrega.pk).update(proxima_tentativa=timezone.now())
+
+    def test_falha_temporaria_reagenda_com_espera_exponencial(self):
+        entrega = self.criar_entrega()
+        self.responder(503)
+
+        for tentativa, espera_base in ((1, 30), (2, 60)):
+            antes = timezone.now()
+            processar_fila_push()
+            entrega.refresh_from_db()
+
+            self.assertEqual(entrega.status, 'pendente')
+            self.assertEqual(entrega.tentativas, tentativa)
+            self.assertIn('503', entrega.ultimo_erro)
+            espera = (entrega.proxima_tentativa - antes).total_seconds()
+            self.assertTrue(espera_base * 0.8 - 1 <= espera <= espera_base * 1.2 + 1, espera)
+            # Ainda não venceu: a próxima rodada não tenta de novo
+            self.assertEqual(processar_fila_push(), 0)
+            self.vencer(entrega)
+
+    def test_desiste_depois_do_maximo_de_tentativas(self):
+        entrega = self.criar_entrega()
+        self.responder(500)
+
+        for _ in range(3):
+            processar_fila_push()
+            self.vencer(entrega)
+
+        entrega.refresh_from_db()
+        self.assertEqual(entrega.status, 'falhou')
+        self.assertEqual(entrega.tentativas, 3)
+        self.assertEqual(processar_fila_push(), 0)
+        self.assertEqual(self.sessao.post.call_count, 3)
+
+    def test_404_e_410_removem_a_inscricao(self):
+        for status_code in (404, 410):
+            with self.subTest(status_code=status_code):
+                self.inscricao.save()
+                self.criar_entrega()
+                self.responder(status_code)
+
+                processar_fila_push()
+
+                self.assertFalse(WebPushSubscription.objects.filter(pk=self.inscricao.pk).exists())
+                self.assertFalse(EntregaPush.objects.exists())
+
+    def test_reserva_vencida_volta_para_a_fila(self):
+        # Processo que reservou morreu no meio do envio: a reserva venceu
+        abandonada = self.criar_entrega(
+            status='enviando', reserva='outro-processo', tentativas=1,
+            proxima_tentativa=timezone.now() - timedelta(seconds=1),
+        )
+        # Reserva ainda válida de outro processo: não pode ser enviada de novo
+        em_andamento = self.criar_entrega(
+            status='enviando', reserva='em-andamento', tentativas=1,
+            proxima_tentativa=timezone.now() + timedelta(seconds=300),
+        )
+
+        self.assertEqual(processar_fila_push(), 1)
+
+        abandonada.refresh_from_db()
+        self.assertEqual(abandonada.status, 'enviada')
+        self.assertEqual(abandonada.tentativas, 2)
+        em_andamento.refresh_from_db()
+        self.assertEqual((em_andamento.status, em_andamento.reserva), ('enviando', 'em-andamento'))
+        self.assertEqual(self.sessao.post.call_count, 1)
+
+
+@override_settings(NOTIFICACOES_JANELA_SEGUNDOS=60, WEBPUSH_DESPACHANTE_EMBUTIDO=False)
+class ConsultasMudancaStatusTest(TestCase):
+    """
+    Uma mudança de status custa um número fixo de consultas, pela API ou pelo admin:
+    relato e histórico gravados uma vez cada, sem reler o relato nem salvá-lo de novo no signal.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.servidor = User.objects.create_user('servidor', password='x', is_staff=True, is_superuser=True)
+        cls.autorizacao = f'Token {Token.objects.create(user=cls.servidor).key}'
+        cidadao = User.objects.create_user('cidadao', password='x')
+        categoria = CategoriaProblema.objects.create(nome='Buraco', emoji='🕳️', tempo_estimado_resolucao=3)
+        cls.relato = RelatoZeladoria.objects.create(
+            cidadao=cidadao, categoria=categoria, descricao='Relato', latitude=-22.92, longitude=-42.82,
+        )
+
+    def test_acao_status_da_api(self):
+        # token, relato, UPDATE do relato, EstatisticaDiaria (saída, entrada e criação da
+        # linha nova), VersaoDados relatos e dashboard, INSERT do histórico, NotificacaoPendente
+        # (tentativa de UPDATE e criação), mais os SAVEPOINT/RELEASE das transações
+        with self.assertNumQueries(17):
+            resposta = self.client.post(
+                f'/api/relatos/{self.relato.pk}/status/', {'status': 'em_analise', 'observacao': 'Vistoria'},
+                content_type='application/json', HTTP_AUTHORIZATION=self.autorizacao,
+            )
+
+        self.assertEqual(resposta.status_code, 200)
+        self.relato.refresh_from_db()
+        self.assertEqual(self.relato.status_atual, 'em_analise')
+        self.assertEqual(self.relato.historico.count(), 1)
+
+    def test_save_do_admin(self):
+        relato = RelatoZeladoria.objects.get(pk=self.relato.pk)
+        form = modelform_factory(RelatoZeladoria, fields=['status_atual', 'prioridade'])(
+            data={'status_atual': 'resolvido', 'prioridade': 'alta'}, instance=relato,
+        )
+        self.assertTrue(form.is_valid())
+        requisicao = RequestFactory().post('/admin/')
+        requisicao.user = self.servidor
+        modelo_admin = RelatoZeladoriaAdmin(RelatoZeladoria, admin_site)
+
+        # Sem releitura do relato: as mesmas escritas da API, sem o token e o SELECT
+        with self.assertNumQueries(15):
+            modelo_admin.save_model(requisicao, form.save(commit=False), form, change=True)
+
+        relato.refresh_from_db()
+        self.assertEqual((relato.status_atual, relato.prioridade), ('resolvido', 'alta'))
+        self.assertEqual(relato.historico.get().atualizado_por, self.servidor)
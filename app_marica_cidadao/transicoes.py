@@ -0,0 +1,60 @@
+"""
+Mudança de status de um relato.
+O status_atual do relato e a entrada no HistoricoStatus são gravados juntos, numa
+única transação e sem reler o relato do banco: quem chama já tem a instância
+(carregada pelo admin, pela API ou pelo próprio histórico).
+
+Há duas entradas para a mesma transição:
+- mudar_status (admin, API): parte do relato e cria o histórico;
+- sincronizar_status (signal de HistoricoStatus): parte de um histórico que já foi
+  criado por outro caminho (inline do admin, primeiro histórico, shell) e só falta
+  levar o status ao relato. Não passa por mudar_status porque isso criaria um
+  segundo histórico; grava o relato pela mesma aplicar_status.
+Históricos criados por mudar_status chegam ao signal com o relato já no status
+novo, então o signal não faz nenhuma escrita (nem consulta) a mais.
+"""
+from django.db import transaction
+from .models import HistoricoStatus
+
+
+def aplicar_status(relato, status, salvar_relato_completo=False):
+    """
+    Grava o status no relato. Com salvar_relato_completo (admin) grava todos os
+    campos do relato editados no formulário; senão, só status_atual e atualizado_em.
+    """
+    relato.status_atual = status
+    if salvar_relato_completo:
+        relato.save()
+    else:
+        relato.save(update_fields=['status_atual', 'atualizado_em'])
+
+
+def mudar_status(relato, status, observacao='', atualizado_por=None, foto_resolucao=None, salvar_relato_completo=False):
+    """
+    Aplica o novo status ao relato e registra o histórico. Retorna o HistoricoStatus.
+    A notificação ao cidadão é agendada pelo signal do histórico e sai após o commit.
+    """
+    with transaction.atomic():
+        aplicar_status(relato, status, salvar_relato_completo)
+
+        historico = HistoricoStatus(
+            relato=relato,
+            status=status,
+            observacao_prefeitura=observacao,
+            atualizado_por=atualizado_por,
+            foto_resolucao=foto_resolucao,
+        )
+        historico.save()
+    return historico
+
+
+def sincronizar_status(historico):
+    """
+    Metade "relato" de mudar_status para um histórico que já existe: leva o status
+    para o relato só se ele for diferente. Usa a instância de relato já ligada ao histórico.
+    """
+    relato = historico.relato
+    if relato.status_atual == historico.status:
+        return False
+    aplicar_status(relato, historico.status)
+    return True
@@ -0,0 +1,180 @@
+"""
+Triagem de fotos pela IA em segundo plano.
+A API só cria o registro AnaliseFoto e devolve o id; um pool de threads com
+concorrência limitada chama o modelo e grava o resultado, que o app consulta por polling.
+Assim uma resposta lenta da IA ocupa uma thread do pool, e não um worker do gunicorn.
+Fotos já analisadas (mesmo conteúdo ou quase idênticas) são respondidas pelo CacheAnaliseIA.
+A imagem é lida direto do upload e reduzida antes de entrar na fila: o pool guarda
+e envia ao modelo só a versão pequena.
+"""
+import io
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+import PIL.Image
+import PIL.ImageOps
+from .ai_service import analisar_imagem_problema, analisar_imagem_stub
+from .models import AnaliseFoto, CacheAnaliseIA
+
+_executor = None
+_vagas = None
+_lock = threading.Lock()
+
+
+def obter_pool():
+    """
+    Cria o pool na primeira chamada (depois do fork dos workers do gunicorn).
+    'vagas' limita análises em execução + na fila.
+    """
+    global _executor, _vagas
+    with _lock:
+        if _executor is None:
+            workers = getattr(settings, 'IA_TRIAGEM_WORKERS', 2)
+            fila = getattr(settings, 'IA_TRIAGEM_FILA_MAXIMA', 20)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='triagem-ia')
+            _vagas = threading.BoundedSemaphore(workers + fila)
+    return _executor, _vagas
+
+
+def analisar(imagem):
+    """
+    Chama o modelo configurado em IA_BACKEND ('gemini' ou 'stub').
+    """
+    if getattr(settings, 'IA_BACKEND', 'gemini') == 'stub':
+        return analisar_imagem_stub(imagem)
+    return analisar_imagem_problema(imagem)
+
+
+def hash_perceptual(img):
+    """
+    dHash de 64 bits: a imagem vira 9x8 em tons de cinza e cada bit diz se um
+    pixel é mais claro que o vizinho da direita. Recompressão e redimensionamento
+    mudam poucos bits.
+    """
+    pixels = list(img.convert('L').resize((9, 8), PIL.Image.LANCZOS).getdata())
+    valor = 0
+    for linha in range(8):
+        for coluna in range(8):
+            valor = (valor << 1) | (pixels[linha * 9 + coluna] > pixels[linha * 9 + coluna + 1])
+    return f'{valor:016x}'
+
+
+def preparar_imagem(arquivo):
+    """
+    Lê o UploadedFile (em memória ou em disco, em blocos) sem cópia intermediária e
+    devolve (jpeg_reduzido, hashes). A imagem é decodificada já reduzida (draft do JPEG)
+    e limitada a IA_IMAGEM_MAX_LADO pixels no maior lado.
+    Levanta ValueError se o arquivo não for uma imagem.
+    """
+    sha256 = hashlib.sha256()
+    for bloco in arquivo.chunks():
+        sha256.update(bloco)
+    arquivo.seek(0)
+
+    max_lado = getattr(settings, 'IA_IMAGEM_MAX_LADO', 1024)
+    try:
+        img = PIL.Image.open(arquivo)
+        # Em JPEG o draft decodifica direto em 1/2, 1/4 ou 1/8 do tamanho. Pedir metade
+        # de max_lado aceita uma escala a mais de redução e quase sempre dispensa o
+        # redimensionamento do thumbnail, que é a etapa mais cara
+        img.draft('RGB', (max_lado // 2, max_lado // 2))
+        img = PIL.ImageOps.exif_transpose(img)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.thumbnail((max_lado, max_lado))
+    except Exception as e:
+        raise ValueError(f"Imagem inválida: {e}")
+
+    saida = io.BytesIO()
+    img.save(saida, 'JPEG', quality=getattr(settings, 'IA_IMAGEM_QUALIDADE', 80), optimize=True)
+    return saida.getvalue(), (sha256.hexdigest(), hash_perceptual(img))
+
+
+def validade_cache():
+    return timezone.now() - timedelta(days=getattr(settings, 'IA_CACHE_DIAS', 30))
+
+
+def cache_ativo():
+    return getattr(settings, 'IA_CACHE_DIAS', 30) > 0
+
+
+def resultado_com_erro(resultado):
+    return not isinstance(resultado, dict) or 'error' in resultado
+
+
+def guardar_no_cache(hashes, resultado):
+    if hashes and cache_ativo() and not resultado_com_erro(resultado):
+        CacheAnaliseIA.guardar(
+            *hashes, resultado, validade_cache(), getattr(settings, 'IA_CACHE_MAX_ENTRADAS', 5000)
+        )
+
+
+def enfileirar_analise(usuario, arquivo):
+    """
+    Cria a AnaliseFoto e agenda o processamento da foto enviada.
+    Se a imagem já está no cache, a análise é criada concluída, sem passar pelo pool.
+    Retorna None quando a fila está cheia; levanta ValueError se não for uma imagem.
+    """
+    conteudo, hashes = preparar_imagem(arquivo)
+    if cache_ativo():
+        resultado = CacheAnaliseIA.buscar(*hashes, validade_cache())
+        if resultado is not None:
+            return AnaliseFoto.objects.create(
+                cidadao=usuario, status='concluida', resultado=resultado, concluido_em=timezone.now()
+            )
+
+    executor, vagas = obter_pool()
+    if not vagas.acquire(blocking=False):
+        return None
+
+    try:
+        analise = AnaliseFoto.objects.create(cidadao=usuario)
+        executor.submit(processar_analise, analise.pk, conteudo, hashes, vagas)
+    except Exception:
+        vagas.release()
+        raise
+    return analise
+
+
+def processar_analise(analise_id, conteudo, hashes, vagas):
+    """
+    Executado numa thread do pool. Resultados sem erro vão para o cache.
+    """
+    try:
+        AnaliseFoto.objects.filter(pk=analise_id).update(status='processando')
+        try:
+            resultado = analisar(io.BytesIO(conteudo))
+        except Exception as e:
+            print(f"Erro na triagem da análise {analise_id}: {e}")
+            resultado = {"error": str(e)}
+
+        AnaliseFoto.objects.filter(pk=analise_id).update(
+            status='erro' if resultado_com_erro(resultado) else 'concluida',
+            resultado=resultado,
+            concluido_em=timezone.now(),
+        )
+        guardar_no_cache(hashes, resultado)
+    finally:
+        vagas.release()
+        close_old_connections()
+
+
+def expirar_se_abandonada(analise):
+    """
+    Análises que ficaram na fila de um processo reiniciado nunca terminam:
+    depois de IA_TRIAGEM_EXPIRACAO_SEGUNDOS são marcadas como erro.
+    """
+    if analise.status in AnaliseFoto.STATUS_FINALIZADOS:
+        return analise
+
+    limite = timezone.now() - timedelta(seconds=getattr(settings, 'IA_TRIAGEM_EXPIRACAO_SEGUNDOS', 300))
+    if analise.criado_em < limite:
+        analise.status = 'erro'
+        analise.resultado = {"error": "A análise expirou. Envie a foto novamente."}
+        analise.concluido_em = timezone.now()
+        analise.save(update_fields=['status', 'resultado', 'concluido_em'])
+    return analise
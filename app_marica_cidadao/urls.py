@@ -1,17 +1,22 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import RelatoZeladoriaViewSet, RegisterUserView, CategoriaProblemaViewSet, APIAnalisarFoto, DashboardAdminView, APILogoutView, PublicRelatosView, ExportarRelatorioPDFView, WebPushSubscribeView, VapidPublicKeyView
+from .views import RelatoZeladoriaViewSet, AvisoBroadcastViewSet, RegisterUserView, CategoriaProblemaViewSet, APIAnalisarFoto, APIAnaliseFotoStatus, DashboardAdminView, DashboardTemposView, DashboardIAView, HeatmapDashboardView, APILogoutView, PublicRelatosView, ExportarRelatorioPDFView, WebPushSubscribeView, VapidPublicKeyView
 
 router = DefaultRouter()
 # Cria as rotas: GET /api/relatos/ e POST /api/relatos/
 router.register(r'relatos', RelatoZeladoriaViewSet, basename='relato')
 router.register(r'categorias', CategoriaProblemaViewSet, basename='categoria')
+router.register(r'avisos', AvisoBroadcastViewSet, basename='aviso')
 
 urlpatterns = [
     path('cadastro/', RegisterUserView.as_view(), name='registrar_usuario'),
     path('logout/', APILogoutView.as_view(), name='api_logout'),
     path('analisar-foto/', APIAnalisarFoto.as_view(), name='analisar_foto'),
+    path('analisar-foto/<uuid:pk>/', APIAnaliseFotoStatus.as_view(), name='analise_foto'),
     path('dashboard-estatisticas/', DashboardAdminView.as_view(), name='admin_dashboard_stats'),
+    path('dashboard-estatisticas/heatmap/', HeatmapDashboardView.as_view(), name='admin_dashboard_heatmap'),
+    path('dashboard-estatisticas/tempos/', DashboardTemposView.as_view(), name='admin_dashboard_tempos'),
+    path('dashboard-estatisticas/ia/', DashboardIAView.as_view(), name='admin_dashboard_ia'),
     path('exportar-pdf/', ExportarRelatorioPDFView.as_view(), name='exportar_pdf_gestao'),
     path('public/relatos/', PublicRelatosView.as_view(), name='public_relatos'),
     path('webpush/inscrever/', WebPushSubscribeView.as_view(), name='webpush_subscribe'),
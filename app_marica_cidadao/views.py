@@ -1,36 +1,49 @@
-from django.shortcuts import render
-from django.http import HttpResponse, FileResponse
+from django.shortcuts import render, get_object_or_404
+from django.urls import reverse
+from django.http import HttpResponse, FileResponse, StreamingHttpResponse
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
 import os
 import json
 import io
 import unicodedata
-from rest_framework import viewsets, permissions, authentication, generics
-from rest_framework.parsers import MultiPartParser, FormParser
+import hashlib
+import calendar
+from rest_framework import viewsets, mixins, permissions, authentication, generics
+from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
+from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer
 from rest_framework.views import APIView
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
 from rest_framework.response import Response
+from rest_framework.pagination import CursorPagination
+from rest_framework.exceptions import ValidationError
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
-from django.db.models import Count
-from django.db.models.functions import TruncDate
+from django.db import transaction
+from django.db.models import Count, Avg, F, Q, Prefetch
+from django.db.models.functions import TruncDate, Floor
 from django.utils import timezone
-from datetime import timedelta
-from django.views.generic import TemplateView
+from datetime import datetime, time as dtime, timedelta
+from django.views.generic import TemplateView, View
 from django.contrib.admin.views.decorators import staff_member_required
-import tempfile
 from fpdf import FPDF
 
-from .models import RelatoZeladoria, CategoriaProblema, WebPushSubscription
+from .models import RelatoZeladoria, HistoricoStatus, CategoriaProblema, WebPushSubscription, VersaoDados, AnaliseFoto, AvisoBroadcast
 from .serializers import (
     RelatoZeladoriaSerializer, 
     UserRegistrationSerializer, 
-    CategoriaProblemaSerializer
+    CategoriaProblemaSerializer,
+    AvisoBroadcastSerializer,
+    HistoricoStatusSerializer
 )
-from .ai_service import analisar_imagem_problema
+from .triagem import enfileirar_analise, expirar_se_abandonada
+from .transicoes import mudar_status
+from .geo import filtro_bbox
 
 def normalizar_texto(texto):
     """
@@ -43,6 +56,35 @@ def normalizar_texto(texto):
     texto_sem_acento = "".join([c for c in nfkd_form if not unicodedata.combining(c)])
     return texto_sem_acento.encode('ascii', 'ignore').decode('ascii')
 
+def responder_com_versao(request, chave, gerar_resposta):
+    """
+    GET condicional baseado em VersaoDados: o ETag combina a versão do conjunto
+    de dados com os parâmetros da requisição. Se o cliente já tem essa versão,
+    devolve 304 sem executar a consulta nem serializar nada.
+    """
+    versao, atualizado_em = VersaoDados.obter(chave)
+    variante = f"{request.get_full_path()}|{getattr(request, 'accepted_media_type', '')}"
+    etag = quote_etag(f"{chave}-{versao}-{hashlib.md5(variante.encode('utf-8')).hexdigest()[:12]}")
+    ultima_modificacao = calendar.timegm(atualizado_em.utctimetuple())
+
+    def aplicar_validadores(response):
+        # O 304 repete os mesmos validadores e o Vary do 200 (RFC 9110, 15.4.5)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(ultima_modificacao)
+        patch_vary_headers(response, ['Accept'])
+        # O PWA pode guardar a resposta, mas deve revalidar a cada uso
+        patch_cache_control(response, no_cache=True)
+        return response
+
+    nao_modificado = get_conditional_response(request, etag=etag, last_modified=ultima_modificacao)
+    if nao_modificado is not None:
+        return aplicar_validadores(nao_modificado)
+
+    response = gerar_resposta()
+    if response.status_code == 200:
+        aplicar_validadores(response)
+    return response
+
 @method_decorator(csrf_exempt, name='dispatch')
 class CustomObtainAuthToken(ObtainAuthToken):
     authentication_classes = []  # Evita CSRF check
@@ -84,6 +126,43 @@ class CategoriaProblemaViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [permissions.AllowAny] # Aberto para o formulário de cadastro/relato funcionar sem travas
     authentication_classes = [] # Evita problemas de CSRF/Token inicial
 
+    def list(self, request, *args, **kwargs):
+        listar = super().list
+        return responder_com_versao(request, 'categorias', lambda: listar(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        detalhar = super().retrieve
+        return responder_com_versao(request, 'categorias', lambda: detalhar(request, *args, **kwargs))
+
+class AvisoBroadcastViewSet(mixins.CreateModelMixin, mixins.ListModelMixin,
+                            mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    Avisos em massa por push (apenas servidores).
+    POST cria e já dispara o aviso; GET acompanha as entregas.
+    Filtros do público: 'bairro' (do perfil) e 'categoria' (relatos abertos).
+    """
+    queryset = AvisoBroadcast.objects.select_related('categoria')
+    serializer_class = AvisoBroadcastSerializer
+    permission_classes = [permissions.IsAdminUser]
+    authentication_classes = [authentication.SessionAuthentication, authentication.TokenAuthentication]
+
+    def create(self, request, *args, **kwargs):
+        from .webpush_service import push_configurado
+        if not push_configurado():
+            return Response(
+                {"error": "Push não configurado no servidor (VAPID_PRIVATE_KEY). O aviso não foi criado."},
+                status=503
+            )
+        return super().create(request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        from .webpush_service import disparar_aviso_broadcast
+        # Se o disparo falhar, o aviso também não fica gravado
+        with transaction.atomic():
+            aviso = serializer.save(criado_por=self.request.user)
+            disparar_aviso_broadcast(aviso)
+        aviso.refresh_from_db()
+
 @method_decorator(csrf_exempt, name='dispatch')
 class RegisterUserView(generics.CreateAPIView):
     queryset = User.objects.none()
@@ -101,25 +180,107 @@ class RegisterUserView(generics.CreateAPIView):
             print(traceback.format_exc())
             return Response({"detail": str(e)}, status=500)
 
+class RelatoCursorPagination(CursorPagination):
+    """
+    Paginação por cursor (criado_em, id): custo constante por página,
+    mesmo no fim de uma fila com milhares de relatos.
+    """
+    ordering = ('-criado_em', '-id')
+    page_size = 20
+    page_size_query_param = 'limite'
+    max_page_size = 100
+
+
+def ler_data(params, nome):
+    valor = params.get(nome)
+    if not valor:
+        return None
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValidationError({nome: "Data inválida. Use o formato AAAA-MM-DD."})
+
+
+def ler_inteiro(params, nome, minimo=None):
+    """
+    Parâmetro numérico opcional (ids, zoom, cursor, limite). Levanta ValueError
+    com uma mensagem para o cliente em vez de deixar o erro virar um 500 na consulta.
+    """
+    valor = params.get(nome)
+    if valor is None or valor == '':
+        return None
+    try:
+        numero = int(valor)
+    except ValueError:
+        raise ValueError(f"Parâmetro '{nome}' deve ser um número inteiro.")
+    if minimo is not None and numero < minimo:
+        raise ValueError(f"Parâmetro '{nome}' deve ser no mínimo {minimo}.")
+    return numero
+
+
 class RelatoZeladoriaViewSet(viewsets.ModelViewSet):
+    """
+    Relatos do cidadão (ou todos, para servidores).
+
+    Filtros (GET): status, prioridade, categoria, bairro, data_inicio, data_fim (AAAA-MM-DD).
+    Use historico=0 para não trazer o histórico aninhado (listagens rápidas da fila).
+    A lista é paginada por cursor; o parâmetro 'limite' define o tamanho da página.
+    Servidores mudam o status com POST em /relatos/<id>/status/.
+    """
     serializer_class = RelatoZeladoriaSerializer
     authentication_classes = [authentication.TokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = RelatoCursorPagination
     
     # Importante: Permite receber arquivos de imagem (FormData do React)
     parser_classes = [MultiPartParser, FormParser]
 
+    def omitir_historico(self):
+        return self.request.query_params.get('historico') in ('0', 'false', 'nao')
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['omitir_historico'] = self.omitir_historico()
+        return context
+
     def get_queryset(self):
         """
         Garante que o cidadão só consiga ver a lista dos SEUS próprios chamados,
         e não os chamados de outros moradores.
         """
         user = self.request.user
+        params = self.request.query_params
+        # O serializer lê categoria.nome/emoji e o histórico aninhado de cada relato:
+        # carregamos tudo em 2 consultas fixas em vez de 2 por relato
+        relatos = RelatoZeladoria.objects.select_related('categoria')
+        if not self.omitir_historico():
+            relatos = relatos.prefetch_related(
+                Prefetch('historico', queryset=HistoricoStatus.objects.order_by(*HistoricoStatus.ORDEM_POR_RELATO))
+            )
+
+        if params.get('status'):
+            relatos = relatos.filter(status_atual=params['status'])
+        if params.get('prioridade'):
+            relatos = relatos.filter(prioridade=params['prioridade'])
+        if params.get('categoria'):
+            try:
+                relatos = relatos.filter(categoria_id=ler_inteiro(params, 'categoria'))
+            except ValueError as e:
+                raise ValidationError({'categoria': str(e)})
+        if params.get('bairro'):
+            relatos = relatos.filter(bairro=params['bairro'])
+        data_inicio = ler_data(params, 'data_inicio')
+        data_fim = ler_data(params, 'data_fim')
+        if data_inicio:
+            relatos = relatos.filter(criado_em__gte=timezone.make_aware(datetime.combine(data_inicio, dtime.min)))
+        if data_fim:
+            relatos = relatos.filter(criado_em__lt=timezone.make_aware(datetime.combine(data_fim + timedelta(days=1), dtime.min)))
+
         # Se for um funcionário da prefeitura, poderia ver todos:
         if user.is_staff:
-            return RelatoZeladoria.objects.all()
+            return relatos
         # Se for cidadão comum, vê apenas os dele:
-        return RelatoZeladoria.objects.filter(cidadao=user).order_by('-criado_em')
+        return relatos.filter(cidadao=user).order_by('-criado_em')
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -128,6 +289,38 @@ class RelatoZeladoriaViewSet(viewsets.ModelViewSet):
             print(serializer.errors)
         return super().create(request, *args, **kwargs)
 
+    @action(
+        detail=True, methods=['post'], url_path='status',
+        permission_classes=[permissions.IsAdminUser],
+        parser_classes=[JSONParser, MultiPartParser, FormParser],
+    )
+    def mudar_status(self, request, pk=None):
+        """
+        Servidores: muda o status do relato e registra o histórico.
+        Campos: status (obrigatório), observacao, foto_resolucao.
+        """
+        status_novo = request.data.get('status')
+        if status_novo not in dict(RelatoZeladoria.STATUS_CHOICES):
+            return Response({"status": "Status inválido."}, status=400)
+
+        relato = get_object_or_404(RelatoZeladoria, pk=pk)
+        if relato.status_atual == status_novo:
+            return Response({"status": "O relato já está neste status."}, status=400)
+
+        historico = mudar_status(
+            relato,
+            status_novo,
+            observacao=request.data.get('observacao', ''),
+            atualizado_por=request.user,
+            foto_resolucao=request.FILES.get('foto_resolucao'),
+        )
+        return Response({
+            "id": relato.id,
+            "status_atual": relato.status_atual,
+            "status_display": relato.get_status_atual_display(),
+            "historico": HistoricoStatusSerializer(historico, context={'request': request}).data,
+        })
+
 @csrf_exempt
 def frontend_view(request):
     """
@@ -144,7 +337,9 @@ def frontend_view(request):
 
 class APIAnalisarFoto(APIView):
     """
-    Recebe uma foto e retorna o palpite da IA sobre a categoria.
+    Recebe uma foto e agenda a triagem pela IA.
+    Responde 202 com o id da análise; o resultado é consultado em APIAnaliseFotoStatus.
+    Fotos que já estão no cache respondem 200 com o resultado.
     """
     permission_classes = [permissions.IsAuthenticated]
     authentication_classes = [authentication.TokenAuthentication]
@@ -155,21 +350,40 @@ class APIAnalisarFoto(APIView):
         if not foto:
             return Response({"error": "Nenhuma foto enviada."}, status=400)
 
-        # Salva temporariamente para processar
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg", mode='wb') as tmp:
-            for chunk in foto.chunks():
-                tmp.write(chunk)
-            temp_path = tmp.name
-
         try:
-            resultado = analisar_imagem_problema(temp_path)
-            # Remove o arquivo temporário
-            os.remove(temp_path)
-            return Response(resultado)
-        except Exception as e:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-            return Response({"error": str(e)}, status=500)
+            analise = enfileirar_analise(request.user, foto)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+        if analise is None:
+            return Response(
+                {"error": "O serviço de IA está ocupado. Tente novamente em instantes."},
+                status=503,
+                headers={'Retry-After': '5'}
+            )
+
+        # Foto já conhecida: o resultado do cache vem na própria resposta
+        return Response({
+            "id": str(analise.id),
+            "status": analise.status,
+            "resultado": analise.resultado,
+            "url": reverse('analise_foto', args=[analise.id]),
+        }, status=200 if analise.status == 'concluida' else 202)
+
+
+class APIAnaliseFotoStatus(APIView):
+    """
+    Situação de uma análise de foto: pendente, processando, concluida ou erro.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    authentication_classes = [authentication.TokenAuthentication]
+
+    def get(self, request, pk):
+        analise = expirar_se_abandonada(get_object_or_404(AnaliseFoto, pk=pk, cidadao=request.user))
+        return Response({
+            "id": str(analise.id),
+            "status": analise.status,
+            "resultado": analise.resultado,
+        })
 
 class APILogoutView(APIView):
     """
@@ -186,47 +400,365 @@ class APILogoutView(APIView):
         except Exception as e:
             return Response({"error": f"Erro ao encerrar sessão: {str(e)}"}, status=500)
 
+def ler_bbox(valor):
+    """
+    Converte o parâmetro 'bbox' (oeste,sul,leste,norte — mesmo formato do
+    map.getBounds().toBBoxString() do Leaflet) em uma tupla de floats.
+    """
+    try:
+        oeste, sul, leste, norte = [float(v) for v in valor.split(',')]
+    except (ValueError, AttributeError):
+        raise ValueError("Parâmetro 'bbox' inválido. Use: oeste,sul,leste,norte")
+    if not (-180 <= oeste <= 180 and -180 <= leste <= 180 and -90 <= sul <= norte <= 90):
+        raise ValueError("Parâmetro 'bbox' fora dos limites geográficos.")
+    return oeste, sul, leste, norte
+
+
+def casas_decimais_por_zoom(zoom):
+    """
+    Precisão das coordenadas devolvidas ao mapa de acordo com o zoom.
+    Em zoom de cidade (13) 5 casas (~1 m) bastam; mais que 6 casas é ruído de GPS.
+    """
+    if zoom is None:
+        return 6
+    return min(6, max(3, zoom // 3 + 1))
+
+
+class ColunarJSONRenderer(JSONRenderer):
+    """
+    JSON comum, anunciado com o tipo de mídia que pede ao mapa público a
+    resposta em colunas (Accept: application/vnd.marica.colunar+json).
+    """
+    media_type = 'application/vnd.marica.colunar+json'
+    format = 'colunar'
+
+
+def codificar_dicionario(valores):
+    """
+    Codificação por dicionário: devolve (dicionario, indices), onde
+    dicionario são os valores distintos na ordem em que aparecem e
+    indices aponta, para cada item, a posição do seu valor no dicionário.
+    """
+    dicionario, posicoes, indices = [], {}, []
+    for valor in valores:
+        if valor not in posicoes:
+            posicoes[valor] = len(dicionario)
+            dicionario.append(valor)
+        indices.append(posicoes[valor])
+    return dicionario, indices
+
+
+def tamanho_celula_cluster(zoom):
+    """
+    Lado (em graus) da célula de agrupamento para um zoom do mapa.
+    Um tile do Leaflet cobre 360/2^zoom graus; dividimos em 4x4 células (~64px).
+    """
+    return 360.0 / (2 ** zoom) / 4
+
+
 class PublicRelatosView(APIView):
     """
     Endpoint público para transparência social.
     Retorna dados anônimos dos relatos para exibir no mapa da cidade.
+
+    Parâmetros (GET, todos opcionais):
+    - bbox: oeste,sul,leste,norte da área visível do mapa
+    - zoom: nível de zoom do mapa (0 a 22), define a precisão das coordenadas
+    - status, categoria, bairro: filtros
+    - modo: 'pontos' ou 'cluster'. Sem o parâmetro, zooms abaixo de
+      MAPA_ZOOM_MINIMO_PONTOS recebem clusters. Os clusters usam no máximo o zoom
+      MAPA_ZOOM_MINIMO_PONTOS - 1 e vêm limitados a MAPA_PUBLICO_LIMITE_MAXIMO
+      células ('truncado': true quando há mais).
+    - cursor: valor 'proximo_cursor' da página anterior (paginação por chave)
+    - limite: tamanho da página (no máximo MAPA_PUBLICO_LIMITE_MAXIMO)
+    - formato: 'linhas' (padrão, uma lista de objetos) ou 'colunar' (arrays
+      paralelos com categoria, status, bairro, data e prioridade codificados
+      por dicionário). Também pode ser pedido pelo header
+      Accept: application/vnd.marica.colunar+json
     """
     permission_classes = [permissions.AllowAny]
     authentication_classes = []
+    renderer_classes = [JSONRenderer, BrowsableAPIRenderer, ColunarJSONRenderer]
 
     def get(self, request):
-        relatos = RelatoZeladoria.objects.all().select_related('categoria')
+        # ETag/Last-Modified: clientes com a versão atual recebem 304
+        return responder_com_versao(request, 'relatos', lambda: self.montar_resposta(request))
+
+    def montar_resposta(self, request):
+        params = request.query_params
+        limite_maximo = getattr(settings, 'MAPA_PUBLICO_LIMITE_MAXIMO', 500)
+
+        try:
+            limite = ler_inteiro(params, 'limite', minimo=1)
+            zoom = ler_inteiro(params, 'zoom')
+            cursor = ler_inteiro(params, 'cursor')
+            categoria = ler_inteiro(params, 'categoria')
+            bbox = ler_bbox(params['bbox']) if params.get('bbox') else None
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+
+        if zoom is not None and not 0 <= zoom <= 22:
+            return Response({"error": "Parâmetro 'zoom' deve estar entre 0 e 22."}, status=400)
+        limite = min(limite or limite_maximo, limite_maximo)
+
+        modo = params.get('modo')
+        if not modo:
+            zoom_minimo_pontos = getattr(settings, 'MAPA_ZOOM_MINIMO_PONTOS', 14)
+            modo = 'cluster' if zoom is not None and zoom < zoom_minimo_pontos else 'pontos'
+        if modo not in ('pontos', 'cluster'):
+            return Response({"error": "Parâmetro 'modo' deve ser 'pontos' ou 'cluster'."}, status=400)
+
+        formato = params.get('formato')
+        if not formato:
+            formato = 'colunar' if isinstance(request.accepted_renderer, ColunarJSONRenderer) else 'linhas'
+        if formato not in ('linhas', 'colunar'):
+            return Response({"error": "Parâmetro 'formato' deve ser 'linhas' ou 'colunar'."}, status=400)
+        self.usar_renderer_do_formato(request, formato)
+
+        relatos = RelatoZeladoria.objects.all()
+
+        if bbox:
+            relatos = relatos.filter(filtro_bbox(*bbox))
+        if params.get('status'):
+            relatos = relatos.filter(status_atual=params['status'])
+        if categoria is not None:
+            relatos = relatos.filter(categoria_id=categoria)
+        if params.get('bairro'):
+            relatos = relatos.filter(bairro=params['bairro'])
+
+        if modo == 'cluster':
+            # Em zoom de pontos a grade teria uma célula por relato: o cluster usa
+            # no máximo o zoom anterior e devolve até limite_maximo células
+            zoom_minimo_pontos = getattr(settings, 'MAPA_ZOOM_MINIMO_PONTOS', 14)
+            zoom_cluster = min(zoom if zoom is not None else 12, zoom_minimo_pontos - 1)
+            clusters, truncado = self.agrupar_em_clusters(relatos, zoom_cluster, limite_maximo)
+            if formato == 'colunar':
+                return self.responder({
+                    "modo": modo, "formato": formato, **self.clusters_em_colunas(clusters), "truncado": truncado,
+                })
+            return self.responder({
+                "modo": modo,
+                "clusters": clusters,
+                "truncado": truncado,
+            })
+
+        if cursor is not None:
+            relatos = relatos.filter(id__lt=cursor)
+
+        # Keyset pela PK: o id cresce junto com o criado_em e não exige OFFSET
+        linhas = list(
+            relatos.order_by('-id').values(
+                'id', 'categoria__nome', 'categoria__emoji', 'status_atual', 'bairro',
+                'latitude', 'longitude', 'criado_em', 'prioridade'
+            )[:limite + 1]
+        )
+        proximo_cursor = None
+        if len(linhas) > limite:
+            linhas = linhas[:limite]
+            proximo_cursor = linhas[-1]['id']
+
+        casas = casas_decimais_por_zoom(zoom)
+        if formato == 'colunar':
+            return self.responder({
+                "modo": modo,
+                "formato": formato,
+                **self.pontos_em_colunas(linhas, casas),
+                "proximo_cursor": proximo_cursor,
+            })
+
+        status_legivel = dict(RelatoZeladoria.STATUS_CHOICES)
         data = []
-        for r in relatos:
+        for r in linhas:
             data.append({
-                "id": r.id,
-                "categoria_nome": r.categoria.nome,
-                "categoria_emoji": r.categoria.emoji,
-                "status_display": r.get_status_atual_display(),
-                "bairro": r.bairro,
-                "latitude": r.latitude,
-                "longitude": r.longitude,
-                "criado_em": r.criado_em.strftime('%d/%m/%Y'),
-                "prioridade": r.prioridade
+                "id": r['id'],
+                "categoria_nome": r['categoria__nome'],
+                "categoria_emoji": r['categoria__emoji'],
+                "status_display": status_legivel.get(r['status_atual'], r['status_atual']),
+                "bairro": r['bairro'],
+                "latitude": round(r['latitude'], casas) if r['latitude'] is not None else None,
+                "longitude": round(r['longitude'], casas) if r['longitude'] is not None else None,
+                "criado_em": timezone.localtime(r['criado_em']).strftime('%d/%m/%Y'),
+                "prioridade": r['prioridade']
             })
-        return Response(data)
+        return self.responder({
+            "modo": modo,
+            "resultados": data,
+            "proximo_cursor": proximo_cursor,
+        })
+
+    def usar_renderer_do_formato(self, request, formato):
+        """
+        O Content-Type segue o formato resolvido: ?formato=linhas com o Accept
+        colunar responde application/json, e ?formato=colunar responde o tipo colunar.
+        """
+        if formato == 'colunar':
+            renderer = ColunarJSONRenderer()
+        elif isinstance(request.accepted_renderer, ColunarJSONRenderer):
+            renderer = JSONRenderer()
+        else:
+            return
+        request.accepted_renderer = renderer
+        request.accepted_media_type = renderer.media_type
+
+    def responder(self, data):
+        response = Response(data)
+        # O formato pode depender do header Accept; caches intermediários precisam saber disso
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+    def pontos_em_colunas(self, linhas, casas):
+        """
+        Mesmo conteúdo do formato 'linhas', em arrays paralelos (um por campo).
+        Textos repetidos viram índices para os dicionários 'categorias',
+        'status', 'bairros', 'datas' e 'prioridades'.
+        """
+        categorias, indices_categoria = codificar_dicionario(
+            (r['categoria__nome'], r['categoria__emoji']) for r in linhas
+        )
+        bairros, indices_bairro = codificar_dicionario(r['bairro'] for r in linhas)
+        datas, indices_data = codificar_dicionario(
+            timezone.localtime(r['criado_em']).strftime('%d/%m/%Y') for r in linhas
+        )
+        prioridades, indices_prioridade = codificar_dicionario(r['prioridade'] for r in linhas)
+
+        codigos_status = [codigo for codigo, _ in RelatoZeladoria.STATUS_CHOICES]
+        posicao_status = {codigo: i for i, codigo in enumerate(codigos_status)}
+
+        return {
+            "categorias": [{"nome": nome, "emoji": emoji} for nome, emoji in categorias],
+            "status": [legivel for _, legivel in RelatoZeladoria.STATUS_CHOICES],
+            "bairros": bairros,
+            "datas": datas,
+            "prioridades": prioridades,
+            "colunas": {
+                "id": [r['id'] for r in linhas],
+                "categoria": indices_categoria,
+                "status": [posicao_status.get(r['status_atual']) for r in linhas],
+                "bairro": indices_bairro,
+                "latitude": [round(r['latitude'], casas) if r['latitude'] is not None else None for r in linhas],
+                "longitude": [round(r['longitude'], casas) if r['longitude'] is not None else None for r in linhas],
+                "criado_em": indices_data,
+                "prioridade": indices_prioridade,
+            },
+        }
+
+    def clusters_em_colunas(self, clusters):
+        codigos_status = [codigo for codigo, _ in RelatoZeladoria.STATUS_CHOICES]
+        return {
+            "colunas": {
+                "latitude": [c['latitude'] for c in clusters],
+                "longitude": [c['longitude'] for c in clusters],
+                "total": [c['total'] for c in clusters],
+                "por_status": {
+                    codigo: [c['status'].get(codigo, 0) for c in clusters]
+                    for codigo in codigos_status
+                },
+            },
+        }
+
+    def agrupar_em_clusters(self, relatos, zoom, limite):
+        """
+        Agrupa os relatos em uma grade calculada no próprio banco: uma linha por
+        célula, com o total, o centro médio dos pontos e a contagem por status.
+        Retorna (clusters, truncado): no máximo 'limite' células, as mais cheias primeiro.
+        """
+        tamanho = tamanho_celula_cluster(zoom)
+        contagem_por_status = {
+            status: Count('id', filter=Q(status_atual=status))
+            for status, _ in RelatoZeladoria.STATUS_CHOICES
+        }
+        celulas = relatos.filter(geohash__isnull=False).annotate(
+            celula_x=Floor(F('longitude') / tamanho),
+            celula_y=Floor(F('latitude') / tamanho),
+        ).values('celula_x', 'celula_y').annotate(
+            total=Count('id'),
+            centro_lat=Avg('latitude'),
+            centro_lng=Avg('longitude'),
+            **contagem_por_status
+        ).order_by('-total')[:limite + 1]
+
+        celulas = list(celulas)
+        truncado = len(celulas) > limite
+        casas = casas_decimais_por_zoom(zoom)
+        clusters = []
+        for c in celulas[:limite]:
+            clusters.append({
+                "latitude": round(c['centro_lat'], casas),
+                "longitude": round(c['centro_lng'], casas),
+                "total": c['total'],
+                "status": {status: c[status] for status in contagem_por_status if c[status]},
+            })
+        return clusters, truncado
 
 @method_decorator(staff_member_required, name='dispatch')
 class DashboardAdminView(TemplateView):
     template_name = 'admin/dashboard_stats.html'
 
     def get_context_data(self, **kwargs):
-        from .utils import get_dashboard_stats
+        from .estatisticas import obter_estatisticas, filtros_da_requisicao
         context = super().get_context_data(**kwargs)
         
-        bairro_selecionado = self.request.GET.get('bairro', '')
+        # Filtros opcionais: bairro, data_inicio, data_fim, categoria
+        filtros = filtros_da_requisicao(self.request.GET)
         
-        # Obtém as estatísticas consolidadas via utilitário
-        stats = get_dashboard_stats(bairro_selecionado)
+        # Obtém as estatísticas consolidadas via motor de estatísticas
+        stats = obter_estatisticas(**filtros)
         context.update(stats)
         
         return context
 
+@method_decorator(staff_member_required, name='dispatch')
+class HeatmapDashboardView(View):
+    """
+    Pontos do mapa de calor do dashboard, carregados sob demanda pelo template.
+    Aceita os mesmos filtros do dashboard e 'precisao' (casas decimais, 1 a 6).
+    A resposta é um array JSON de [latitude, longitude, peso] transmitido em partes.
+    """
+
+    def get(self, request):
+        from .estatisticas import pontos_heatmap, filtros_da_requisicao
+
+        padrao = getattr(settings, 'HEATMAP_CASAS_DECIMAIS', 4)
+        try:
+            precisao = int(request.GET.get('precisao', padrao))
+        except ValueError:
+            precisao = padrao
+        precisao = max(1, min(precisao, 6))
+
+        pontos = pontos_heatmap(casas_decimais=precisao, **filtros_da_requisicao(request.GET))
+
+        def gerar_json():
+            yield '['
+            separador = ''
+            for lat, lng, peso in pontos:
+                yield f'{separador}[{lat},{lng},{peso}]'
+                separador = ','
+            yield ']'
+
+        return StreamingHttpResponse(gerar_json(), content_type='application/json')
+
+class DashboardTemposView(APIView):
+    """
+    Tempos (ms) das consultas do motor de estatísticas, para acompanhar a performance do dashboard.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    authentication_classes = [authentication.SessionAuthentication, authentication.TokenAuthentication]
+
+    def get(self, request):
+        from .estatisticas import resumo_tempos
+        return Response(resumo_tempos())
+
+class DashboardIAView(APIView):
+    """
+    Latência (p50/p95), taxa de erro e estado do disjuntor das chamadas ao Gemini neste processo.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    authentication_classes = [authentication.SessionAuthentication, authentication.TokenAuthentication]
+
+    def get(self, request):
+        from .ai_service import resumo_metricas_ia
+        return Response(resumo_metricas_ia())
+
 class ExportarRelatorioPDFView(APIView):
     """
     Gera um relatório PDF profissional para gestão pública.
@@ -236,9 +768,14 @@ class ExportarRelatorioPDFView(APIView):
     def get(self, request):
         try:
             # 1. Coleta de Dados
-            total = RelatoZeladoria.objects.count()
-            resolvidos = RelatoZeladoria.objects.filter(status_atual='resolvido').count()
-            pendentes = RelatoZeladoria.objects.filter(status_atual='recebido').count()
+            contagens = RelatoZeladoria.objects.aggregate(
+                total=Count('id'),
+                resolvidos=Count('id', filter=Q(status_atual='resolvido')),
+                pendentes=Count('id', filter=Q(status_atual='recebido')),
+            )
+            total = contagens['total']
+            resolvidos = contagens['resolvidos']
+            pendentes = contagens['pendentes']
             relatos_recentes = RelatoZeladoria.objects.select_related('categoria').order_by('-criado_em')[:20]
 
             # 2. Configuração do PDF
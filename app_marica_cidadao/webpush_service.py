@@ -1,58 +1,437 @@
 import json
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from py_vapid import Vapid
 from pywebpush import webpush, WebPushException
 from django.conf import settings
-from .models import WebPushSubscription
+from django.db import transaction, close_old_connections
+from django.db.models import F, Min
+from django.utils import timezone
+from .models import WebPushSubscription, MensagemPush, EntregaPush, AvisoBroadcast
+from .notificacoes import processar_notificacoes_pendentes, segundos_ate_proxima_notificacao
 
-def disparar_notificacao_push(user, title, message, url="/"):
+# Tempo que uma entrega fica reservada para um lote. Se o processo morrer no meio
+# do envio, a entrega volta para a fila depois disso.
+RESERVA_SEGUNDOS = 300
+
+# Espera máxima entre tentativas, qualquer que seja o número de falhas
+ESPERA_MAXIMA_SEGUNDOS = 3600
+
+# Validade do JWT VAPID assinado (o máximo aceito pelos serviços de push é 24 h)
+# e antecedência com que ele é renovado antes de vencer
+VALIDADE_VAPID_SEGUNDOS = 12 * 60 * 60
+MARGEM_RENOVACAO_VAPID_SEGUNDOS = 10 * 60
+
+# Envios feitos pelo backend 'fake' (WEBPUSH_BACKEND=fake), para testes e desenvolvimento
+entregas_fake = []
+
+
+class PushNaoConfigurado(Exception):
     """
-    Busca todas as inscrições ativas do usuário e envia a notificação via Push Service do Navegador.
+    Não há como enviar push (VAPID_PRIVATE_KEY ausente e backend diferente de 'fake').
     """
-    subscriptions = WebPushSubscription.objects.filter(user=user)
-    if not subscriptions.exists():
-        return False
-        
-    vapid_private_key = getattr(settings, 'VAPID_PRIVATE_KEY', None)
-    vapid_admin_email = getattr(settings, 'VAPID_ADMIN_EMAIL', 'mailto:admin@marica.rj.gov.br')
-    
-    if not vapid_private_key:
-        print("Erro: VAPID_PRIVATE_KEY não configurada. Impossível enviar push.")
-        return False
+    pass
+
+
+class EndpointRemovido(Exception):
+    """
+    O serviço de push respondeu 404/410: o cidadão removeu a permissão ou desinstalou o PWA.
+    """
+    pass
 
-    payload = json.dumps({
+
+def montar_payload(title, message, url="/"):
+    return json.dumps({
         "title": title,
         "body": message,
         "url": url,
         "icon": "/logo192.png", # Adapte se necessário
-        "badge": "/logo192.png" 
+        "badge": "/logo192.png"
     })
 
+
+def push_configurado():
+    if getattr(settings, 'WEBPUSH_BACKEND', 'pywebpush') == 'fake':
+        return True
+    if not getattr(settings, 'VAPID_PRIVATE_KEY', None):
+        print("Erro: VAPID_PRIVATE_KEY não configurada. Impossível enviar push.")
+        return False
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Conexões e cabeçalhos VAPID reaproveitados por origem do serviço de push
+# (ex.: https://fcm.googleapis.com, https://updates.push.services.mozilla.com)
+# ---------------------------------------------------------------------------
+
+_lock_http = threading.Lock()
+_sessoes = {}
+_cabecalhos_vapid = {}
+_vapid = None
+
+
+def origem_do_endpoint(endpoint):
+    url = urlparse(endpoint)
+    return f"{url.scheme}://{url.netloc}"
+
+
+def obter_sessao(origem):
+    """
+    Uma requests.Session por origem, com keep-alive: o handshake TLS acontece uma
+    vez por conexão do pool, e não a cada dispositivo notificado.
+    """
+    with _lock_http:
+        sessao = _sessoes.get(origem)
+        if sessao is None:
+            sessao = requests.Session()
+            adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=getattr(settings, 'WEBPUSH_WORKERS', 4))
+            sessao.mount('https://', adaptador)
+            sessao.mount('http://', adaptador)
+            _sessoes[origem] = sessao
+    return sessao
+
+
+def cabecalhos_vapid(origem):
+    """
+    Cabeçalhos VAPID (JWT assinado com 'aud' = origem) guardados até pouco antes
+    de expirar. A chave privada também é carregada uma única vez.
+    """
+    global _vapid
+    agora = time.time()
+    with _lock_http:
+        em_cache = _cabecalhos_vapid.get(origem)
+        if em_cache and em_cache[1] - MARGEM_RENOVACAO_VAPID_SEGUNDOS > agora:
+            return dict(em_cache[0])
+
+        if _vapid is None:
+            chave = settings.VAPID_PRIVATE_KEY
+            _vapid = Vapid.from_file(chave) if os.path.isfile(chave) else Vapid.from_string(private_key=chave)
+
+        expira_em = int(agora) + VALIDADE_VAPID_SEGUNDOS
+        cabecalhos = _vapid.sign({
+            "sub": getattr(settings, 'VAPID_ADMIN_EMAIL', 'mailto:admin@marica.rj.gov.br'),
+            "aud": origem,
+            "exp": expira_em,
+        })
+        _cabecalhos_vapid[origem] = (cabecalhos, expira_em)
+    return dict(cabecalhos)
+
+
+def descartar_cabecalhos_vapid(origem):
+    with _lock_http:
+        _cabecalhos_vapid.pop(origem, None)
+
+
+def enviar_para_inscricao(sub, payload):
+    """
+    Envia o payload para um dispositivo.
+    Levanta EndpointRemovido se a inscrição não existe mais e Exception para
+    falhas que valem uma nova tentativa.
+    """
+    if getattr(settings, 'WEBPUSH_BACKEND', 'pywebpush') == 'fake':
+        # Endpoints terminados em /gone e /falha simulam 410 e erro temporário
+        if sub.endpoint.endswith('/gone'):
+            raise EndpointRemovido("410 Gone (simulado)")
+        if sub.endpoint.endswith('/falha'):
+            raise RuntimeError("Falha temporária simulada do serviço de push")
+        entregas_fake.append({'endpoint': sub.endpoint, 'payload': json.loads(payload)})
+        return
+
+    sub_info = {
+        "endpoint": sub.endpoint,
+        "keys": {
+            "p256dh": sub.p256dh,
+            "auth": sub.auth
+        }
+    }
+    origem = origem_do_endpoint(sub.endpoint)
+    try:
+        # Sem vapid_claims o pywebpush não assina de novo: usa os cabeçalhos já prontos
+        webpush(
+            subscription_info=sub_info,
+            data=payload,
+            headers=cabecalhos_vapid(origem),
+            requests_session=obter_sessao(origem),
+            timeout=getattr(settings, 'WEBPUSH_TIMEOUT_SEGUNDOS', 10)
+        )
+    except WebPushException as ex:
+        # Response com erro é "falsa" em contexto booleano: compara com None
+        if ex.response is not None and ex.response.status_code in [404, 410]:
+            raise EndpointRemovido(repr(ex)) from ex
+        if ex.response is not None and ex.response.status_code in [401, 403]:
+            # JWT recusado (chave trocada, relógio adiantado): assina de novo na próxima tentativa
+            descartar_cabecalhos_vapid(origem)
+        raise
+
+
+def disparar_notificacao_push(user, title, message, url="/"):
+    """
+    Envia na hora, sem passar pela fila, para todas as inscrições do usuário.
+    Usado pelo script de teste manual (test_push.py); o sistema usa enfileirar_notificacao_push.
+    """
+    subscriptions = WebPushSubscription.objects.filter(user=user)
+    if not subscriptions.exists() or not push_configurado():
+        return False
+
+    payload = montar_payload(title, message, url)
     sucesso = False
     for sub in subscriptions:
         try:
-            sub_info = {
-                "endpoint": sub.endpoint,
-                "keys": {
-                    "p256dh": sub.p256dh,
-                    "auth": sub.auth
-                }
-            }
-            
-            webpush(
-                subscription_info=sub_info,
-                data=payload,
-                vapid_private_key=vapid_private_key,
-                vapid_claims={"sub": vapid_admin_email}
-            )
+            enviar_para_inscricao(sub, payload)
             sucesso = True
             print(f"Push enviado para o endpoint: {sub.endpoint[:30]}...")
-            
-        except WebPushException as ex:
-            print("WebPush Erro:", repr(ex))
-            # Se for um erro 410 (Gone), significa que o cidadão desinstalou o PWA ou removeu a permissão.
-            if ex.response and ex.response.status_code in [404, 410]:
-                print(f"Removendo inscrição inativa: {sub.endpoint[:30]}...")
-                sub.delete()
+        except EndpointRemovido:
+            print(f"Removendo inscrição inativa: {sub.endpoint[:30]}...")
+            sub.delete()
         except Exception as e:
             print(f"Erro inesperado ao enviar push: {str(e)}")
-            
+
     return sucesso
+
+
+def enfileirar_notificacao_push(user, title, message, url="/"):
+    """
+    Grava a mensagem e uma entrega por dispositivo do usuário e acorda o despachante
+    quando a transação atual for confirmada. Retorna a quantidade de entregas criadas.
+    """
+    inscricoes = list(WebPushSubscription.objects.filter(user=user).values_list('pk', flat=True))
+    if not inscricoes or not push_configurado():
+        return 0
+
+    mensagem = MensagemPush.objects.create(titulo=title, mensagem=message, url=url)
+    EntregaPush.objects.bulk_create([
+        EntregaPush(mensagem=mensagem, inscricao_id=inscricao_id) for inscricao_id in inscricoes
+    ])
+    transaction.on_commit(acordar_despachante)
+    return len(inscricoes)
+
+
+def disparar_aviso_broadcast(aviso, tamanho_bloco=2000):
+    """
+    Cria uma entrega por dispositivo do público do aviso. As inscrições são lidas
+    do banco em blocos (iterator) e gravadas com bulk_create do mesmo tamanho, então
+    a memória usada não depende do número de destinatários. O envio em si fica com
+    o despachante, com a concorrência de WEBPUSH_WORKERS.
+    O aviso fica 'enviando' até a fila esvaziar (concluir_avisos) e passa direto
+    para 'enviado' se o público não tem nenhum dispositivo.
+    Retorna o total de entregas, ou None se o aviso já tinha sido disparado.
+    Levanta PushNaoConfigurado sem mexer no aviso, que continua como rascunho.
+    """
+    if not push_configurado():
+        raise PushNaoConfigurado("Push não configurado (VAPID_PRIVATE_KEY ausente). O aviso não foi enviado.")
+
+    with transaction.atomic():
+        # Troca condicional de status: dois cliques no admin não disparam duas vezes
+        if not AvisoBroadcast.objects.filter(pk=aviso.pk, status='rascunho').update(status='enviando'):
+            return None
+
+        mensagem = MensagemPush.objects.create(titulo=aviso.titulo, mensagem=aviso.mensagem, url=aviso.url)
+        total = 0
+        bloco = []
+        for inscricao_id in aviso.inscricoes_alvo().values_list('pk', flat=True).iterator(chunk_size=tamanho_bloco):
+            bloco.append(EntregaPush(mensagem=mensagem, inscricao_id=inscricao_id, em_massa=True))
+            if len(bloco) >= tamanho_bloco:
+                EntregaPush.objects.bulk_create(bloco)
+                total += len(bloco)
+                bloco = []
+        if bloco:
+            EntregaPush.objects.bulk_create(bloco)
+            total += len(bloco)
+
+        aviso.status = 'enviando' if total else 'enviado'
+        aviso.mensagem_push = mensagem
+        aviso.total_dispositivos = total
+        aviso.disparado_em = timezone.now()
+        aviso.save(update_fields=['status', 'mensagem_push', 'total_dispositivos', 'disparado_em'])
+        transaction.on_commit(acordar_despachante)
+
+    print(f"Aviso '{aviso.titulo}' enfileirado para {total} dispositivos.")
+    return total
+
+
+def concluir_avisos():
+    """
+    Avisos 'enviando' que não têm mais entregas na fila (todas enviadas ou que
+    desistiram) passam para 'enviado'. Chamado pelo despachante após cada lote em massa.
+    """
+    return AvisoBroadcast.objects.filter(status='enviando').exclude(
+        mensagem_push__entregas__status__in=['pendente', 'enviando']
+    ).update(status='enviado')
+
+
+# ---------------------------------------------------------------------------
+# Despachante: drena a fila de EntregaPush em segundo plano
+# ---------------------------------------------------------------------------
+
+_executor = None
+_despachante = None
+_lock = threading.Lock()
+
+
+def obter_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'WEBPUSH_WORKERS', 4), thread_name_prefix='webpush'
+            )
+    return _executor
+
+
+def espera_para_tentativa(tentativas):
+    """
+    Espera exponencial (base, 2x, 4x, ...) com variação de 20% para não sincronizar as novas tentativas.
+    """
+    espera = getattr(settings, 'WEBPUSH_ESPERA_BASE_SEGUNDOS', 30) * 2 ** max(0, tentativas - 1)
+    return min(ESPERA_MAXIMA_SEGUNDOS, espera) * random.uniform(0.8, 1.2)
+
+
+def reservar_lote(tamanho):
+    """
+    Marca até 'tamanho' entregas vencidas com um código de reserva próprio.
+    O UPDATE repete as condições da busca, então uma entrega já reservada por
+    outro processo (gunicorn ou processar_fila_push) não é pega de novo.
+    """
+    agora = timezone.now()
+    vencidas = EntregaPush.objects.filter(status__in=['pendente', 'enviando'], proxima_tentativa__lte=agora)
+
+    # Notificações individuais (mudança de status) passam na frente dos avisos em massa
+    ids = []
+    for em_massa in (False, True):
+        if len(ids) < tamanho:
+            ids += vencidas.filter(em_massa=em_massa).order_by('proxima_tentativa').values_list(
+                'pk', flat=True
+            )[:tamanho - len(ids)]
+    if not ids:
+        return []
+
+    reserva = uuid.uuid4().hex
+    vencidas.filter(pk__in=ids).update(
+        status='enviando',
+        reserva=reserva,
+        tentativas=F('tentativas') + 1,
+        proxima_tentativa=agora + timedelta(seconds=RESERVA_SEGUNDOS),
+    )
+    return list(EntregaPush.objects.filter(reserva=reserva).select_related('mensagem', 'inscricao'))
+
+
+def entregar(entrega, payload):
+    """
+    Executado nas threads do pool (só rede, sem banco). Retorna (resultado, erro).
+    """
+    try:
+        enviar_para_inscricao(entrega.inscricao, payload)
+        return 'enviada', ''
+    except EndpointRemovido as e:
+        return 'removida', str(e)
+    except Exception as e:
+        return 'erro', str(e) or repr(e)
+
+
+def processar_fila_push():
+    """
+    Envia todas as entregas vencidas, um lote de WEBPUSH_LOTE por vez, em paralelo.
+    Retorna quantas entregas foram tentadas.
+    """
+    executor = obter_executor()
+    max_tentativas = getattr(settings, 'WEBPUSH_MAX_TENTATIVAS', 5)
+    total = 0
+
+    while True:
+        lote = reservar_lote(getattr(settings, 'WEBPUSH_LOTE', 100))
+        if not lote:
+            return total
+        total += len(lote)
+
+        payloads = {}
+        for entrega in lote:
+            if entrega.mensagem_id not in payloads:
+                payloads[entrega.mensagem_id] = montar_payload(
+                    entrega.mensagem.titulo, entrega.mensagem.mensagem, entrega.mensagem.url
+                )
+        resultados = executor.map(lambda entrega: entregar(entrega, payloads[entrega.mensagem_id]), lote)
+
+        enviadas, removidas = [], []
+        for entrega, (resultado, erro) in zip(lote, resultados):
+            if resultado == 'enviada':
+                enviadas.append(entrega.pk)
+            elif resultado == 'removida':
+                print(f"Removendo inscrição inativa: {entrega.inscricao.endpoint[:30]}...")
+                removidas.append(entrega.inscricao_id)
+            elif entrega.tentativas >= max_tentativas:
+                print(f"WebPush Erro (desistindo após {entrega.tentativas} tentativas): {erro}")
+                EntregaPush.objects.filter(pk=entrega.pk).update(status='falhou', ultimo_erro=erro)
+            else:
+                EntregaPush.objects.filter(pk=entrega.pk).update(
+                    status='pendente',
+                    ultimo_erro=erro,
+                    proxima_tentativa=timezone.now() + timedelta(seconds=espera_para_tentativa(entrega.tentativas)),
+                )
+
+        if enviadas:
+            EntregaPush.objects.filter(pk__in=enviadas).update(
+                status='enviada', enviada_em=timezone.now(), ultimo_erro=''
+            )
+        if removidas:
+            # Apaga também as entregas pendentes desses dispositivos (CASCADE)
+            WebPushSubscription.objects.filter(pk__in=removidas).delete()
+        if any(entrega.em_massa for entrega in lote):
+            concluir_avisos()
+
+
+def segundos_ate_proxima_entrega(maximo=60):
+    proxima = EntregaPush.objects.filter(status__in=['pendente', 'enviando']).aggregate(
+        proxima=Min('proxima_tentativa')
+    )['proxima']
+    if proxima is None:
+        return maximo
+    return min(maximo, max(0.0, (proxima - timezone.now()).total_seconds()))
+
+
+class DespachantePush(threading.Thread):
+    """
+    Thread do próprio processo web que distribui as notificações de status cuja
+    janela venceu e drena a fila de push. Dorme até a próxima entrega ou notificação
+    agendada ou até ser acordada por uma nova mensagem.
+    """
+    def __init__(self):
+        super().__init__(name='despachante-push', daemon=True)
+        self.acordar = threading.Event()
+
+    def run(self):
+        while True:
+            self.acordar.clear()
+            try:
+                # Primeiro as notificações: o push que elas enfileiram sai nesta mesma rodada
+                processar_notificacoes_pendentes()
+                processar_fila_push()
+                espera = min(segundos_ate_proxima_entrega(), segundos_ate_proxima_notificacao())
+            except Exception as e:
+                print(f"Erro no despachante de push: {e}")
+                espera = 30
+            finally:
+                close_old_connections()
+            self.acordar.wait(espera)
+
+
+def acordar_despachante():
+    """
+    Inicia (na primeira vez) e acorda o despachante embutido.
+    Com WEBPUSH_DESPACHANTE_EMBUTIDO=False a fila fica por conta do comando processar_fila_push.
+    """
+    global _despachante
+    if not getattr(settings, 'WEBPUSH_DESPACHANTE_EMBUTIDO', True):
+        return
+    with _lock:
+        if _despachante is None or not _despachante.is_alive():
+            _despachante = DespachantePush()
+            _despachante.start()
+    _despachante.acordar.set()
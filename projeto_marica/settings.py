@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
-from decouple import config
+from decouple import config, Csv
 import dj_database_url
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -32,6 +32,19 @@ VAPID_PUBLIC_KEY = config('VAPID_PUBLIC_KEY', default='')
 VAPID_PRIVATE_KEY = config('VAPID_PRIVATE_KEY', default='')
 VAPID_ADMIN_EMAIL = config('VAPID_ADMIN_EMAIL', default='mailto:admin@marica.rj.gov.br')
 
+# Fila de notificações push (EntregaPush)
+WEBPUSH_BACKEND = config('WEBPUSH_BACKEND', default='pywebpush')  # 'fake' não faz chamadas HTTP (testes)
+WEBPUSH_DESPACHANTE_EMBUTIDO = config('WEBPUSH_DESPACHANTE_EMBUTIDO', default=True, cast=bool)  # False: use o comando processar_fila_push
+WEBPUSH_WORKERS = config('WEBPUSH_WORKERS', default=4, cast=int)  # Envios simultâneos
+WEBPUSH_LOTE = config('WEBPUSH_LOTE', default=100, cast=int)
+WEBPUSH_TIMEOUT_SEGUNDOS = config('WEBPUSH_TIMEOUT_SEGUNDOS', default=10, cast=float)
+WEBPUSH_MAX_TENTATIVAS = config('WEBPUSH_MAX_TENTATIVAS', default=5, cast=int)
+WEBPUSH_ESPERA_BASE_SEGUNDOS = config('WEBPUSH_ESPERA_BASE_SEGUNDOS', default=30, cast=int)  # Dobra a cada falha
+
+# Notificações de mudança de status do relato (app_marica_cidadao/notificacoes.py)
+NOTIFICACOES_CANAIS = config('NOTIFICACOES_CANAIS', default='push,whatsapp', cast=Csv())  # 'push', 'whatsapp' (simulado)
+NOTIFICACOES_JANELA_SEGUNDOS = config('NOTIFICACOES_JANELA_SEGUNDOS', default=15, cast=int)  # Mudanças seguidas do mesmo relato viram uma só notificação (0 envia na hora)
+
 ALLOWED_HOSTS = ['*', 'maricacidadao.duckdns.org']  # Permite acesso via qualquer IP e pelo novo domínio DuckDNS
 
 # Configurações de CORS
@@ -114,6 +127,22 @@ DATABASES = {
 }
 
 
+# Cache (dashboard administrativo). Em memória local por padrão. A invalidação não
+# depende do backend: a versão dos dados fica no banco (VersaoDados 'dashboard'),
+# então todos os workers param de usar a entrada antiga na próxima leitura. Com
+# vários workers do gunicorn um backend compartilhado (Redis/Memcached) só evita
+# que cada processo recalcule a mesma entrada, ex.:
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache e CACHE_LOCATION=redis://127.0.0.1:6379/1
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='marica-cidadao'),
+    }
+}
+DASHBOARD_CACHE_SEGUNDOS = config('DASHBOARD_CACHE_SEGUNDOS', default=300, cast=int)
+HEATMAP_CASAS_DECIMAIS = config('HEATMAP_CASAS_DECIMAIS', default=4, cast=int)  # 4 casas ~ 11 m
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -218,6 +247,28 @@ SPECTACULAR_SETTINGS = {
     'SERVE_INCLUDE_SCHEMA': False,
 }
 
+# Mapa público de transparência
+MAPA_PUBLICO_LIMITE_MAXIMO = config('MAPA_PUBLICO_LIMITE_MAXIMO', default=500, cast=int)
+MAPA_ZOOM_MINIMO_PONTOS = config('MAPA_ZOOM_MINIMO_PONTOS', default=14, cast=int)  # Abaixo disso o mapa recebe clusters
+
+# Detecção de relatos duplicados (mesma categoria, mesmo local, ainda abertos)
+DUPLICIDADE_RAIO_METROS = config('DUPLICIDADE_RAIO_METROS', default=30, cast=int)
+DUPLICIDADE_JANELA_DIAS = config('DUPLICIDADE_JANELA_DIAS', default=30, cast=int)
+
+# Triagem de fotos pela IA em segundo plano
+IA_BACKEND = config('IA_BACKEND', default='gemini')  # 'stub' usa um modelo local, sem chamar a API
+IA_TRIAGEM_WORKERS = config('IA_TRIAGEM_WORKERS', default=2, cast=int)  # Chamadas simultâneas ao modelo por processo
+IA_TRIAGEM_FILA_MAXIMA = config('IA_TRIAGEM_FILA_MAXIMA', default=20, cast=int)  # Acima disso a API responde 503
+IA_TRIAGEM_EXPIRACAO_SEGUNDOS = config('IA_TRIAGEM_EXPIRACAO_SEGUNDOS', default=300, cast=int)
+IA_STUB_ATRASO_SEGUNDOS = config('IA_STUB_ATRASO_SEGUNDOS', default=0, cast=float)
+IA_TEMPO_LIMITE_SEGUNDOS = config('IA_TEMPO_LIMITE_SEGUNDOS', default=15, cast=float)  # Orçamento de cada chamada ao Gemini
+IA_DISJUNTOR_FALHAS = config('IA_DISJUNTOR_FALHAS', default=5, cast=int)  # Falhas seguidas que abrem o disjuntor
+IA_DISJUNTOR_SEGUNDOS = config('IA_DISJUNTOR_SEGUNDOS', default=60, cast=int)  # Tempo aberto antes de testar de novo
+IA_IMAGEM_MAX_LADO = config('IA_IMAGEM_MAX_LADO', default=1024, cast=int)  # Maior lado (px) da imagem enviada ao modelo
+IA_IMAGEM_QUALIDADE = config('IA_IMAGEM_QUALIDADE', default=80, cast=int)  # Qualidade JPEG da imagem reduzida
+IA_CACHE_DIAS = config('IA_CACHE_DIAS', default=30, cast=int)  # Validade do cache de resultados por imagem (0 desliga)
+IA_CACHE_MAX_ENTRADAS = config('IA_CACHE_MAX_ENTRADAS', default=5000, cast=int)  # Acima disso remove as menos usadas
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -40,13 +40,12 @@ admin.site.index_template = "admin/custom_index.html"
 # Sobrescrita da View de Index do Admin para injetar o contexto do Dashboard Premium
 def custom_admin_index(request, extra_context=None):
     from django.contrib.admin.sites import site
-    from app_marica_cidadao.utils import get_dashboard_stats
+    from app_marica_cidadao.estatisticas import obter_estatisticas, filtros_da_requisicao
     
     extra_context = extra_context or {}
-    bairro_selecionado = request.GET.get('bairro', '')
     
-    # Obtém as estatísticas consolidadas via utilitário
-    stats = get_dashboard_stats(bairro_selecionado)
+    # Obtém as estatísticas consolidadas via motor de estatísticas
+    stats = obter_estatisticas(**filtros_da_requisicao(request.GET))
     extra_context.update(stats)
 
     return site.index(request, extra_context=extra_context)